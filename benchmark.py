@@ -0,0 +1,1191 @@
+import io
+import os
+import sys
+import json
+import glob
+import argparse
+import platform
+import copy
+import subprocess
+import tracemalloc
+import tempfile
+import time
+import math
+import random
+from collections import deque
+
+# Benchmarks run without opening a window, and without pygame's greeting so the suite's JSON can be piped
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+import numpy as np
+import torch
+
+pygame.init()
+
+from config import TRACKS_PATH, TRAINING_TIMESTEP, RED_CAR_IMAGE, BLUE_CAR_IMAGE, ROTATION_RESOLUTION, NETWORK_INPUT_SIZE, NETWORK_ACTION_SIZE, MODELS_PATH, BATCH_SIZE, EXPERIENCE_CAPACITY, TRACK_WIDTH, TRACK_HEIGHT, SCREEN_WIDTH, SCREEN_HEIGHT, BACKGROUND_COLOUR, FPS, COLOUR_SCHEME, BUTTON_BORDER_THICKNESS
+from environment import VectorEnvironment
+from cars import Car, CarAgent, RotationCache, getAgentStates, selectAgentActions, updateCarProgresses
+from gui import Minimap, TrackOverview
+from model import ExperienceMemory, PrioritisedExperienceMemory, NeuralNetwork, DQNTrainer, InferenceEngine, scriptPolicy, quantisePolicy, getNumpyNetwork
+import modelNumpy
+import instrumentation
+from track import Track
+
+def check(passed, message):
+    # Benchmarks that also check results stop with a non-zero exit status when a check fails
+    if not passed:
+        sys.exit(f"Check failed: {message}")
+
+def loadTrack(trackName):
+    track = Track(trackName)
+
+    startTime = time.perf_counter()
+    track.initialiseTrack()
+    print(f"Initialised {trackName} in {time.perf_counter() - startTime:.3f}s")
+
+    return track
+
+def getTestAgents(track, count, seed=0):
+    # Agents placed on random points of the centre line facing random directions
+    randomGenerator = random.Random(seed)
+    centrePoints = track.curvePoints.tolist()
+
+    agents = []
+    for _ in range(count):
+        point = randomGenerator.choice(centrePoints)
+        agents.append(CarAgent(point[0], point[1], randomGenerator.uniform(0, 360), RED_CAR_IMAGE, track, None, False))
+
+    return agents
+
+def legacyGetDistances(agent):
+    # The original sensor implementation which marched along each sensor every 10 pixels
+    distances = []
+
+    for sensor in agent.sensors:
+        sensorAngle = math.radians(agent.direction + sensor)
+        directionVector = pygame.Vector2(math.cos(sensorAngle), math.sin(sensorAngle))
+
+        sensorDistance = agent.maxDistance
+        for distance in range(0, agent.maxDistance, 10):
+            position = agent.imageRect.center + directionVector * distance
+
+            if agent.track.checkCollideAtPoint(position):
+                sensorDistance = distance
+                break
+
+        distances.append(sensorDistance / agent.maxDistance)
+
+    return distances
+
+def bruteForceGetDistances(agent):
+    # Marching along each sensor one pixel at a time, which finds exactly where the ray first reaches a wall pixel
+    width, height = agent.track.mask.get_size()
+    centreX, centreY = agent.imageRect.center
+    distances = []
+
+    for sensor in agent.sensors:
+        sensorAngle = math.radians(agent.direction + sensor)
+        directionX = math.cos(sensorAngle)
+        directionY = math.sin(sensorAngle)
+
+        sensorDistance = agent.maxDistance
+        for distance in range(agent.maxDistance):
+            x = int(centreX + directionX * distance)
+            y = int(centreY + directionY * distance)
+
+            if x < 0 or y < 0 or x >= width or y >= height or agent.track.checkCollideAtPoint((x, y)):
+                sensorDistance = distance
+                break
+
+        distances.append(sensorDistance / agent.maxDistance)
+
+    return distances
+
+def timeRays(getDistances, agents, repeats):
+    startTime = time.perf_counter()
+    for _ in range(repeats):
+        for agent in agents:
+            getDistances(agent)
+    elapsedTime = time.perf_counter() - startTime
+
+    rays = repeats * len(agents) * len(agents[0].sensors)
+    return rays / elapsedTime
+
+def checkSensors(track, agentCount=200, maxDifference=1):
+    # Sensors must agree with marching every pixel, apart from stepping short of the wall by up to a pixel, including where the road reaches the edge of the track
+    largestDifference = 0
+    for agent in getTestAgents(track, agentCount):
+        for bruteForceDistance, distance in zip(bruteForceGetDistances(agent), agent.getDistances()):
+            largestDifference = max(largestDifference, abs(bruteForceDistance - distance) * agent.maxDistance)
+
+    print(f"{track.getFilePath()}: largest difference from marching every pixel {largestDifference:.0f}px")
+    check(largestDifference <= maxDifference, f"distance field sensors on {track.getFilePath()} differ from marching every pixel by {largestDifference:.0f}px")
+
+def benchmarkRaycasts(trackName="squigly", agentCount=200, repeats=10):
+    track = loadTrack(trackName)
+    agents = getTestAgents(track, agentCount)
+
+    legacyRate = timeRays(legacyGetDistances, agents, repeats)
+    distanceFieldRate = timeRays(CarAgent.getDistances, agents, repeats)
+
+    print(f"Marching sensors:       {legacyRate:,.0f} rays/s")
+    print(f"Distance field sensors: {distanceFieldRate:,.0f} rays/s ({distanceFieldRate / legacyRate:.1f}x)")
+
+    for trackName in ["squigly", "straightTrack", "straightTrackasds"]:
+        checkSensors(loadTrack(trackName))
+
+def benchmarkRotationCache(resolutions=(1, 0.5), repeats=2000):
+    for resolution in resolutions:
+        totalTime = 0
+        totalBytes = 0
+
+        for image in [RED_CAR_IMAGE, BLUE_CAR_IMAGE]:
+            startTime = time.perf_counter()
+            rotationCache = RotationCache(image, resolution)
+            totalTime += time.perf_counter() - startTime
+            totalBytes += rotationCache.getMemoryUsage()
+
+        print(f"{resolution} degree rotation caches: built in {totalTime:.3f}s using {totalBytes / 1024 ** 2:.1f}MB")
+
+    # Cost of finding the rotated image and mask for one turning step
+    directions = [random.uniform(0, 360) for _ in range(repeats)]
+
+    startTime = time.perf_counter()
+    for direction in directions:
+        rotatedImage = pygame.transform.rotate(RED_CAR_IMAGE, -direction)
+        pygame.mask.from_surface(rotatedImage)
+    rotateTime = (time.perf_counter() - startTime) / repeats
+
+    rotationCache = RotationCache(RED_CAR_IMAGE, ROTATION_RESOLUTION)
+    startTime = time.perf_counter()
+    for direction in directions:
+        rotationCache.getRotation(direction)
+    cacheTime = (time.perf_counter() - startTime) / repeats
+
+    print(f"Rotating every step: {rotateTime * 1e6:.1f}us per turn")
+    print(f"Rotation cache:      {cacheTime * 1e6:.1f}us per turn")
+
+def getResidentMemory():
+    # Resident memory of this process in bytes, only available on Linux
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return None
+
+def legacySampleBatch(memory, device):
+    # The original deque of tuples and the batch building code from DQNTrainer.updateModel
+    states, actions, nextStates, rewards = zip(*random.sample(memory, BATCH_SIZE))
+
+    states = torch.cat(states)
+    actions = torch.cat(actions)
+    rewards = torch.cat(rewards)
+
+    nonFinalMask = torch.tensor([state is not None for state in nextStates], device=device, dtype=torch.bool)
+    nextStates = torch.cat([state for state in nextStates if state is not None])
+
+    return states, actions, rewards, nextStates, nonFinalMask
+
+def benchmarkExperienceMemory(capacities=(10_000, 1_000_000), repeats=1000):
+    device = torch.device("cpu")
+    checkPrioritisedSampling(capacities[0])
+
+    for capacity in capacities:
+        memoryBefore = getResidentMemory()
+        legacyMemory = deque([], maxlen=capacity)
+        for index in range(capacity):
+            state = torch.rand(1, NETWORK_INPUT_SIZE)
+            nextState = None if index % 10 == 0 else torch.rand(1, NETWORK_INPUT_SIZE)
+            legacyMemory.append((state, torch.tensor([index % NETWORK_ACTION_SIZE]), nextState, torch.tensor([0.1])))
+        memoryAfter = getResidentMemory()
+
+        startTime = time.perf_counter()
+        for _ in range(repeats):
+            legacySampleBatch(legacyMemory, device)
+        legacyTime = (time.perf_counter() - startTime) / repeats
+
+        del legacyMemory
+
+        memory = ExperienceMemory(capacity, device)
+        fillMemory(memory, capacity)
+
+        startTime = time.perf_counter()
+        for _ in range(repeats):
+            memory.getBatch(BATCH_SIZE)
+        ringTime = (time.perf_counter() - startTime) / repeats
+
+        ringBytes = memory.memory.element_size() * memory.memory.shape[1]
+
+        del memory
+
+        # Prioritised sampling includes updating the priorities of the sampled batch
+        prioritisedMemory = PrioritisedExperienceMemory(capacity, device)
+        fillMemory(prioritisedMemory, capacity)
+
+        startTime = time.perf_counter()
+        for _ in range(repeats):
+            batch = prioritisedMemory.getBatch(BATCH_SIZE)
+            prioritisedMemory.updatePriorities(batch[-2], torch.rand(BATCH_SIZE))
+        prioritisedTime = (time.perf_counter() - startTime) / repeats
+
+        del prioritisedMemory
+
+        print(f"Capacity {capacity:,}:")
+        if memoryBefore is not None:
+            print(f"  Deque memory:       {(memoryAfter - memoryBefore) / capacity:.0f} bytes per experience, {legacyTime * 1e6:.0f}us per batch")
+        else:
+            print(f"  Deque memory:       {legacyTime * 1e6:.0f}us per batch")
+        print(f"  Ring buffer memory: {ringBytes} bytes per experience, {ringTime * 1e6:.0f}us per batch")
+        print(f"  Prioritised memory: {prioritisedTime * 1e6:.0f}us per batch and priority update")
+
+def fillMemory(memory, count):
+    memory.addExperiences(
+        torch.rand(count, NETWORK_INPUT_SIZE).numpy(),
+        torch.randint(0, NETWORK_ACTION_SIZE, (count,)).numpy(),
+        torch.rand(count, NETWORK_INPUT_SIZE).numpy(),
+        torch.rand(count).numpy(),
+        (torch.rand(count) < 0.1).numpy(),
+    )
+
+def checkPrioritisedSampling(capacity, count=100):
+    # A partly filled memory must only sample experiences it holds, even for values right at the end of the total priority
+    memory = PrioritisedExperienceMemory(capacity, torch.device("cpu"))
+    fillMemory(memory, count)
+
+    indices = memory.priorities.find(np.full(BATCH_SIZE, memory.priorities.getTotal()), memory.getSize())
+    check((indices < count).all(), f"sampled experience {indices.max()} from a memory holding {count}")
+    check((memory.priorities.getValues(indices) > 0).all(), "sampled an experience with no priority")
+
+class BenchmarkGame:
+    # The parts of Game that DQNTrainer needs, without a window
+    def __init__(self, track=None):
+        self.track = track
+        self.device = torch.device("cpu")
+        self.running = True
+
+def legacySoftUpdate(policyNet, targetNet, strength):
+    # The original state_dict based soft update
+    targetNetStateDict = targetNet.state_dict()
+    policyNetStateDict = policyNet.state_dict()
+
+    for key in policyNetStateDict:
+        targetNetStateDict[key] = policyNetStateDict[key] * strength + targetNetStateDict[key] * (1.0 - strength)
+
+    targetNet.load_state_dict(targetNetStateDict)
+
+def benchmarkTargetUpdate(repeats=5000):
+    learner = DQNTrainer(BenchmarkGame(), "torch").learner
+
+    startTime = time.perf_counter()
+    for _ in range(repeats):
+        legacySoftUpdate(learner.policyNet, learner.targetNet, 0.1)
+    legacyTime = (time.perf_counter() - startTime) / repeats
+
+    startTime = time.perf_counter()
+    for _ in range(repeats):
+        learner.softUpdateTargetNetwork()
+    inPlaceTime = (time.perf_counter() - startTime) / repeats
+
+    print(f"state_dict soft update: {legacyTime * 1e6:.1f}us per step")
+    print(f"In place soft update:   {inPlaceTime * 1e6:.1f}us per step")
+
+def getLearners():
+    # A learner for each backend, starting from the same weights and the same experiences
+    torchLearner = DQNTrainer(BenchmarkGame(), "torch").learner
+    numpyLearner = DQNTrainer(BenchmarkGame(), "numpy").learner
+    numpyLearner.loadPolicyWeights(*torchLearner.getPolicyWeights())
+
+    return {"Torch": torchLearner, "NumPy": numpyLearner}
+
+def getRandomBatch(randomGenerator, batchSize):
+    return (
+        randomGenerator.random((batchSize, NETWORK_INPUT_SIZE), dtype=np.float32),
+        randomGenerator.integers(0, NETWORK_ACTION_SIZE, batchSize),
+        randomGenerator.normal(size=batchSize).astype(np.float32),
+        randomGenerator.random((batchSize, NETWORK_INPUT_SIZE), dtype=np.float32),
+        randomGenerator.random(batchSize) < 0.1,
+    )
+
+def getLargestDifference(arrays, otherArrays):
+    return max(np.abs(array - otherArray).max() for array, otherArray in zip(arrays, otherArrays))
+
+def benchmarkLearnerParity(batchSizes=(1, 32, 128), steps=20, seed=0, tolerance=1e-6):
+    # Both learners should give the same Q-Values and gradients for the same weights, and stay together while they learn
+    # Both work in float32, so anything more than rounding apart (tolerance) means one of them is wrong
+    randomGenerator = np.random.default_rng(seed)
+    torchLearner, numpyLearner = getLearners().values()
+
+    for batchSize in batchSizes:
+        batch = getRandomBatch(randomGenerator, batchSize)
+
+        qValueDifference = np.abs(torchLearner.getQValues(batch[0]) - numpyLearner.getQValues(batch[0])).max()
+
+        torchWeightGradients, torchBiasGradients = torchLearner.getGradients(*batch)
+        numpyWeightGradients, numpyBiasGradients = numpyLearner.getGradients(*batch)
+        gradientDifference = max(getLargestDifference(torchWeightGradients, numpyWeightGradients), getLargestDifference(torchBiasGradients, numpyBiasGradients))
+        gradientScale = max(np.abs(gradients).max() for gradients in torchWeightGradients + torchBiasGradients)
+
+        print(f"Batch of {batchSize}: largest Q-Value difference {qValueDifference:.2e}, largest gradient difference {gradientDifference:.2e} (largest gradient {gradientScale:.2e})")
+        check(qValueDifference <= tolerance, f"Q-Values for a batch of {batchSize} differ by {qValueDifference:.2e}, more than {tolerance:.0e}")
+        check(gradientDifference <= tolerance, f"gradients for a batch of {batchSize} differ by {gradientDifference:.2e}, more than {tolerance:.0e}")
+
+    for _ in range(steps):
+        batch = getRandomBatch(randomGenerator, BATCH_SIZE)
+
+        torchLearner.learnFromBatch(*(torch.from_numpy(array) for array in batch))
+        torchLearner.softUpdateTargetNetwork()
+        numpyLearner.learnFromBatch(*batch)
+        numpyLearner.softUpdateTargetNetwork()
+
+    torchWeights, torchBiases = torchLearner.getPolicyWeights()
+    parameterDifference = max(getLargestDifference(torchWeights, numpyLearner.policyNet.weights), getLargestDifference(torchBiases, numpyLearner.policyNet.biases))
+    print(f"After {steps} updates: largest parameter difference {parameterDifference:.2e}")
+    check(parameterDifference <= tolerance, f"parameters after {steps} updates differ by {parameterDifference:.2e}, more than {tolerance:.0e}")
+
+def benchmarkLearners(experienceCount=10_000, repeats=500, seed=0):
+    learners = getLearners()
+
+    batch = getRandomBatch(np.random.default_rng(seed), experienceCount)
+    for learner in learners.values():
+        learner.memory.addExperiences(batch[0], batch[1], batch[3], batch[2], batch[4])
+
+    timings = {}
+    for name, learner in learners.items():
+        learner.updateModel()
+
+        startTime = time.perf_counter()
+        for _ in range(repeats):
+            learner.updateModel()
+            learner.softUpdateTargetNetwork()
+        timings[name] = (time.perf_counter() - startTime) / repeats
+
+    # Memory allocated by a warmed up NumPy step, which should only be small Python objects and ufunc buffers
+    tracemalloc.start()
+    learners["NumPy"].updateModel()
+    learners["NumPy"].softUpdateTargetNetwork()
+    allocatedBytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    print(f"Torch AdamW update: {timings['Torch'] * 1e6:.0f}us per step")
+    print(f"NumPy Adam update:  {timings['NumPy'] * 1e6:.0f}us per step ({timings['Torch'] / timings['NumPy']:.1f}x), peak {allocatedBytes} bytes allocated per step")
+
+def benchmarkCheckpoint(capacities=(10_000, 1_000_000)):
+    for capacity in capacities:
+        with tempfile.TemporaryDirectory() as checkpointPath:
+            # A full memory saved the old way, by serialising the whole tensor
+            memory = ExperienceMemory(capacity, torch.device("cpu"))
+            fillMemory(memory, capacity)
+
+            startTime = time.perf_counter()
+            torch.save(memory.memory, f"{checkpointPath}/serialised.pt")
+            serialisedSaveTime = time.perf_counter() - startTime
+
+            startTime = time.perf_counter()
+            torch.load(f"{checkpointPath}/serialised.pt")
+            serialisedLoadTime = time.perf_counter() - startTime
+
+            # The same memory kept in a memory-mapped file, where saving flushes it and resuming maps it again
+            memory = ExperienceMemory(capacity, torch.device("cpu"), checkpointPath)
+            fillMemory(memory, capacity)
+
+            startTime = time.perf_counter()
+            state = memory.getState()
+            mappedSaveTime = time.perf_counter() - startTime
+
+            startTime = time.perf_counter()
+            ExperienceMemory(capacity, torch.device("cpu"), checkpointPath, True).loadState(state)
+            mappedLoadTime = time.perf_counter() - startTime
+
+        print(f"{capacity} experiences:")
+        print(f"  Serialised:      {serialisedSaveTime * 1000:.1f}ms to save, {serialisedLoadTime * 1000:.1f}ms to load")
+        print(f"  Memory-mapped:   {mappedSaveTime * 1000:.1f}ms to save, {mappedLoadTime * 1000:.1f}ms to load")
+
+    # A whole trainer saved and resumed with each learner
+    for backend in ["torch", "numpy"]:
+        with tempfile.TemporaryDirectory() as checkpointPath:
+            trainer = DQNTrainer(BenchmarkGame(), backend, checkpointPath)
+            batch = getRandomBatch(np.random.default_rng(0), EXPERIENCE_CAPACITY)
+            trainer.memory.addExperiences(batch[0], batch[1], batch[3], batch[2], batch[4])
+            trainer.learner.updateModel()
+
+            startTime = time.perf_counter()
+            trainer.saveCheckpoint()
+            saveTime = time.perf_counter() - startTime
+
+            startTime = time.perf_counter()
+            resumedTrainer = DQNTrainer(BenchmarkGame(), backend, checkpointPath, True)
+            resumeTime = time.perf_counter() - startTime
+
+            parameterDifference = getLargestDifference(trainer.learner.getPolicyWeights()[0], resumedTrainer.learner.getPolicyWeights()[0])
+
+        print(f"{backend} trainer: {saveTime * 1000:.1f}ms to save, {resumeTime * 1000:.1f}ms to resume, largest parameter difference {parameterDifference}")
+
+def getRoadArray(drawFunction):
+    # Boolean array of the pixels covered by the road and the time taken to draw it
+    surface = pygame.Surface((TRACK_WIDTH, TRACK_HEIGHT), pygame.SRCALPHA)
+
+    startTime = time.perf_counter()
+    drawFunction(surface)
+    elapsedTime = time.perf_counter() - startTime
+
+    return pygame.surfarray.array_alpha(surface).T > 0, elapsedTime
+
+def growArray(array, distance):
+    # Every pixel within distance pixels (horizontally and vertically) of a True pixel
+    grown = array.copy()
+    for rowOffset in range(-distance, distance + 1):
+        for columnOffset in range(-distance, distance + 1):
+            grown |= np.roll(array, (rowOffset, columnOffset), axis=(0, 1))
+
+    return grown
+
+def benchmarkRasterisation(trackNames=("squigly", "straightTrack", "straightTrackasds"), maxEdgeDistance=2):
+    # The polygon strips may only move the road's edge slightly, never add or remove road away from it
+    for trackName in trackNames:
+        track = Track(trackName)
+        track.pointFrequency = track.finalPointFrequency
+        curvePoints, curveOffsets = track.getCurves()
+
+        circleRoad, circleTime = getRoadArray(lambda surface: track.drawCircles(surface, curvePoints))
+        stripRoad, stripTime = getRoadArray(lambda surface: track.drawRoad(surface, curvePoints, curveOffsets))
+
+        # Differences are measured against the edge of the circle road
+        differences = circleRoad ^ stripRoad
+        print(f"{trackName}: circles {circleTime * 1000:.0f}ms, polygon strips {stripTime * 1000:.0f}ms ({circleTime / stripTime:.1f}x)")
+
+        for distance in range(1, maxEdgeDistance + 1):
+            edge = growArray(circleRoad, distance) & growArray(~circleRoad, distance)
+            farDifferences = (differences & ~edge).sum()
+            print(f"  Pixels that differ more than {distance}px from the edge of the circle road: {farDifferences} of {differences.sum()} differing")
+
+        check(farDifferences == 0, f"{farDifferences} pixels of {trackName} differ more than {maxEdgeDistance}px from the edge of the circle road")
+
+def legacyCollideCheckpoint(car):
+    # The original check for whether the inner rect of a car touches its next checkpoint line
+    innerRect = pygame.Rect(0, 0, car.rect.width // 2, car.rect.height // 2)
+    innerRect.center = car.rect.center
+
+    checkpoint = car.track.checkpoints[car.checkpointIndex]
+    return innerRect.clipline(checkpoint[0], checkpoint[1])
+
+def checkFollowingParity(track, agentCount=200, steps=60):
+    # A single car walking along the centre line must end on the same progress as the batched walk, every step of a drive around the track
+    agents = getTestAgents(track, agentCount)
+    for agent in agents:
+        agent.speed = agent.maxSpeed
+        agent.wheelDirection = 10
+
+    largestDifference = 0
+    for _ in range(steps):
+        for agent in agents:
+            agent.moveCar(1 / FPS)
+
+        centres = np.array([agent.rect.center for agent in agents], dtype=np.float64)
+        previousProgresses = [agent.progress for agent in agents]
+        batchProgresses = track.getProgresses(centres[:, 0], centres[:, 1], previousProgresses)
+
+        for agent, batchProgress in zip(agents, batchProgresses):
+            agent.updateProgress()
+            largestDifference = max(largestDifference, abs(agent.progress - batchProgress))
+
+    print(f"Single and batched progress differ by up to {largestDifference:.2g}px over {steps} steps")
+    check(largestDifference == 0, "a single car's progress differs from the batched progress")
+
+def benchmarkProgress(trackName="squigly", agentCount=200, repeats=100):
+    track = loadTrack(trackName)
+    agents = getTestAgents(track, agentCount)
+
+    startTime = time.perf_counter()
+    track.buildProgressIndex()
+    print(f"Built progress index in {time.perf_counter() - startTime:.3f}s")
+
+    def collideCheckpoints():
+        for agent in agents:
+            legacyCollideCheckpoint(agent)
+
+    def updateProgresses():
+        for agent in agents:
+            agent.updateProgress()
+
+    # Cars stood still pass every checkpoint behind them first, then race cars rarely pass one in a frame
+    for _ in range(len(track.checkpoints)):
+        updateCarProgresses(agents)
+
+    # Races find the progress of every car together
+    legacyTime, progressTime, batchTime = [time / agentCount for time in getInterleavedBestTimes([collideCheckpoints, updateProgresses, lambda: updateCarProgresses(agents)], repeats)]
+
+    print(f"Checkpoint line test:    {legacyTime * 1e6:.2f}us per car")
+    print(f"Progress along track:    {progressTime * 1e6:.2f}us per car")
+    print(f"Batched progress:        {batchTime * 1e6:.2f}us per car")
+
+    checkFollowingParity(track)
+    check(batchTime <= legacyTime, f"batched progress takes {batchTime * 1e6:.2f}us per car, more than the {legacyTime * 1e6:.2f}us checkpoint line test")
+
+    for trackName in ["squigly", "straightTrack", "straightTrackasds"]:
+        checkProgressGrid(loadTrack(trackName))
+
+def getCentreLinePoints(track, progresses):
+    # Points on the centre line at each progress
+    distances = np.append(track.progressDistances, track.trackLength)
+    points = np.vstack([track.progressPoints, track.progressPoints[:1]])
+    trackDistances = (progresses + track.startDistance) % track.trackLength
+
+    return np.interp(trackDistances, distances, points[:, 0]), np.interp(trackDistances, distances, points[:, 1])
+
+def checkProgressGrid(track, count=3000, seed=0):
+    # Progress found through the grid must be the closest point on the whole centre line, even where the road passes close to itself
+    randomGenerator = np.random.default_rng(seed)
+    roadY, roadX = np.nonzero(~track.getWallArray())
+    samples = randomGenerator.choice(len(roadX), count, replace=False)
+    xs, ys = roadX[samples].astype(np.float64), roadY[samples].astype(np.float64)
+
+    allSegments = np.broadcast_to(np.arange(len(track.progressPoints)), (count, len(track.progressPoints)))
+    bruteForceProgresses = (track.projectOntoCentreLine(xs, ys, allSegments) - track.startDistance) % track.trackLength
+    gridProgresses = track.getProgresses(xs, ys)
+
+    bruteForceX, bruteForceY = getCentreLinePoints(track, bruteForceProgresses)
+    gridX, gridY = getCentreLinePoints(track, gridProgresses)
+    extraDistances = np.hypot(gridX - xs, gridY - ys) - np.hypot(bruteForceX - xs, bruteForceY - ys)
+
+    wrongCount = int((extraDistances > 1e-6).sum())
+    print(f"{track.getFilePath()}: {wrongCount} of {count} grid lookups further than the closest centre line point, by up to {max(extraDistances.max(), 0):.2f}px")
+    check(wrongCount == 0, f"progress grid lookups on {track.getFilePath()} do not match a search of the whole centre line")
+
+def timeFrames(drawTrack, screen, cameraOffsets):
+    # Wall clock and CPU time per frame of clearing the screen and drawing the track
+    startTime = time.perf_counter()
+    startCpuTime = time.process_time()
+
+    for cameraOffset in cameraOffsets:
+        screen.fill(BACKGROUND_COLOUR)
+        drawTrack(screen, cameraOffset)
+
+    frameTime = (time.perf_counter() - startTime) / len(cameraOffsets)
+    cpuTime = (time.process_time() - startCpuTime) / len(cameraOffsets)
+
+    return frameTime, cpuTime
+
+def benchmarkTrackDrawing(trackName="squigly", frames=300):
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    track = loadTrack(trackName)
+
+    # Camera following the centre line, as it does when following a car
+    centrePoints = track.progressPoints[np.linspace(0, len(track.progressPoints) - 1, frames).astype(np.int64)]
+    cameraOffsets = [pygame.Vector2(x - SCREEN_WIDTH / 2, y - SCREEN_HEIGHT / 2) for x, y in centrePoints.tolist()]
+
+    startTime = time.perf_counter()
+    track.buildTiles()
+    print(f"Built tiles in {time.perf_counter() - startTime:.3f}s")
+
+    # Both ways of drawing must give the same picture
+    differentFrames = 0
+    for cameraOffset in cameraOffsets[::10]:
+        screen.fill(BACKGROUND_COLOUR)
+        screen.blit(track.trackSurface, (-cameraOffset, (TRACK_WIDTH, TRACK_HEIGHT)))
+        legacyFrame = pygame.surfarray.array3d(screen)
+
+        screen.fill(BACKGROUND_COLOUR)
+        track.draw(screen, cameraOffset)
+        differentFrames += not np.array_equal(legacyFrame, pygame.surfarray.array3d(screen))
+
+    legacyFrameTime, legacyCpuTime = timeFrames(lambda screen, cameraOffset: screen.blit(track.trackSurface, (-cameraOffset, (TRACK_WIDTH, TRACK_HEIGHT))), screen, cameraOffsets)
+    tiledFrameTime, tiledCpuTime = timeFrames(track.draw, screen, cameraOffsets)
+
+    print(f"Whole track surface: {legacyFrameTime * 1000:.2f}ms per frame, {legacyCpuTime * 1000:.2f}ms CPU")
+    print(f"Visible tiles:       {tiledFrameTime * 1000:.2f}ms per frame, {tiledCpuTime * 1000:.2f}ms CPU ({legacyFrameTime / tiledFrameTime:.1f}x)")
+    print(f"Frames that differ: {differentFrames} of {len(cameraOffsets[::10])}")
+
+    check(differentFrames == 0, f"{differentFrames} frames drawn from tiles differ from the whole track surface")
+
+def legacyVisualisationFrame(screen, track, agent):
+    # The original visualisation frame which drew and scaled the whole track every frame
+    trackSurface = pygame.Surface((TRACK_WIDTH, TRACK_HEIGHT), pygame.SRCALPHA)
+    trackSurface.fill(BACKGROUND_COLOUR)
+
+    track.draw(trackSurface, pygame.Vector2(0, 0))
+    agent.draw(trackSurface, pygame.Vector2(0, 0))
+
+    screen.blit(pygame.transform.scale(trackSurface, (SCREEN_WIDTH, SCREEN_HEIGHT)), (0, 0))
+
+def benchmarkVisualisation(trackName="squigly", frames=20):
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    track = loadTrack(trackName)
+    agents = getTestAgents(track, frames)
+
+    startTime = time.perf_counter()
+    for agent in agents:
+        legacyVisualisationFrame(screen, track, agent)
+    legacyTime = (time.perf_counter() - startTime) / frames
+
+    # Same overview as Game.visualizeEpisode and the viewer, which scales the background once
+    startTime = time.perf_counter()
+    trackOverview = TrackOverview(0, 0, 1, 1, track)
+    setupTime = time.perf_counter() - startTime
+
+    startTime = time.perf_counter()
+    for agent in agents:
+        trackOverview.draw(screen, agent)
+    scaledTime = (time.perf_counter() - startTime) / frames
+
+    print(f"Scaling the whole track every frame: {legacyTime * 1000:.1f}ms per frame")
+    print(f"Scaled background:                   {scaledTime * 1000:.2f}ms per frame after {setupTime * 1000:.0f}ms to build it ({legacyTime / scaledTime:.0f}x)")
+
+def legacySelectAction(agent, model):
+    # The original action selection which built a tensor from a list and ran the network with autograd enabled
+    state = torch.tensor([agent.speed / agent.maxSpeed, *agent.getDistances()], dtype=torch.float32).unsqueeze(0)
+    return int(model(state).argmax())
+
+def benchmarkInference(trackName="squigly", agentCounts=(1, 10, 50), repeats=20):
+    track = loadTrack(trackName)
+    model = NeuralNetwork(NETWORK_INPUT_SIZE, NETWORK_ACTION_SIZE)
+    inferenceEngine = InferenceEngine(model, torch.device("cpu"))
+
+    for agentCount in agentCounts:
+        agents = getTestAgents(track, agentCount)
+        for agent in agents:
+            agent.inferenceEngine = inferenceEngine
+
+        legacyActions = [legacySelectAction(agent, model) for agent in agents]
+        differentActions = sum(legacyAction != action for legacyAction, action in zip(legacyActions, selectAgentActions(agents)))
+
+        startTime = time.perf_counter()
+        for _ in range(repeats):
+            for agent in agents:
+                legacySelectAction(agent, model)
+        legacyTime = (time.perf_counter() - startTime) / repeats
+
+        startTime = time.perf_counter()
+        for _ in range(repeats):
+            for agent in agents:
+                agent.selectAction()
+        singleTime = (time.perf_counter() - startTime) / repeats
+
+        startTime = time.perf_counter()
+        for _ in range(repeats):
+            selectAgentActions(agents)
+        batchTime = (time.perf_counter() - startTime) / repeats
+
+        print(f"{agentCount} agents:")
+        print(f"  Autograd, one at a time:       {legacyTime * 1000:.2f}ms per step")
+        print(f"  Inference mode, one at a time: {singleTime * 1000:.2f}ms per step")
+        print(f"  Inference mode, batched:       {batchTime * 1000:.2f}ms per step ({legacyTime / batchTime:.1f}x)")
+        print(f"  Actions that differ: {differentActions}")
+
+        check(differentActions == 0, f"{differentActions} of {agentCount} batched actions differ from the original action selection")
+
+def checkGridPositions(track, count=50):
+    # Every grid car starts at its slot's progress, and one frame later has not moved to another part of the road or started a lap
+    startPositions = track.getGridPositions(count)
+    agentCars = [CarAgent(startPoint.x, startPoint.y, startAngle, RED_CAR_IMAGE, track, None, False, startProgress) for startPoint, startAngle, startProgress in startPositions]
+
+    for agentCar in agentCars:
+        agentCar.drive(1 / FPS, *agentCar.getActionValues(4))
+    updateCarProgresses(agentCars)
+
+    largestChange = 0
+    for agentCar, (_, _, startProgress) in zip(agentCars, startPositions):
+        largestChange = max(largestChange, abs(track.getProgressChange(startProgress, agentCar.progress)))
+        check(agentCar.lap == 0 and agentCar.checkpointIndex == 0, f"a grid car on {track.getFilePath()} started on lap {agentCar.lap} at checkpoint {agentCar.checkpointIndex}")
+
+    print(f"{track.getFilePath()}: {count} grid cars start on lap 0, progress changed by up to {largestChange:.0f}px in the first frame")
+    check(largestChange < track.gridRowSpacing, f"a grid car on {track.getFilePath()} moved to another part of the road")
+
+def benchmarkRace(trackName="squigly", opponentCounts=(1, 20, 50), frames=300):
+    for gridTrackName in ["squigly", "straightTrack", "straightTrackasds"]:
+        checkGridPositions(loadTrack(gridTrackName))
+
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    track = loadTrack(trackName)
+    inferenceEngine = InferenceEngine(NeuralNetwork(NETWORK_INPUT_SIZE, NETWORK_ACTION_SIZE), torch.device("cpu"))
+
+    frameBudget = 1 / FPS
+    spawnPoint, spawnAngle = track.getSpawnPosition()
+    overBudget = []
+
+    for opponentCount in opponentCounts:
+        # Same setup and frame as Game.gameLoop, with the player holding the accelerator
+        playerCar = Car(spawnPoint.x, spawnPoint.y, spawnAngle, BLUE_CAR_IMAGE, track)
+        startPositions = [(spawnPoint, spawnAngle, playerCar.progress)] if opponentCount == 1 else track.getGridPositions(opponentCount)
+        agentCars = [CarAgent(startPoint.x, startPoint.y, startAngle, RED_CAR_IMAGE, track, inferenceEngine, False, startProgress) for startPoint, startAngle, startProgress in startPositions]
+
+        minimap = Minimap(0, 0, 0.2, 0.2, track, COLOUR_SCHEME[1], BUTTON_BORDER_THICKNESS)
+        cameraOffset = pygame.Vector2(0, 0)
+
+        frameTimes = []
+        for _ in range(frames):
+            startTime = time.perf_counter()
+
+            playerCar.drive(frameBudget, 1, 0)
+            for agentCar, selectedAction in zip(agentCars, selectAgentActions(agentCars)):
+                agentCar.drive(frameBudget, *agentCar.getActionValues(selectedAction))
+            updateCarProgresses([playerCar, *agentCars])
+
+            cameraOffset = playerCar.getCameraOffset(cameraOffset, frameBudget)
+
+            screen.fill(BACKGROUND_COLOUR)
+            track.draw(screen, cameraOffset)
+            for agentCar in agentCars:
+                agentCar.draw(screen, cameraOffset)
+            playerCar.draw(screen, cameraOffset)
+            minimap.draw(screen, playerCar, agentCars)
+
+            pygame.display.flip()
+            frameTimes.append(time.perf_counter() - startTime)
+
+        frameTimes = np.array(frameTimes)
+        withinBudget = np.percentile(frameTimes, 99) <= frameBudget
+        print(f"{opponentCount} opponents: median {np.median(frameTimes) * 1000:.2f}ms, 99th percentile {np.percentile(frameTimes, 99) * 1000:.2f}ms, {(frameTimes > frameBudget).mean() * 100:.1f}% of frames over the {frameBudget * 1000:.1f}ms budget ({'holds' if withinBudget else 'misses'} {FPS} FPS)")
+
+        if not withinBudget:
+            overBudget.append(opponentCount)
+
+    # Every race size is reported before failing
+    check(len(overBudget) == 0, f"the 99th percentile frame time is over the {frameBudget * 1000:.1f}ms budget with {', '.join(map(str, overBudget))} opponents")
+
+def getSavedSize(model):
+    # Size of the TorchScript file the model would be exported as
+    buffer = io.BytesIO()
+    torch.jit.save(model, buffer)
+
+    return len(buffer.getvalue())
+
+def benchmarkExport(trackName="squigly", agentCounts=(1, 50), stateCount=5000, repeats=2000):
+    track = loadTrack(trackName)
+    states = getAgentStates(getTestAgents(track, stateCount))
+
+    # Exports of the same randomly initialised policy, so every variant is compared against the float eager network
+    torch.manual_seed(0)
+    model = NeuralNetwork(NETWORK_INPUT_SIZE, NETWORK_ACTION_SIZE).eval()
+    policies = {
+        "Eager float32": model,
+        "TorchScript float32": scriptPolicy(model),
+        "TorchScript int8": scriptPolicy(quantisePolicy(copy.deepcopy(model))),
+    }
+
+    device = torch.device("cpu")
+    floatQValues = InferenceEngine(model, device).getQValues(states).clone()
+    floatActions = floatQValues.argmax(dim=1)
+
+    for name, policy in policies.items():
+        inferenceEngine = InferenceEngine(policy, device)
+
+        qValues = inferenceEngine.getQValues(states)
+        agreement = (qValues.argmax(dim=1) == floatActions).float().mean().item()
+        maxDifference = (qValues - floatQValues).abs().max().item()
+
+        size = f"{getSavedSize(policy) / 1024:.1f}KB" if name != "Eager float32" else "-"
+        print(f"{name}: {size}, {agreement * 100:.2f}% of actions agree with float, largest Q-Value difference {maxDifference:.4f}")
+
+        for agentCount in agentCounts:
+            batch = states[:agentCount]
+
+            # Warm up so TorchScript has profiled and optimised the graph before timing
+            for _ in range(20):
+                inferenceEngine.selectActions(batch)
+
+            startTime = time.perf_counter()
+            for _ in range(repeats):
+                inferenceEngine.selectActions(batch)
+            inferenceTime = (time.perf_counter() - startTime) / repeats
+
+            print(f"  {agentCount} agents: {inferenceTime * 1e6:.1f}us per inference")
+
+def timeColdStart(code, repeats):
+    # Best wall time of a fresh interpreter running the code, so nothing is already imported or cached in memory
+    times = []
+    for _ in range(repeats):
+        startTime = time.perf_counter()
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env={**os.environ, "SDL_VIDEODRIVER": "dummy"}, cwd=os.path.dirname(os.path.abspath(__file__)))
+        times.append(time.perf_counter() - startTime)
+
+    return min(times), result.stdout.strip().splitlines()[-1]
+
+def benchmarkColdStart(modelName="benchmarkColdStart", repeats=3):
+    # A throwaway model saved both ways so the two backends load the same weights
+    modelPath = f"{MODELS_PATH}/{modelName}"
+    model = NeuralNetwork(NETWORK_INPUT_SIZE, NETWORK_ACTION_SIZE)
+    torch.save(model.state_dict(), f"{modelPath}.model")
+
+    try:
+        # Everything main.py imports before the menu can open, then loading an opponent
+        menuCode = "import main, sys; print('torch' in sys.modules)"
+        torchCode = f"import torch, main; from model import InferenceEngine, loadPolicy; InferenceEngine(loadPolicy('{modelName}', 'cpu'), 'cpu'); print(True)"
+        numpyCode = f"import main, sys; from policies import loadInferenceEngine; loadInferenceEngine('{modelName}'); print('torch' in sys.modules)"
+
+        menuTime, menuTorch = timeColdStart(menuCode, repeats)
+        torchTime, _ = timeColdStart(torchCode, repeats)
+
+        modelNumpy.saveNetwork(getNumpyNetwork(model), f"{modelPath}.npz")
+        numpyTime, numpyTorch = timeColdStart(numpyCode, repeats)
+    finally:
+        for extension in [".model", ".npz"]:
+            if os.path.isfile(modelPath + extension):
+                os.remove(modelPath + extension)
+
+    print(f"Menu ready:                  {menuTime:.2f}s (torch imported: {menuTorch})")
+    print(f"Opponent loaded with torch:  {torchTime:.2f}s")
+    print(f"Opponent loaded with NumPy:  {numpyTime:.2f}s (torch imported: {numpyTorch}, {torchTime / numpyTime:.1f}x)")
+
+def timeTrainingSteps(agents, steps):
+    # Training steps for agents that always use the policy, replacing any whose episode ends with a new car like the trainer does
+    startTime = time.perf_counter()
+    for _ in range(steps):
+        for index, agent in enumerate(agents):
+            if agent.update(1 / FPS)[3]:
+                agents[index] = getTrainingAgent(agent.track, agent.inferenceEngine, agent.start)
+
+    return steps * len(agents) / (time.perf_counter() - startTime)
+
+def getTrainingAgent(track, inferenceEngine, start):
+    # A training car at start, a (position, direction, progress) tuple, remembered so the car can be started again
+    (x, y), direction, progress = start
+    agent = CarAgent(x, y, direction, RED_CAR_IMAGE, track, inferenceEngine, True, progress)
+    agent.start = start
+
+    return agent
+
+def getTrainingAgents(track, count):
+    # Training cars at the test agents' starts that share one NumPy policy
+    inferenceEngine = modelNumpy.InferenceEngine(modelNumpy.NeuralNetwork(NETWORK_INPUT_SIZE, NETWORK_ACTION_SIZE))
+
+    return [getTrainingAgent(track, inferenceEngine, (agent.rect.center, agent.direction - 90, agent.progress)) for agent in getTestAgents(track, count)]
+
+def benchmarkInstrumentation(trackName="squigly", agentCount=50, steps=200, repeats=1_000_000):
+    track = loadTrack(trackName)
+    agents = getTrainingAgents(track, agentCount)
+
+    # Cost of one disabled check, which is all a hot path pays when instrumentation is off
+    instrumentation.enabled = False
+    startTime = time.perf_counter()
+    for _ in range(repeats):
+        if instrumentation.enabled:
+            pass
+    checkTime = (time.perf_counter() - startTime) / repeats
+
+    # Alternating runs and keeping the best of each so neither side is favoured by warming up
+    timeTrainingSteps(agents, 10)
+    disabledRate, enabledRate = 0, 0
+    recorded = False
+    for _ in range(3):
+        instrumentation.enabled = False
+        instrumentation.reset()
+        disabledRate = max(disabledRate, timeTrainingSteps(agents, steps))
+        recorded = recorded or len(instrumentation.counts) + len(instrumentation.phaseTimes) > 0
+
+        instrumentation.enabled = True
+        instrumentation.reset()
+        enabledRate = max(enabledRate, timeTrainingSteps(agents, steps))
+
+    instrumentation.enabled = False
+    agentSteps = steps * agentCount
+    raycastsPerStep = instrumentation.counts["raycasts"] / agentSteps
+    overlapsPerStep = instrumentation.counts["overlaps"] / agentSteps
+    instrumentation.reset()
+
+    print(f"Disabled check: {checkTime * 1e9:.0f}ns, anything recorded while disabled: {recorded}")
+    print(f"Disabled: {disabledRate:,.0f} steps/s")
+    print(f"Enabled:  {enabledRate:,.0f} steps/s ({(disabledRate / enabledRate - 1) * 100:+.1f}% time per step)")
+    print(f"Raycasts per step: {raycastsPerStep:.1f}, overlaps per step: {overlapsPerStep:.1f}")
+
+def getBestTime(function, repeats, setup=None):
+    # Fastest of several runs, which is the one least slowed down by anything else running on the machine
+    bestTime = math.inf
+    for _ in range(repeats):
+        arguments = setup() if setup else ()
+
+        startTime = time.perf_counter()
+        function(*arguments)
+        bestTime = min(bestTime, time.perf_counter() - startTime)
+
+    return bestTime
+
+def getInterleavedBestTimes(functions, rounds, calls=20):
+    # Fastest time per call of each function, timed in turns a few calls at a time so a slow spell on the machine lands on all of them
+    bestTimes = [math.inf] * len(functions)
+    for _ in range(rounds):
+        for index, function in enumerate(functions):
+            startTime = time.perf_counter()
+            for _ in range(calls):
+                function()
+            bestTimes[index] = min(bestTimes[index], (time.perf_counter() - startTime) / calls)
+
+    return bestTimes
+
+def getSuiteTrack(trackName):
+    track = Track(trackName)
+    track.initialiseTrack()
+
+    return track
+
+def getUncachedTrack(trackName):
+    # A track that compiles itself without reading or replacing the compiled copy on disk
+    track = Track(trackName)
+    track.loadCache = lambda cacheKey: False
+    track.saveCache = lambda cacheKey: None
+
+    return (track,)
+
+def suiteTracks(repeats=3):
+    results = {}
+
+    for trackPath in sorted(glob.glob(f"{TRACKS_PATH}/*.json")):
+        trackName = os.path.splitext(os.path.basename(trackPath))[0]
+
+        results[f"initialiseTrack/{trackName}/compile"] = getBestTime(Track.initialiseTrack, repeats, lambda: getUncachedTrack(trackName))
+
+        # Makes sure there is an up to date compiled copy to load
+        getSuiteTrack(trackName)
+        results[f"initialiseTrack/{trackName}/cached"] = getBestTime(Track.initialiseTrack, repeats, lambda: (Track(trackName),))
+
+    return results
+
+def suiteSensors(trackName="squigly", agentCount=200, repeats=10):
+    track = getSuiteTrack(trackName)
+    agents = getTestAgents(track, agentCount)
+
+    def getDistances():
+        for agent in agents:
+            agent.getDistances()
+
+    return {
+        "getDistances": getBestTime(getDistances, repeats) / agentCount,
+        "getAgentStates": getBestTime(lambda: getAgentStates(agents), repeats) / agentCount,
+    }
+
+def getMovingAgents(track, count, wheelDirection):
+    # Fresh agents for every run so they all start from the same positions
+    agents = getTestAgents(track, count)
+    for agent in agents:
+        agent.speed = agent.maxSpeed / 2
+        agent.wheelDirection = wheelDirection
+
+    return (agents,)
+
+def suiteMovement(trackName="squigly", agentCount=200, steps=5, repeats=10):
+    track = getSuiteTrack(trackName)
+
+    def moveCars(agents):
+        for _ in range(steps):
+            for agent in agents:
+                agent.moveCar(1 / FPS)
+
+    # Turning also looks up the rotated mask and checks it against the track
+    return {
+        "moveCar/straight": getBestTime(moveCars, repeats, lambda: getMovingAgents(track, agentCount, 0)) / (agentCount * steps),
+        "moveCar/turning": getBestTime(moveCars, repeats, lambda: getMovingAgents(track, agentCount, 20)) / (agentCount * steps),
+    }
+
+def suiteOverlap(trackName="squigly", count=1000, repeats=10, seed=0):
+    track = getSuiteTrack(trackName)
+    agents = getTestAgents(track, count, seed)
+    mask = agents[0].mask
+
+    # Cars on the road, and anywhere on the track surface where most of them touch a wall or the edge
+    randomGenerator = random.Random(seed)
+    roadPositions = [(agent.imageRect.x, agent.imageRect.y) for agent in agents]
+    anyPositions = [(randomGenerator.uniform(0, TRACK_WIDTH), randomGenerator.uniform(0, TRACK_HEIGHT)) for _ in range(count)]
+
+    def getOverlaps(positions):
+        for x, y in positions:
+            track.getOverlap(x, y, mask)
+
+    return {
+        "getOverlap/road": getBestTime(lambda: getOverlaps(roadPositions), repeats) / count,
+        "getOverlap/anywhere": getBestTime(lambda: getOverlaps(anyPositions), repeats) / count,
+    }
+
+def suiteUpdates(batchSizes=(32, 128, 512), experienceCount=10_000, steps=50, repeats=3, seed=0):
+    learners = getLearners()
+
+    batch = getRandomBatch(np.random.default_rng(seed), experienceCount)
+    for learner in learners.values():
+        learner.memory.addExperiences(batch[0], batch[1], batch[3], batch[2], batch[4])
+
+    # The same work as updateModel with uniform sampling, for batch sizes other than BATCH_SIZE
+    def updateModel(learner, batchSize):
+        for _ in range(steps):
+            learner.learnFromBatch(*learner.memory.getBatch(batchSize))
+            learner.softUpdateTargetNetwork()
+
+    results = {}
+    for name, learner in learners.items():
+        for batchSize in batchSizes:
+            updateModel(learner, batchSize)
+            results[f"updateModel/{name.lower()}/{batchSize}"] = getBestTime(lambda: updateModel(learner, batchSize), repeats) / steps
+
+    return results
+
+def suiteSteps(trackName="squigly", agentCount=50, carCount=64, steps=200, repeats=3, seed=0):
+    track = getSuiteTrack(trackName)
+    results = {}
+
+    # Agents driving and sensing on their own, and cars stepped together by a vector environment
+    agents = getTrainingAgents(track, agentCount)
+    timeTrainingSteps(agents, 10)
+    results["environmentStep/agent"] = min(1 / timeTrainingSteps(agents, steps) for _ in range(repeats))
+
+    environment = VectorEnvironment(track, carCount, seed)
+
+    def stepEnvironment():
+        for _ in range(steps):
+            environment.step(environment.selectActions(environment.states, 0.1))
+
+    stepEnvironment()
+    results["environmentStep/vector"] = getBestTime(stepEnvironment, repeats) / (steps * carCount)
+
+    # Whole training steps, from driving the car to updating the networks
+    for backend in ["torch", "numpy"]:
+        random.seed(seed)
+        trainer = DQNTrainer(BenchmarkGame(track), backend)
+        fillMemory(trainer.memory, BATCH_SIZE)
+        spawnPoint, spawnAngle = track.getSpawnPosition()
+
+        def trainSteps():
+            agentCar = CarAgent(spawnPoint.x, spawnPoint.y, spawnAngle, RED_CAR_IMAGE, track, trainer.inferenceEngine, True)
+            state = agentCar.getState()
+
+            for _ in range(steps):
+                action, nextState, reward, episodeEnded = agentCar.update(TRAINING_TIMESTEP, 0.5)
+                trainer.memory.addExperience(state, action, nextState, reward)
+                trainer.updateNetworks()
+
+                if episodeEnded:
+                    agentCar = CarAgent(spawnPoint.x, spawnPoint.y, spawnAngle, RED_CAR_IMAGE, track, trainer.inferenceEngine, True)
+                    nextState = agentCar.getState()
+
+                state = nextState
+
+        trainSteps()
+        results[f"trainingStep/{backend}"] = getBestTime(trainSteps, repeats) / steps
+
+    return results
+
+# Hot paths timed by the suite, each returning the seconds taken by one call or step of everything it times
+SUITE = {
+    "tracks": suiteTracks,
+    "sensors": suiteSensors,
+    "movement": suiteMovement,
+    "overlap": suiteOverlap,
+    "updates": suiteUpdates,
+    "steps": suiteSteps,
+}
+
+def runSuite(names, runs):
+    results = {}
+
+    for name in names:
+        print(f"Running {name}", file=sys.stderr, flush=True)
+
+        # Each part is run several times and every metric keeps its median, so one run slowed down by the machine is not reported as a regression
+        runTimes = {}
+        for _ in range(runs):
+            for metric, seconds in SUITE[name]().items():
+                runTimes.setdefault(metric, []).append(seconds)
+
+        for metric, times in runTimes.items():
+            seconds = float(np.median(times))
+            print(f"  {metric:<44} {seconds * 1e6:>12.2f}us {1 / seconds:>14,.1f}/s (runs from {min(times) * 1e6:.2f}us to {max(times) * 1e6:.2f}us)", file=sys.stderr)
+            results[metric] = seconds
+
+    # What the results were measured with, since timings from different machines or libraries are not comparable
+    return {
+        "machine": {
+            "platform": platform.platform(),
+            "processor": platform.processor() or platform.machine(),
+            "cpus": os.cpu_count(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "torch": torch.__version__,
+            "pygame": pygame.version.ver,
+        },
+        "secondsPerOperation": results,
+    }
+
+def compareResults(results, baseline, tolerance):
+    # A metric has regressed when it is slower than the baseline by more than the tolerance, returns the regressed metrics
+    if baseline["machine"] != results["machine"]:
+        print("Warning: the baseline was measured on a different machine or with different libraries", file=sys.stderr)
+
+    regressions = []
+    for metric, seconds in results["secondsPerOperation"].items():
+        baselineSeconds = baseline["secondsPerOperation"].get(metric)
+        if baselineSeconds is None:
+            print(f"  {metric:<44} not in the baseline", file=sys.stderr)
+            continue
+
+        change = seconds / baselineSeconds - 1
+        if change > tolerance:
+            status = "REGRESSION"
+            regressions.append(metric)
+        elif change < -tolerance:
+            status = "faster"
+        else:
+            status = ""
+
+        print(f"  {metric:<44} {baselineSeconds * 1e6:>12.2f}us -> {seconds * 1e6:>12.2f}us {change:>+8.1%} {status}", file=sys.stderr)
+
+    return regressions
+
+BENCHMARKS = {
+    "raycasts": benchmarkRaycasts,
+    "rotations": benchmarkRotationCache,
+    "memory": benchmarkExperienceMemory,
+    "targetUpdate": benchmarkTargetUpdate,
+    "learnerParity": benchmarkLearnerParity,
+    "learners": benchmarkLearners,
+    "checkpoint": benchmarkCheckpoint,
+    "rasterisation": benchmarkRasterisation,
+    "progress": benchmarkProgress,
+    "trackDrawing": benchmarkTrackDrawing,
+    "visualisation": benchmarkVisualisation,
+    "inference": benchmarkInference,
+    "race": benchmarkRace,
+    "export": benchmarkExport,
+    "coldStart": benchmarkColdStart,
+    "instrumentation": benchmarkInstrumentation,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the benchmarks named on the command line, or all of them")
+    parser.add_argument("names", nargs="*", help=f"benchmarks to run, or with --suite the parts of the suite to run: {', '.join(SUITE)}")
+    parser.add_argument("--suite", action="store_true", help="time the hot paths and write the results as JSON")
+    parser.add_argument("--output", help="file the suite's JSON results are written to instead of the standard output")
+    parser.add_argument("--compare", help="JSON results from an earlier run of the suite to check for regressions against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="fraction slower than the baseline a metric can be before it is a regression")
+    parser.add_argument("--runs", type=int, default=3, help="times each part of the suite is run, keeping the median of every metric")
+    arguments = parser.parse_args()
+
+    if not arguments.suite:
+        for name in arguments.names or BENCHMARKS:
+            BENCHMARKS[name]()
+        sys.exit()
+
+    for name in arguments.names:
+        if name not in SUITE:
+            parser.error(f"no part of the suite called {name}")
+
+    # Seeded so every run times the same positions, experiences and actions
+    random.seed(0)
+    np.random.seed(0)
+    torch.manual_seed(0)
+
+    results = runSuite(arguments.names or SUITE, arguments.runs)
+
+    if arguments.output:
+        with open(arguments.output, "w") as file:
+            json.dump(results, file, indent=4)
+    else:
+        print(json.dumps(results, indent=4))
+
+    if arguments.compare:
+        with open(arguments.compare) as file:
+            baseline = json.load(file)
+
+        print(f"Compared with {arguments.compare}:", file=sys.stderr)
+        regressions = compareResults(results, baseline, arguments.tolerance)
+
+        if regressions:
+            print(f"{len(regressions)} regressions: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
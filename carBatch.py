@@ -0,0 +1,187 @@
+import numpy as np
+
+from cars import Car
+
+class CarBatch:
+    def __init__(self, track, count, image):
+        self.track = track
+        self.count = count
+
+        # A single car at the spawn point provides the driving constants and the starting state for every car in the batch
+        spawnPoint, spawnAngle = track.getSpawnPosition()
+        self.template = Car(spawnPoint.x, spawnPoint.y, spawnAngle, image, track)
+
+        self.maxSpeed = self.template.maxSpeed
+        self.acceleration = self.template.acceleration
+
+        self.friction = self.template.friction
+        self.brakeStrength = self.template.brakeStrength
+        self.stoppingOffset = self.template.stoppingOffset
+
+        self.steerSpeed = self.template.steerSpeed
+        self.steerCenterSpeed = self.template.steerCenterSpeed
+
+        self.width = self.template.rect.width
+        self.height = self.template.rect.height
+
+        # Images and masks come from the same rotation cache as the single cars
+        self.rotationCache = self.template.rotationCache
+        self.imageSizes, self.outlineOffsets = self.rotationCache.getOutlines()
+
+        # Furthest any edge pixel gets from the centre of its image, so cars further than this from a wall can skip the edge checks
+        imageCentres = self.imageSizes[:, None, :] // 2
+        self.outlineRadius = np.sqrt(((self.outlineOffsets - imageCentres) ** 2).sum(axis=2)).max() + 1
+
+        # Every property of the cars is stored in its own array with one element per car
+        self.speed = np.zeros(count)
+        self.direction = np.zeros(count)
+        self.wheelDirection = np.zeros(count)
+        self.rotationIndex = np.zeros(count, dtype=np.intp)
+
+        # Position of the unrotated car and its rounded rect
+        self.x = np.zeros(count)
+        self.y = np.zeros(count)
+        self.rectX = np.zeros(count, dtype=np.int64)
+        self.rectY = np.zeros(count, dtype=np.int64)
+
+        # Top left of the rotated image
+        self.imageX = np.zeros(count, dtype=np.int64)
+        self.imageY = np.zeros(count, dtype=np.int64)
+
+        self.lap = np.zeros(count, dtype=np.int64)
+        self.checkpointIndex = np.zeros(count, dtype=np.int64)
+        self.progress = np.zeros(count)
+
+        self.reset()
+
+    def reset(self, indices=slice(None)):
+        # Move the chosen cars back to the spawn point
+        self.speed[indices] = self.template.speed
+        self.direction[indices] = self.template.direction
+        self.wheelDirection[indices] = self.template.wheelDirection
+        self.rotationIndex[indices] = self.rotationCache.getIndex(self.template.direction)
+
+        self.x[indices] = self.template.x
+        self.y[indices] = self.template.y
+        self.rectX[indices] = self.template.rect.x
+        self.rectY[indices] = self.template.rect.y
+        self.imageX[indices] = self.template.imageRect.x
+        self.imageY[indices] = self.template.imageRect.y
+
+        self.lap[indices] = self.template.lap
+        self.checkpointIndex[indices] = self.template.checkpointIndex
+        self.progress[indices] = self.template.progress
+
+    def getCentres(self):
+        return np.stack([self.rectX + self.width // 2, self.rectY + self.height // 2], axis=1)
+
+    def getImageCentres(self):
+        imageSizes = self.imageSizes[self.rotationIndex]
+        return np.stack([self.imageX + imageSizes[:, 0] // 2, self.imageY + imageSizes[:, 1] // 2], axis=1)
+
+    def handleInputs(self, deltaTime, acceleration, steerDirection):
+        speed = self.speed
+        forwards = speed >= 0
+
+        # Same acceleration, braking and friction model as Car.handleInputs, with each case selected per car
+        accelerating = np.where(forwards,
+            np.minimum(speed + self.acceleration * deltaTime, self.maxSpeed),
+            np.minimum(speed + (-speed * self.brakeStrength * deltaTime + (deltaTime * self.stoppingOffset)), 0))
+
+        reversing = np.where(speed <= 0,
+            np.maximum(speed - (self.acceleration / 2) * deltaTime, -self.maxSpeed / 2),
+            np.maximum(speed - (speed * self.brakeStrength * deltaTime + (deltaTime * self.stoppingOffset)), 0))
+
+        coasting = np.where(speed > 0,
+            np.maximum(speed - (speed * self.friction * deltaTime + (deltaTime * self.stoppingOffset)), 0),
+            np.minimum(speed + (-speed * self.friction * deltaTime + (deltaTime * self.stoppingOffset)), 0))
+
+        self.speed = np.select([acceleration == 1, acceleration == -1], [accelerating, reversing], coasting)
+
+        # Steering towards the input or back towards the centre
+        wheelDirection = self.wheelDirection
+        steering = np.clip(wheelDirection + steerDirection * self.steerSpeed * deltaTime, -45, 45)
+
+        centering = np.where(wheelDirection > 0,
+            np.maximum(wheelDirection - self.steerCenterSpeed * deltaTime, 0),
+            np.where(wheelDirection < 0, np.minimum(wheelDirection + self.steerCenterSpeed * deltaTime, 0), wheelDirection))
+
+        self.wheelDirection = np.where(steerDirection != 0, steering, centering)
+
+    def getOverlaps(self, x, y, rotationIndex):
+        # Batched version of Track.getOverlap that checks the edge pixels of each car's mask against the walls
+        # Offsets are truncated the same way as pygame does for mask offsets
+        x = np.trunc(x).astype(np.int64)
+        y = np.trunc(y).astype(np.int64)
+
+        # Only cars whose centre is close to a wall need their edge pixels checked
+        imageSizes = self.imageSizes[rotationIndex]
+        wallDistances = self.track.getWallDistances(x + imageSizes[:, 0] // 2, y + imageSizes[:, 1] // 2)
+        nearWall = np.flatnonzero(wallDistances <= self.outlineRadius)
+
+        overlaps = np.zeros(len(x), dtype=bool)
+        if len(nearWall) > 0:
+            outlines = self.outlineOffsets[rotationIndex[nearWall]]
+            collisions = self.track.checkCollideAtPoints(x[nearWall, None] + outlines[:, :, 0], y[nearWall, None] + outlines[:, :, 1])
+            overlaps[nearWall] = collisions.any(axis=1)
+
+        return overlaps
+
+    def moveCars(self, deltaTime):
+        # Turning, using the same turning circle as Car.moveCar
+        turning = (self.speed != 0) & (self.wheelDirection != 0)
+        tangent = np.where(turning, np.tan(np.radians(self.wheelDirection)), 1)
+
+        turningRadius = ((self.height * 3.5) + (self.height * 1.5) * (self.speed / self.maxSpeed)) / tangent
+        angularVelocity = self.speed / turningRadius
+        directionChange = np.where(turning, np.degrees(angularVelocity * deltaTime), 0)
+
+        newRotationIndex = np.round((self.direction + directionChange) / self.rotationCache.resolution).astype(np.intp) % self.rotationCache.steps
+
+        # Cars only turn if the turned mask does not overlap a wall
+        turned = turning & ~self.getOverlaps(self.imageX, self.imageY, newRotationIndex)
+        self.direction = np.where(turned, self.direction + directionChange, self.direction)
+        self.rotationIndex = np.where(turned, newRotationIndex, self.rotationIndex)
+        self.updateImagePositions()
+
+        xChange = self.speed * np.sin(np.radians(self.direction)) * deltaTime
+        yChange = self.speed * np.cos(np.radians(self.direction)) * deltaTime
+
+        overlapX = self.getOverlaps(self.imageX + xChange, self.imageY, self.rotationIndex)
+        self.x = np.where(overlapX, self.x, self.x + xChange)
+        self.updateImagePositions()
+
+        overlapY = self.getOverlaps(self.imageX, self.imageY - yChange, self.rotationIndex)
+        self.y = np.where(overlapY, self.y, self.y - yChange)
+        self.updateImagePositions()
+
+        return overlapX | overlapY
+
+    def updateImagePositions(self):
+        # Rects round their position, then the rotated image is centred on the rect
+        self.rectX = np.floor(self.x + 0.5).astype(np.int64)
+        self.rectY = np.floor(self.y + 0.5).astype(np.int64)
+
+        imageSizes = self.imageSizes[self.rotationIndex]
+        self.imageX = self.rectX + self.width // 2 - imageSizes[:, 0] // 2
+        self.imageY = self.rectY + self.height // 2 - imageSizes[:, 1] // 2
+
+    def updateProgress(self):
+        # Batched version of Car.updateProgress
+        previousProgress = self.progress
+        centres = self.getCentres()
+        self.progress = self.track.getProgresses(centres[:, 0], centres[:, 1], previousProgress)
+
+        return self.track.getProgressChange(previousProgress, self.progress), self.track.checkCheckpointPassed(self.progress, self.checkpointIndex)
+
+    def update(self, deltaTime, acceleration, steerDirection):
+        self.handleInputs(deltaTime, acceleration, steerDirection)
+
+        collisions = self.moveCars(deltaTime)
+        self.speed[collisions] = 0
+
+        progressChange, passed = self.updateProgress()
+        self.checkpointIndex[passed] = (self.checkpointIndex[passed] + 1) % len(self.track.checkpoints)
+        self.lap[passed & (self.checkpointIndex == 1)] += 1
+
+        return collisions, passed, progressChange
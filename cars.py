@@ -1,12 +1,82 @@
-from config import CAMERA_SCROLL_SPEED, SCREEN_WIDTH, SCREEN_HEIGHT, CHECKPOINT_REWARD, CRASH_REWARD, MAX_IDLE_TIMESTEPS, SPEED_REWARD, IDLE_REWARD, LAP_REWARD
+from config import ROTATION_RESOLUTION, CAMERA_SCROLL_SPEED, SCREEN_WIDTH, SCREEN_HEIGHT, CHECKPOINT_REWARD, CRASH_REWARD, MAX_IDLE_TIMESTEPS, SPEED_REWARD, IDLE_REWARD, LAP_REWARD, PROGRESS_REWARD
 
 import pygame
-import torch
+import numpy as np
 import random
 import math
+import time
+
+import instrumentation
+
+class RotationCache:
+    def __init__(self, image, resolution=ROTATION_RESOLUTION):
+        self.resolution = resolution
+        self.steps = round(360 / resolution)
+
+        # Every rotated image and its collision mask are created once so cars never rotate images while moving
+        self.images = []
+        self.masks = []
+        for step in range(self.steps):
+            rotatedImage = pygame.transform.rotate(image, -step * resolution)
+
+            self.images.append(rotatedImage)
+            self.masks.append(pygame.mask.from_surface(rotatedImage))
+
+        self.outlines = None
+
+    def getIndex(self, direction):
+        # Round the direction to the nearest stored angle
+        return round(direction / self.resolution) % self.steps
+
+    def getRotation(self, direction):
+        index = self.getIndex(direction)
+        return self.images[index], self.masks[index]
+
+    def getOutlines(self):
+        # Image sizes and the edge pixels of every mask as arrays so many cars can be collision checked at once
+        if self.outlines is None:
+            imageSizes = np.array([image.get_size() for image in self.images])
+            edges = []
+
+            for mask in self.masks:
+                maskSurface = mask.to_surface(setcolor=(255, 255, 255, 255), unsetcolor=(0, 0, 0, 0))
+                solid = np.pad(pygame.surfarray.array_alpha(maskSurface) > 0, 1)
+
+                # A solid pixel is on the edge if any of its four neighbours is empty
+                interior = solid[1:-1, 1:-1] & solid[:-2, 1:-1] & solid[2:, 1:-1] & solid[1:-1, :-2] & solid[1:-1, 2:]
+                edges.append(np.argwhere(solid[1:-1, 1:-1] & ~interior))
+
+            # Pad every outline to the same length by repeating its first point
+            outlineLength = max(len(edge) for edge in edges)
+            outlineOffsets = np.array([np.concatenate([edge, np.repeat(edge[:1], outlineLength - len(edge), axis=0)]) for edge in edges])
+
+            self.outlines = imageSizes, outlineOffsets
+
+        return self.outlines
+
+    def getMemoryUsage(self):
+        # Bytes used by the pixels of every image and the bits of every mask
+        imageBytes = sum(image.get_width() * image.get_height() * image.get_bytesize() for image in self.images)
+        maskBytes = sum(mask.get_size()[0] * mask.get_size()[1] // 8 for mask in self.masks)
+
+        return imageBytes + maskBytes
+
+# Rotation caches are shared between every car with the same image
+rotationCaches = {}
+
+def getRotationCache(image):
+    if image not in rotationCaches:
+        rotationCaches[image] = RotationCache(image)
+
+    return rotationCaches[image]
+
+def buildRotationCaches(images):
+    # Building the caches up front so the first race or training episode does not stall
+    for image in images:
+        getRotationCache(image)
 
 class Car:
-    def __init__(self, x, y, direction, image, track):
+    def __init__(self, x, y, direction, image, track, progress=None):
         self.maxSpeed = 800
         self.acceleration = 300
 
@@ -27,8 +97,8 @@ class Car:
         self.track = track
 
         self.image = image
-        self.rotatedImage = pygame.transform.rotate(self.image, -self.direction)
-        self.mask = pygame.mask.from_surface(self.image)
+        self.rotationCache = getRotationCache(image)
+        self.rotatedImage, self.mask = self.rotationCache.getRotation(self.direction)
         self.maskOffset = (0, 0)
 
         # Start centered on spawn point instead of the top left of the car being on the spawn point
@@ -41,6 +111,9 @@ class Car:
         self.imageRect = self.rotatedImage.get_rect()
         self.imageRect.center = self.rect.center
 
+        # Distance along the track from the finish line, looked up unless the starting position's progress is already known
+        self.progress = track.getProgress(self.rect.center) if progress is None else progress
+
     def handleInputs(self, deltaTime, acceleration, steerDirection):
         if acceleration == 1:
             if self.speed >= 0:
@@ -81,8 +154,7 @@ class Car:
             angularVelocity = self.speed / turningRadius
             directionChange = math.degrees(angularVelocity * deltaTime)
 
-            newImage = pygame.transform.rotate(self.image, -(self.direction + directionChange))
-            newMask = pygame.mask.from_surface(newImage)
+            newImage, newMask = self.rotationCache.getRotation(self.direction + directionChange)
 
             newImageRect = newImage.get_rect()
             newImageRect.center = self.rect.center
@@ -114,31 +186,40 @@ class Car:
 
         return (overlapX or overlapY)
 
-    def collideCheckpoint(self, checkpoint):
-        innerRect = pygame.Rect(0, 0, self.rect.width // 2, self.rect.height // 2)
-        innerRect.center = self.rect.center
+    def updateProgress(self):
+        # Returns the distance moved along the track and whether the next checkpoint has been passed
+        previousProgress = self.progress
+        self.progress = self.track.getProgress(self.rect.center, previousProgress)
 
-        if innerRect.clipline(checkpoint[0], checkpoint[1]):
-            return True
+        return self.track.getProgressChange(previousProgress, self.progress), self.track.checkCheckpointPassed(self.progress, self.checkpointIndex)
 
-        return False
+    def getRaceProgress(self):
+        # Laps completed plus the fraction of the current lap, so cars can be ranked during a race
+        return self.lap - 1 + self.progress / self.track.trackLength
 
-    def update(self, deltaTime, acceleration, steerDirection):
+    def passCheckpoint(self):
+        self.checkpointIndex += 1
+
+        if self.checkpointIndex > len(self.track.checkpoints) - 1:
+            self.checkpointIndex = 0
+
+        if self.checkpointIndex == 1:
+            self.lap += 1
+
+    def drive(self, deltaTime, acceleration, steerDirection):
+        # Moving the car without updating its progress, so the progress of every car in a race can be found together by updateCarProgresses
         self.handleInputs(deltaTime, acceleration, steerDirection)
         
         collision = self.moveCar(deltaTime)
         if collision:
             self.speed = 0
 
-        nextCheckpoint = self.track.checkpoints[self.checkpointIndex]
-        if self.collideCheckpoint(nextCheckpoint):
-            self.checkpointIndex += 1
-
-            if self.checkpointIndex > len(self.track.checkpoints) - 1:
-                self.checkpointIndex = 0
+    def update(self, deltaTime, acceleration, steerDirection):
+        self.drive(deltaTime, acceleration, steerDirection)
 
-            if self.checkpointIndex == 1:
-                self.lap += 1
+        _, checkpointPassed = self.updateProgress()
+        if checkpointPassed:
+            self.passCheckpoint()
 
     def getCameraOffset(self, cameraOffset, deltaTime):
         xTrueOffset = self.x - SCREEN_WIDTH / 2
@@ -153,8 +234,8 @@ class Car:
         screen.blit(self.rotatedImage, (self.imageRect.x - cameraOffset.x, self.imageRect.y - cameraOffset.y))
 
 class CarAgent(Car):
-    def __init__(self, x, y, direction, image, track, model, device, training):
-        super().__init__(x, y, direction, image, track)
+    def __init__(self, x, y, direction, image, track, inferenceEngine, training, progress=None):
+        super().__init__(x, y, direction, image, track, progress)
         
         # Distance sensors that will provide input to the neural network
         self.sensors= [
@@ -172,31 +253,27 @@ class CarAgent(Car):
         if self.training:
             self.idleTimesteps = 0 
 
-        self.model = model
-        self.device = device
+        # Anything with a selectActions method that takes a (states, inputs) array, so several agents can share one forward pass
+        self.inferenceEngine = inferenceEngine
 
     def getDistances(self):
+        if instrumentation.enabled:
+            startTime = time.perf_counter()
+
         distances = []
 
         for sensor in self.sensors:
             # Calculate angle
             sensorAngle = math.radians(self.direction + sensor)
-            # Normalise angle
-            directionVector = pygame.Vector2(math.cos(sensorAngle), math.sin(sensorAngle))
-
-            # Default distance will be equal to the max distance checked by the sensor
-            sensorDistance = self.maxDistance
-            # Iterate until position of sensor is out of bounds
-            # Iterating every 10 pixels to increase efficiency while sacrificing accuracy
-            for distance in range(0, self.maxDistance, 10):
-                position = self.imageRect.center + directionVector * distance
-
-                if self.track.checkCollideAtPoint(position):
-                    sensorDistance = distance
-                    break
-            
+
+            # The track's distance field lets each sensor jump straight towards the nearest wall instead of checking every 10 pixels
+            sensorDistance = self.track.castRay(self.imageRect.center, sensorAngle, self.maxDistance)
+
             # Normalise distance
-            distances.append(sensorDistance / self.maxDistance)
+            distances.append(min(sensorDistance, self.maxDistance) / self.maxDistance)
+
+        if instrumentation.enabled:
+            instrumentation.addPhaseTime("sensors", startTime)
 
         return distances
 
@@ -207,25 +284,29 @@ class CarAgent(Car):
             *self.getDistances(),
         ]
 
-        return torch.tensor(state, dtype=torch.float32, device=self.device).unsqueeze(0)
+        return np.array([state], dtype=np.float32)
 
-    def selectAction(self, state):
-        # Calculate Q-Values
-        QValues = self.model(state)
-        
-        # Get the best action
-        selectedAction = QValues.argmax()
+    def selectAction(self):
+        # Get the best action for the current state
+        if instrumentation.enabled:
+            startTime = time.perf_counter()
+
+        selectedAction = int(self.inferenceEngine.selectActions(self.getState())[0])
+
+        if instrumentation.enabled:
+            instrumentation.addPhaseTime("selectAction", startTime)
 
+        return self.getActionValues(selectedAction)
+
+    def getActionValues(self, selectedAction):
         # Convert index of best action to acceleration and turning value
         accelerationAction = (selectedAction // 3) - 1
         turningAction = (selectedAction % 3) - 1
 
         return accelerationAction, turningAction
 
-    def update(self, deltaTime, explorationThreshold=0):
-        # Get current state so it can be fed into the neural network
-        state = self.getState()
-
+    def update(self, deltaTime, explorationThreshold=0, selectedAction=None):
+        # The best action can be chosen beforehand for a batch of agents by selectAgentActions
         if self.training:
             reward = 0
             crashed = False
@@ -236,20 +317,32 @@ class CarAgent(Car):
 
             if sample > explorationThreshold:
                 # Select best action
-                accelerationAction, turningAction = self.selectAction(state)
+                if selectedAction is None:
+                    accelerationAction, turningAction = self.selectAction()
+                else:
+                    accelerationAction, turningAction = self.getActionValues(selectedAction)
             else:
                 # Selecting random action
                 accelerationAction = random.choice([-1, 0, 1])
                 turningAction = random.choice([-1, 0, 1])
-        else:
+        elif selectedAction is None:
             # Select best action
-            accelerationAction, turningAction = self.selectAction(state)
+            accelerationAction, turningAction = self.selectAction()
+        else:
+            accelerationAction, turningAction = self.getActionValues(selectedAction)
 
         # Update car position and direction according to inputs
         self.handleInputs(deltaTime, accelerationAction, turningAction)
         
         # Check if car has crashed
+        if instrumentation.enabled:
+            startTime = time.perf_counter()
+
         collision = self.moveCar(deltaTime)
+
+        if instrumentation.enabled:
+            instrumentation.addPhaseTime("moveCar", startTime)
+
         if collision:
             self.speed = 0
 
@@ -257,9 +350,9 @@ class CarAgent(Car):
                 reward += CRASH_REWARD
                 crashed = True
 
-        # Check whether car has crossed a checkpoint
-        nextCheckpoint = self.track.checkpoints[self.checkpointIndex]
-        if self.collideCheckpoint(nextCheckpoint):
+        # Check whether car has passed a checkpoint
+        progressChange, checkpointPassed = self.updateProgress()
+        if checkpointPassed:
             self.checkpointIndex += 1
 
             if self.training:
@@ -293,6 +386,9 @@ class CarAgent(Car):
             # Only add speed reward if speed is positive
             reward += max(0, self.speed) * SPEED_REWARD
 
+            # Reward for moving along the track, which is negative when driving backwards
+            reward += progressChange * PROGRESS_REWARD
+
             # If the agent does not get any reward for a long time then truncate the episode and punish it
             self.idleTimesteps += 1
 
@@ -305,4 +401,72 @@ class CarAgent(Car):
         return collision
             
     def draw(self, screen, cameraOffset):
-        screen.blit(self.rotatedImage, (self.imageRect.x - cameraOffset[0], self.imageRect.y - cameraOffset[1]))
\ No newline at end of file
+        screen.blit(self.rotatedImage, (self.imageRect.x - cameraOffset[0], self.imageRect.y - cameraOffset[1]))
+
+def getAgentStates(agents):
+    # Same inputs as CarAgent.getState for every agent, with all of their sensors cast together
+    if instrumentation.enabled:
+        startTime = time.perf_counter()
+
+    track = agents[0].track
+    sensors = np.array(agents[0].sensors)
+    maxDistance = agents[0].maxDistance
+
+    centres = np.array([agent.imageRect.center for agent in agents], dtype=np.float64)
+    directions = np.array([agent.direction for agent in agents], dtype=np.float64)
+
+    sensorAngles = np.radians(directions[:, None] + sensors[None, :]).reshape(-1)
+    sensorX = np.repeat(centres[:, 0], len(sensors))
+    sensorY = np.repeat(centres[:, 1], len(sensors))
+    distances = track.castRays(sensorX, sensorY, sensorAngles, maxDistance).reshape(len(agents), len(sensors))
+
+    states = np.empty((len(agents), len(sensors) + 1), dtype=np.float32)
+    states[:, 0] = [agent.speed / agent.maxSpeed for agent in agents]
+    states[:, 1:] = distances / maxDistance
+
+    if instrumentation.enabled:
+        instrumentation.addPhaseTime("sensors", startTime)
+
+    return states
+
+def updateCarProgresses(cars):
+    # Same as Car.update after driving for every car in a race, with the progress of all of them found in one search
+    track = cars[0].track
+    count = len(cars)
+    xs = np.array([car.rect.centerx for car in cars], dtype=np.float64)
+    ys = np.array([car.rect.centery for car in cars], dtype=np.float64)
+    progresses = track.getProgresses(xs, ys, np.fromiter([car.progress for car in cars], np.float64, count))
+    passed = track.checkCheckpointPassed(progresses, np.fromiter([car.checkpointIndex for car in cars], np.int64, count))
+
+    for car, progress in zip(cars, progresses.tolist()):
+        car.progress = progress
+
+    for index in np.flatnonzero(passed):
+        cars[index].passCheckpoint()
+
+def selectAgentActions(agents):
+    # Best action index for every agent, with the agents that share an inference engine evaluated in one forward pass
+    if instrumentation.enabled:
+        startTime = time.perf_counter()
+
+    groups = {}
+    for index, agent in enumerate(agents):
+        groups.setdefault(id(agent.inferenceEngine), []).append(index)
+
+    selectedActions = [None] * len(agents)
+    for indices in groups.values():
+        # A lone agent, as in a race against one opponent, is quicker to evaluate without gathering a batch
+        if len(indices) == 1:
+            states = agents[indices[0]].getState()
+        else:
+            states = getAgentStates([agents[index] for index in indices])
+
+        actions = agents[indices[0]].inferenceEngine.selectActions(states).tolist()
+
+        for index, action in zip(indices, actions):
+            selectedActions[index] = action
+
+    if instrumentation.enabled:
+        instrumentation.addPhaseTime("selectAction", startTime)
+
+    return selectedActions
@@ -13,6 +13,8 @@ CAR_HEIGHT = 106
 ASSETS_PATH = "Assets"
 TRACKS_PATH =  ASSETS_PATH + "/Tracks"
 MODELS_PATH = ASSETS_PATH +  "/Models"
+CHECKPOINTS_PATH = ASSETS_PATH + "/Checkpoints"
+INSTRUMENTATION_PATH = ASSETS_PATH + "/Instrumentation"
 
 # Initialising fonts
 FONT_16 = pygame.font.Font(f"{ASSETS_PATH}/Fonts/font.otf", 16)
@@ -24,6 +26,9 @@ FONT_128 = pygame.font.Font(f"{ASSETS_PATH}/Fonts/font.otf", 128)
 BLUE_CAR_IMAGE = pygame.transform.scale(pygame.image.load(f"{ASSETS_PATH}/Cars/BlueCar.png"), (CAR_WIDTH, CAR_HEIGHT))
 RED_CAR_IMAGE = pygame.transform.scale(pygame.image.load(f"{ASSETS_PATH}/Cars/RedCar.png"), (CAR_WIDTH, CAR_HEIGHT))
 
+# Angle in degrees between the pre-rotated car images and masks
+ROTATION_RESOLUTION = 1
+
 FPS = 60
 CAMERA_SCROLL_SPEED = 6
 
@@ -43,6 +48,8 @@ BUTTON_HOVER_THICKNESS = 7
 
 CHECKPOINT_FREQUENCY = 5
 TOTAL_LAPS = 3
+# AI cars in race mode, which still holds the frame rate with up to 50
+RACE_OPPONENTS = 20
 COUNTDOWN_DURATION = 5
 
 NETWORK_INPUT_SIZE = 6
@@ -58,10 +65,25 @@ CHECKPOINT_REWARD = 0.1
 LAP_REWARD = 0.5
 CRASH_REWARD = -0.5
 IDLE_REWARD = -1
+# Reward for every pixel driven along the track, 0 only rewards checkpoints
+PROGRESS_REWARD = 0
 
 TRAINING_EPISODES = 1000
+# Training is saved every this many episodes, and when the window is closed, so it can be resumed
+CHECKPOINT_INTERVAL = 50
+
+# Worker processes that each step a batch of cars, 0 trains a single car in the main process
+TRAINING_WORKERS = 0
+CARS_PER_WORKER = 16
+# Steps collected by every car between each batch of updates and the number of updates done with them
+ROLLOUT_STEPS = 16
+UPDATES_PER_ROLLOUT = 16
 VISUALISATION_STEP = 10
 MAX_VISUALISATION_TIME = 60
+# Show episodes in a separate window so training does not pause while they are visualised
+ASYNC_VISUALISATION = True
+# Record per-phase timers and counters to JSONL and CSV files in INSTRUMENTATION_PATH, one row per episode or race
+INSTRUMENTATION = False
 
 BATCH_SIZE = 128
 DISCOUNT_FACTOR = 0.99
@@ -69,4 +91,16 @@ EXPLORATION_START = 1
 EXPLORATION_END = 0.1
 EXPLORATION_DECAY = 0.01
 TARGET_UPDATE_STRENGTH = 0.1
-LR = 1e-4
\ No newline at end of file
+# Number of training steps between each soft update of the target network
+TARGET_UPDATE_INTERVAL = 1
+LR = 1e-4
+# Library the networks are trained with, "torch" or "numpy"
+LEARNER_BACKEND = "torch"
+
+# Sample experiences in proportion to their TD error instead of uniformly, only supported by the torch learner
+PRIORITISED_REPLAY = False
+PRIORITY_EXPONENT = 0.6
+PRIORITY_OFFSET = 1e-5
+# Importance sampling correction starts weak and reaches full strength after this many batches
+IMPORTANCE_SAMPLING_START = 0.4
+IMPORTANCE_SAMPLING_STEPS = 100000
\ No newline at end of file
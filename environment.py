@@ -0,0 +1,199 @@
+from config import NETWORK_INPUT_SIZE, NETWORK_ACTION_SIZE, TRAINING_TIMESTEP, MAX_TIMESTEPS, MAX_IDLE_TIMESTEPS, SPEED_REWARD, CHECKPOINT_REWARD, LAP_REWARD, CRASH_REWARD, IDLE_REWARD, PROGRESS_REWARD, RED_CAR_IMAGE
+
+import multiprocessing
+import numpy as np
+
+from carBatch import CarBatch
+from cars import CarAgent
+from modelNumpy import NeuralNetwork
+from track import Track
+
+class VectorEnvironment:
+    def __init__(self, track, count, seed=None):
+        self.track = track
+        self.count = count
+
+        self.cars = CarBatch(track, count, RED_CAR_IMAGE)
+
+        # The sensors are taken from a single agent so both kinds of environment see the same inputs
+        spawnPoint, spawnAngle = track.getSpawnPosition()
+        template = CarAgent(spawnPoint.x, spawnPoint.y, spawnAngle, RED_CAR_IMAGE, track, None, True)
+        self.sensors = np.array(template.sensors)
+        self.maxDistance = template.maxDistance
+
+        # Acting is done with a NumPy copy of the policy network so workers do not need to build autograd graphs
+        self.policyNet = NeuralNetwork(NETWORK_INPUT_SIZE, NETWORK_ACTION_SIZE)
+        self.randomGenerator = np.random.default_rng(seed)
+
+        self.idleTimesteps = np.zeros(count, dtype=np.int64)
+        self.episodeTimesteps = np.zeros(count, dtype=np.int64)
+        self.episodeRewards = np.zeros(count)
+
+        self.states = self.getStates()
+
+    def getStates(self):
+        # Same inputs as CarAgent.getState for every car at once
+        centres = self.cars.getImageCentres()
+
+        sensorAngles = np.radians(self.cars.direction[:, None] + self.sensors[None, :]).reshape(-1)
+        sensorX = np.repeat(centres[:, 0], len(self.sensors))
+        sensorY = np.repeat(centres[:, 1], len(self.sensors))
+        distances = self.track.castRays(sensorX, sensorY, sensorAngles, self.maxDistance).reshape(self.count, len(self.sensors))
+
+        states = np.empty((self.count, NETWORK_INPUT_SIZE), dtype=np.float32)
+        states[:, 0] = self.cars.speed / self.cars.maxSpeed
+        states[:, 1:] = distances / self.maxDistance
+
+        return states
+
+    def selectActions(self, states, explorationThreshold):
+        # Best action from the policy network for every car
+        actions = self.policyNet.forwardPass(states).argmax(axis=1)
+
+        # Random actions for the cars that are exploring
+        exploring = self.randomGenerator.random(self.count) <= explorationThreshold
+        actions[exploring] = self.randomGenerator.integers(0, NETWORK_ACTION_SIZE, exploring.sum())
+
+        return actions
+
+    def step(self, actions):
+        # Convert action indexes to acceleration and turning values
+        accelerationActions = actions // 3 - 1
+        turningActions = actions % 3 - 1
+
+        crashed, crossedCheckpoint, progressChange = self.cars.update(TRAINING_TIMESTEP, accelerationActions, turningActions)
+
+        # Same rewards as CarAgent.update when training
+        rewards = np.zeros(self.count)
+        rewards[crashed] += CRASH_REWARD
+
+        rewards[crossedCheckpoint] += CHECKPOINT_REWARD
+        self.idleTimesteps[crossedCheckpoint] = 0
+
+        completedLap = crossedCheckpoint & (self.cars.checkpointIndex == 1)
+        rewards[completedLap] += LAP_REWARD
+        truncated = completedLap & (self.cars.lap > 1)
+
+        nextStates = self.getStates()
+
+        # Only add speed reward if speed is positive
+        rewards += np.maximum(0, self.cars.speed) * SPEED_REWARD
+
+        rewards += progressChange * PROGRESS_REWARD
+
+        # Punish cars that have not earned any reward for a long time
+        self.idleTimesteps += 1
+        idle = self.idleTimesteps >= MAX_IDLE_TIMESTEPS
+        rewards[idle] += IDLE_REWARD
+        truncated |= idle
+
+        self.episodeTimesteps += 1
+        truncated |= self.episodeTimesteps >= MAX_TIMESTEPS
+
+        self.episodeRewards += rewards
+
+        # Record and restart every finished episode
+        finished = np.flatnonzero(crashed | truncated)
+        finishedEpisodes = list(zip(self.episodeRewards[finished].tolist(), self.episodeTimesteps[finished].tolist()))
+
+        self.cars.reset(finished)
+        self.idleTimesteps[finished] = 0
+        self.episodeTimesteps[finished] = 0
+        self.episodeRewards[finished] = 0
+
+        self.states = self.getStates() if len(finished) > 0 else nextStates
+
+        return nextStates, rewards, crashed, finishedEpisodes
+
+    def collect(self, weights, explorationThreshold, steps):
+        # Load the latest policy weights
+        self.policyNet.loadWeights(*weights)
+
+        states, actions, rewards, nextStates, crashed = [], [], [], [], []
+        finishedEpisodes = []
+
+        for _ in range(steps):
+            stepStates = self.states
+            stepActions = self.selectActions(stepStates, explorationThreshold)
+            stepNextStates, stepRewards, stepCrashed, stepFinishedEpisodes = self.step(stepActions)
+
+            states.append(stepStates)
+            actions.append(stepActions)
+            rewards.append(stepRewards)
+            nextStates.append(stepNextStates)
+            crashed.append(stepCrashed)
+            finishedEpisodes += stepFinishedEpisodes
+
+        # One array for each part of the transitions, with the crashed flags marking transitions without a next state
+        transitions = (np.concatenate(states), np.concatenate(actions), np.concatenate(rewards).astype(np.float32), np.concatenate(nextStates), np.concatenate(crashed))
+
+        return transitions, finishedEpisodes
+
+def runWorker(connection, trackPath, count, seed):
+    # Each worker compiles its own copy of the track and steps its own batch of cars
+    track = Track(trackPath)
+    track.initialiseTrack()
+
+    environment = VectorEnvironment(track, count, seed)
+
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+
+        connection.send(environment.collect(*message))
+
+    connection.close()
+
+class ParallelEnvironment:
+    def __init__(self, trackPath, workers, carsPerWorker):
+        # Spawning fresh processes instead of forking so workers do not inherit the game window
+        context = multiprocessing.get_context("spawn")
+
+        self.connections = []
+        self.processes = []
+
+        for index in range(workers):
+            connection, workerConnection = context.Pipe()
+
+            process = context.Process(target=runWorker, args=(workerConnection, trackPath, carsPerWorker, index), daemon=True)
+            process.start()
+
+            self.connections.append(connection)
+            self.processes.append(process)
+
+        self.count = workers * carsPerWorker
+        self.collecting = False
+
+    def startCollecting(self, weights, explorationThreshold, steps):
+        # Workers step their cars in the background until the transitions are received
+        for connection in self.connections:
+            connection.send((weights, explorationThreshold, steps))
+
+        self.collecting = True
+
+    def receiveTransitions(self):
+        results = [connection.recv() for connection in self.connections]
+        self.collecting = False
+
+        transitions = tuple(np.concatenate(parts) for parts in zip(*(result[0] for result in results)))
+        finishedEpisodes = [episode for result in results for episode in result[1]]
+
+        return transitions, finishedEpisodes
+
+    def close(self):
+        # A worker sending a rollout bigger than the pipe buffer waits until it is read, so it would never see the message to stop
+        if self.collecting:
+            for connection in self.connections:
+                connection.recv()
+
+            self.collecting = False
+
+        for connection in self.connections:
+            connection.send(None)
+
+        # Workers are only stopped by force if they are stuck
+        for process in self.processes:
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
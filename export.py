@@ -0,0 +1,65 @@
+import argparse
+import os
+
+# Exporting never needs a window, so pygame uses its dummy video driver
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame
+import torch
+
+pygame.init()
+
+from config import MODELS_PATH, NETWORK_INPUT_SIZE, NETWORK_ACTION_SIZE
+from model import NeuralNetwork, scriptPolicy, quantisePolicy, getNumpyNetwork
+from modelNumpy import saveNetwork
+
+def loadTrainedModel(modelName):
+    model = NeuralNetwork(NETWORK_INPUT_SIZE, NETWORK_ACTION_SIZE)
+    model.load_state_dict(torch.load(f"{MODELS_PATH}/{modelName}.model", map_location="cpu"))
+
+    return model.eval()
+
+def exportOnnx(model, path):
+    # ONNX export needs the onnx package, which the game itself never uses
+    try:
+        torch.onnx.export(model, torch.zeros((1, NETWORK_INPUT_SIZE)), path, input_names=["states"], output_names=["qValues"], dynamic_axes={"states": {0: "batch"}, "qValues": {0: "batch"}})
+    except ImportError as error:
+        print(f"Skipping {path}: {error}")
+        return False
+
+    return True
+
+def exportModel(modelName, quantise=False, onnx=False, numpy=False):
+    model = loadTrainedModel(modelName)
+    paths = [f"{MODELS_PATH}/{modelName}.pt"]
+
+    scriptPolicy(model).save(paths[-1])
+
+    if quantise:
+        paths.append(f"{MODELS_PATH}/{modelName}.int8.pt")
+        scriptPolicy(quantisePolicy(loadTrainedModel(modelName))).save(paths[-1])
+
+    if onnx:
+        paths.append(f"{MODELS_PATH}/{modelName}.onnx")
+        if not exportOnnx(model, paths[-1]):
+            paths.pop()
+
+    if numpy:
+        paths.append(f"{MODELS_PATH}/{modelName}.npz")
+        saveNetwork(getNumpyNetwork(model), paths[-1])
+
+    for path in paths:
+        print(f"Saved {path} ({os.path.getsize(path) / 1024:.1f}KB)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a trained model so it can be loaded without the training code")
+    parser.add_argument("model", help=f"name of a model in {MODELS_PATH}, without .model")
+    parser.add_argument("--quantise", action="store_true", help="also save an int8 copy, which play mode loads instead when it exists")
+    parser.add_argument("--onnx", action="store_true", help="also save an ONNX copy, which needs the onnx package")
+    parser.add_argument("--numpy", action="store_true", help="also save a NumPy copy, which play mode loads without importing torch")
+    arguments = parser.parse_args()
+
+    if not os.path.isfile(f"{MODELS_PATH}/{arguments.model}.model"):
+        parser.error(f"no model called {arguments.model} in {MODELS_PATH}")
+
+    exportModel(arguments.model, arguments.quantise, arguments.onnx, arguments.numpy)
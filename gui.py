@@ -2,6 +2,18 @@ from config import SCREEN_WIDTH, SCREEN_HEIGHT, TRACK_WIDTH, TRACK_HEIGHT, BACKG
 
 import pygame
 
+def formatStopWatch(stopWatchTime):
+    # Modulo 60 to remove minutes
+    seconds = stopWatchTime % 60
+
+    # Floor division by 60 to remove seconds
+    minutes = int(stopWatchTime // 60)
+
+    if minutes > 0:
+        return f"{minutes:02d}:{seconds:05.2f}" # Pad seconds and minutes with a 0 if only one digit and round to 2 decimal places for example: 1:5.323 because 01:05.32
+    else:
+        return f"{seconds:05.2f}"
+
 class GuiElement:
     def __init__(self, x, y, width, height):
         self.rect = pygame.Rect(SCREEN_WIDTH * x, SCREEN_HEIGHT * y, SCREEN_WIDTH * width, SCREEN_HEIGHT * height)
@@ -39,15 +51,38 @@ class Minimap(GuiElement):
         self.agentColour = (255, 255, 0)
         self.dotSize = 3
 
-    def draw(self, screen, player, agent):
+    def draw(self, screen, player, agents):
         self.surface.blit(self.trackSurface, (0, 0))
         
         pygame.draw.rect(self.surface, self.borderColour, self.rect, self.borderThickness)
+
+        # The player is drawn last so it stays visible when agents are close to it
+        for agent in agents:
+            pygame.draw.circle(self.surface, self.agentColour, (agent.rect.center[0] * self.scale, agent.rect.center[1] * self.scale), self.dotSize)
         pygame.draw.circle(self.surface, self.playerColour, (player.rect.center[0] * self.scale, player.rect.center[1] * self.scale), self.dotSize)
-        pygame.draw.circle(self.surface, self.agentColour, (agent.rect.center[0] * self.scale, agent.rect.center[1] * self.scale), self.dotSize)
 
         screen.blit(self.surface, self.rect)
 
+class TrackOverview(GuiElement):
+    def __init__(self, x, y, width, height, track):
+        super().__init__(x, y, width, height)
+
+        # The whole track is scaled down to fit once, then each frame only the car is scaled onto it
+        trackSurface = pygame.Surface((TRACK_WIDTH, TRACK_HEIGHT))
+        trackSurface.fill(BACKGROUND_COLOUR)
+        track.draw(trackSurface, pygame.Vector2(0, 0))
+
+        self.backgroundSurface = pygame.transform.scale(trackSurface, self.rect.size).convert()
+        self.scale = pygame.Vector2(self.rect.width / TRACK_WIDTH, self.rect.height / TRACK_HEIGHT)
+
+    def draw(self, screen, car=None):
+        screen.blit(self.backgroundSurface, self.rect)
+
+        if car is not None:
+            carSize = pygame.Vector2(car.rotatedImage.get_size()).elementwise() * self.scale
+            carPosition = pygame.Vector2(car.imageRect.topleft).elementwise() * self.scale + self.rect.topleft
+            screen.blit(pygame.transform.scale(car.rotatedImage, carSize), carPosition)
+
 class Container(GuiElement):
     def __init__(self, x, y, width, height, backgroundColour, borderColour=(0,0,0), borderThickness=0):
         super().__init__(x, y, width, height)
@@ -0,0 +1,70 @@
+import argparse
+import os
+
+# Training never needs a window, so pygame uses its dummy video driver
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame
+import torch
+
+pygame.init()
+
+from config import TRACKS_PATH, MODELS_PATH, CHECKPOINTS_PATH, INSTRUMENTATION_PATH, RED_CAR_IMAGE, BLUE_CAR_IMAGE, TRAINING_EPISODES, LEARNER_BACKEND
+from cars import buildRotationCaches
+from model import DQNTrainer, getCheckpointEpisode
+from track import Track
+import instrumentation
+
+class HeadlessGame:
+    # Stands in for Game during training, printing progress instead of drawing the training menus
+    def __init__(self, trackName, modelName, device, backend, resume=False):
+        self.device = torch.device(device)
+        self.modelName = modelName
+        self.running = True
+
+        self.track = Track(trackName)
+        self.track.initialiseTrack()
+
+        buildRotationCaches([RED_CAR_IMAGE, BLUE_CAR_IMAGE])
+
+        self.trainer = DQNTrainer(self, backend, f"{CHECKPOINTS_PATH}/{trackName}", resume)
+
+    def trainingMenu(self, episode, steps, reward, explorationThreshold):
+        print(f"Episode {episode} / {TRAINING_EPISODES}  Steps: {steps}  Reward: {round(reward, 2)}  Exploration Rate: {round(explorationThreshold, 3)}", flush=True)
+
+    def checkEndTraining(self):
+        return False
+
+    def visualizeEpisode(self):
+        # Nothing to show, so training always continues
+        return False
+
+    def modelSaveMenu(self):
+        print(f"Saving model {self.modelName} to {MODELS_PATH}", flush=True)
+        return self.modelName
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train an agent without opening a window")
+    parser.add_argument("track", help=f"name of a track in {TRACKS_PATH}, without .json")
+    parser.add_argument("model", help=f"name of the model file saved to {MODELS_PATH}, without .model")
+    parser.add_argument("--device", default="cpu", help="torch device to train on")
+    parser.add_argument("--backend", default=LEARNER_BACKEND, choices=["torch", "numpy"], help="library the networks are trained with")
+    parser.add_argument("--resume", action="store_true", help=f"carry on from the track's checkpoint in {CHECKPOINTS_PATH}")
+    parser.add_argument("--instrument", action="store_true", help=f"record per-phase timers and counters for every episode to {INSTRUMENTATION_PATH}")
+    arguments = parser.parse_args()
+
+    if not os.path.isfile(f"{TRACKS_PATH}/{arguments.track}.json"):
+        parser.error(f"no track called {arguments.track} in {TRACKS_PATH}")
+
+    if arguments.resume:
+        checkpointEpisode = getCheckpointEpisode(f"{CHECKPOINTS_PATH}/{arguments.track}")
+        if checkpointEpisode is None:
+            parser.error(f"no checkpoint for {arguments.track} in {CHECKPOINTS_PATH}")
+
+        print(f"Resuming from episode {checkpointEpisode}", flush=True)
+
+    if arguments.instrument:
+        instrumentation.enabled = True
+
+    game = HeadlessGame(arguments.track, arguments.model, arguments.device, arguments.backend, arguments.resume)
+    game.trainer.train()
@@ -0,0 +1,95 @@
+import time
+import json
+import csv
+import os
+
+from config import INSTRUMENTATION, INSTRUMENTATION_PATH
+
+# Every measurement in the hot paths is behind "if instrumentation.enabled", so when it is off they only cost one attribute lookup
+enabled = INSTRUMENTATION
+
+# Phases can be nested, e.g. sensors happen inside environmentStep, so their times do not add up to the row's time
+PHASES = ["environmentStep", "sensors", "selectAction", "moveCar", "addExperience", "collect", "updateModel", "targetUpdate", "trainingMenu", "visualisation", "checkpoint", "agents", "player", "progress", "drawing"]
+COUNTERS = ["environmentSteps", "gradientSteps", "raycasts", "overlaps"]
+
+# Totals since the last row was written
+phaseTimes = {}
+phaseCalls = {}
+counts = {}
+rowStartTime = time.perf_counter()
+
+outputPath = None
+csvFieldNames = None
+
+def start(name):
+    # Each run gets its own pair of files so rows from different runs are never mixed
+    global outputPath, csvFieldNames
+
+    os.makedirs(INSTRUMENTATION_PATH, exist_ok=True)
+    outputPath = f"{INSTRUMENTATION_PATH}/{name}-{time.strftime('%Y%m%d-%H%M%S')}"
+
+    csvFieldNames = None
+    reset()
+
+def reset():
+    global rowStartTime
+
+    phaseTimes.clear()
+    phaseCalls.clear()
+    counts.clear()
+    rowStartTime = time.perf_counter()
+
+def addPhaseTime(phase, startTime):
+    # Called with the perf_counter time the phase started at
+    phaseTimes[phase] = phaseTimes.get(phase, 0) + time.perf_counter() - startTime
+    phaseCalls[phase] = phaseCalls.get(phase, 0) + 1
+
+def addCount(counter, amount=1):
+    counts[counter] = counts.get(counter, 0) + amount
+
+def getRow(**fields):
+    # The given fields, e.g. the episode number, followed by the timers and counters and the rates worked out from them
+    elapsed = time.perf_counter() - rowStartTime
+    row = dict(fields)
+    row["time"] = elapsed
+
+    for phase in PHASES + sorted(set(phaseTimes) - set(PHASES)):
+        row[f"{phase}Time"] = phaseTimes.get(phase, 0)
+        row[f"{phase}Calls"] = phaseCalls.get(phase, 0)
+
+    for counter in COUNTERS + sorted(set(counts) - set(COUNTERS)):
+        row[counter] = counts.get(counter, 0)
+
+    steps = counts.get("environmentSteps", 0)
+    row["environmentStepsPerSecond"] = steps / elapsed if elapsed > 0 else 0
+    row["gradientStepsPerSecond"] = counts.get("gradientSteps", 0) / elapsed if elapsed > 0 else 0
+    row["raycastsPerStep"] = counts.get("raycasts", 0) / steps if steps > 0 else 0
+    row["overlapsPerStep"] = counts.get("overlaps", 0) / steps if steps > 0 else 0
+
+    return row
+
+def writeRow(**fields):
+    # Appends one row to both files and starts the next row from zero
+    global csvFieldNames
+
+    if outputPath is None:
+        start("run")
+
+    row = getRow(**fields)
+
+    with open(outputPath + ".jsonl", "a") as file:
+        file.write(json.dumps(row) + "\n")
+
+    # The CSV keeps the columns of its first row, so phases only seen later are left to the JSONL file
+    with open(outputPath + ".csv", "a", newline="") as file:
+        writer = csv.DictWriter(file, csvFieldNames or list(row), extrasaction="ignore", restval=0)
+
+        if csvFieldNames is None:
+            csvFieldNames = list(row)
+            writer.writeheader()
+
+        writer.writerow(row)
+
+    reset()
+
+    return row
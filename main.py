@@ -1,15 +1,16 @@
 import pygame
-import torch
 import math
+import time
 import os
 
 pygame.init()
 
-from config import FPS, SCREEN_WIDTH, SCREEN_HEIGHT, ASPECT_RATIO, TRACK_WIDTH, TRACK_HEIGHT, COUNTDOWN_DURATION, COLOUR_SCHEME, BACKGROUND_COLOUR, BLUE_CAR_IMAGE, RED_CAR_IMAGE, BUTTON_BORDER_THICKNESS, BUTTON_HOVER_THICKNESS, MODELS_PATH, NETWORK_INPUT_SIZE, NETWORK_ACTION_SIZE, TRACKS_PATH, MAX_VISUALISATION_TIME, TOTAL_LAPS, VISUALISATION_STEP, TRAINING_EPISODES, FONT_16, FONT_32, FONT_64, FONT_128
-from gui import Container, TextLabel, Button, TextInputBox, Minimap
-from cars import Car, CarAgent
-from model import DQNTrainer, NeuralNetwork
+from config import FPS, SCREEN_WIDTH, SCREEN_HEIGHT, ASPECT_RATIO, TRACK_WIDTH, TRACK_HEIGHT, COUNTDOWN_DURATION, COLOUR_SCHEME, BACKGROUND_COLOUR, BLUE_CAR_IMAGE, RED_CAR_IMAGE, BUTTON_BORDER_THICKNESS, BUTTON_HOVER_THICKNESS, MODELS_PATH, CHECKPOINTS_PATH, NETWORK_INPUT_SIZE, NETWORK_ACTION_SIZE, TRACKS_PATH, MAX_VISUALISATION_TIME, TOTAL_LAPS, RACE_OPPONENTS, VISUALISATION_STEP, ASYNC_VISUALISATION, TRAINING_EPISODES, FONT_16, FONT_32, FONT_64, FONT_128
+from gui import Container, TextLabel, Button, TextInputBox, Minimap, TrackOverview, formatStopWatch
+from cars import Car, CarAgent, buildRotationCaches, selectAgentActions, updateCarProgresses
+from policies import getModelNames, loadInferenceEngine
 from track import Track
+import instrumentation
 
 class Game:
     def __init__(self):
@@ -17,8 +18,12 @@ class Game:
         self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
         pygame.display.set_caption("Racing Game")
 
-        self.device = torch.device("cpu")
-        self.trainer = DQNTrainer(self)
+        # Torch is only imported once an agent is trained, so the menu opens without waiting for it
+        self.device = "cpu"
+        self.trainer = None
+        self.viewer = None
+
+        buildRotationCaches([RED_CAR_IMAGE, BLUE_CAR_IMAGE])
 
         self.running = True
         self.clock = pygame.time.Clock()
@@ -33,11 +38,12 @@ class Game:
     def displayMainMenu(self):
         #Initialising menu buttons
         playButton = Button(0.1, 0.2, 0.2, 0.1, "Play", FONT_32, COLOUR_SCHEME[0], COLOUR_SCHEME[1],COLOUR_SCHEME[0], BUTTON_BORDER_THICKNESS, BUTTON_HOVER_THICKNESS)
-        trackButton = Button(0.1, 0.35, 0.2, 0.1, "Create Track", FONT_32, COLOUR_SCHEME[0], COLOUR_SCHEME[1], COLOUR_SCHEME[0], BUTTON_BORDER_THICKNESS, BUTTON_HOVER_THICKNESS)
-        trainButton = Button(0.1, 0.5, 0.2, 0.1, "Train an Agent", FONT_32, COLOUR_SCHEME[0], COLOUR_SCHEME[1], COLOUR_SCHEME[0], BUTTON_BORDER_THICKNESS, BUTTON_HOVER_THICKNESS)
-        exitButton = Button(0.1, 0.65, 0.2, 0.1, "Exit", FONT_32, COLOUR_SCHEME[0], COLOUR_SCHEME[1], COLOUR_SCHEME[0], BUTTON_BORDER_THICKNESS, BUTTON_HOVER_THICKNESS)
+        raceButton = Button(0.1, 0.35, 0.2, 0.1, "Race", FONT_32, COLOUR_SCHEME[0], COLOUR_SCHEME[1], COLOUR_SCHEME[0], BUTTON_BORDER_THICKNESS, BUTTON_HOVER_THICKNESS)
+        trackButton = Button(0.1, 0.5, 0.2, 0.1, "Create Track", FONT_32, COLOUR_SCHEME[0], COLOUR_SCHEME[1], COLOUR_SCHEME[0], BUTTON_BORDER_THICKNESS, BUTTON_HOVER_THICKNESS)
+        trainButton = Button(0.1, 0.65, 0.2, 0.1, "Train an Agent", FONT_32, COLOUR_SCHEME[0], COLOUR_SCHEME[1], COLOUR_SCHEME[0], BUTTON_BORDER_THICKNESS, BUTTON_HOVER_THICKNESS)
+        exitButton = Button(0.1, 0.8, 0.2, 0.1, "Exit", FONT_32, COLOUR_SCHEME[0], COLOUR_SCHEME[1], COLOUR_SCHEME[0], BUTTON_BORDER_THICKNESS, BUTTON_HOVER_THICKNESS)
 
-        buttons = [playButton, trackButton, trainButton, exitButton]
+        buttons = [playButton, raceButton, trackButton, trainButton, exitButton]
 
         while self.running:
             # Checking if buttons are hovered
@@ -57,18 +63,28 @@ class Game:
                         if hoveredButton == playButton:
                             trackSelected = self.trackSelection()
                             if trackSelected:
-                                model = self.modelSelection()
-                                if model:
+                                inferenceEngine = self.modelSelection()
+                                if inferenceEngine:
+                                    self.track.initialiseTrack()
+                                    self.gameLoop([inferenceEngine], 1)
+                        elif hoveredButton == raceButton:
+                            trackSelected = self.trackSelection()
+                            if trackSelected:
+                                inferenceEngines = self.raceModelSelection()
+                                if inferenceEngines:
                                     self.track.initialiseTrack()
-                                    self.gameLoop(model)
+                                    self.gameLoop(inferenceEngines, RACE_OPPONENTS)
                         elif hoveredButton == trackButton:
                             while self.trackSelection(True):
                                 self.trackEditor()
                         elif hoveredButton == trainButton:
                             trackSelected = self.trackSelection()
                             if trackSelected:
-                                self.track.initialiseTrack()
-                                self.trainer.train()
+                                self.trainer = self.trainerSelection()
+                                if self.trainer:
+                                    self.track.initialiseTrack()
+                                    self.trainer.train()
+                                    self.closeViewer()
                         elif hoveredButton == exitButton:
                             self.running = False
 
@@ -185,27 +201,62 @@ class Game:
             updateButtons = False
 
     def modelSelection(self):
-        models = []
-
-        # Creating track buttons from diirectory
-        modelPaths = os.listdir(MODELS_PATH)
-        for modelPath in modelPaths:
-            # Get rid of .model
-            strippedPath = modelPath[:-6]
-            models.append(strippedPath)
+        # Creating model buttons from directory
+        models = getModelNames()
 
         selectedModel = self.selectionMenu(models, "Select Model:")
 
         if selectedModel != None:
-            selectedModelPath = modelPaths[selectedModel]
-            
-            model = NeuralNetwork(NETWORK_INPUT_SIZE, NETWORK_ACTION_SIZE).to(self.device)
-            model.load_state_dict(torch.load(f"{MODELS_PATH}/{selectedModelPath}"))
-
-            return model
+            return loadInferenceEngine(models[selectedModel], self.device)
         else:
             return False
-        
+
+    def raceModelSelection(self):
+        # Models are picked one at a time until the race is started, and the opponents take turns using each of them
+        models = getModelNames()
+        selectedModels = []
+
+        while True:
+            options = models
+            if len(selectedModels) > 0:
+                options = ["Start Race"] + options
+
+            selectedOption = self.selectionMenu(options, f"Select Opponent Models ({len(selectedModels)} selected):")
+
+            if selectedOption == None:
+                return False
+
+            if len(selectedModels) > 0:
+                if selectedOption == 0:
+                    # Each model is loaded once, so opponents using the same model share an inference engine and their actions are chosen in one forward pass
+                    inferenceEngines = {}
+                    for model in selectedModels:
+                        if model not in inferenceEngines:
+                            inferenceEngines[model] = loadInferenceEngine(model, self.device)
+
+                    return [inferenceEngines[model] for model in selectedModels]
+
+                # Skipping past the start option
+                selectedOption -= 1
+
+            selectedModels.append(models[selectedOption])
+
+    def trainerSelection(self):
+        from model import DQNTrainer, getCheckpointEpisode
+
+        # Training on a track carries on from its checkpoint if there is one and the player chooses to
+        checkpointPath = f"{CHECKPOINTS_PATH}/{self.track.getFilePath()}"
+        checkpointEpisode = getCheckpointEpisode(checkpointPath)
+
+        if checkpointEpisode is None:
+            return DQNTrainer(self, checkpointPath=checkpointPath)
+
+        selectedOption = self.selectionMenu([f"Resume from episode {checkpointEpisode}", "Start again"], "Training Checkpoint Found:")
+
+        if selectedOption == None:
+            return False
+
+        return DQNTrainer(self, checkpointPath=checkpointPath, resume=selectedOption == 0)
 
     def trackSelection(self, allowNewTrack=False):
         tracks = []
@@ -215,7 +266,7 @@ class Game:
             tracks.append("New Track")
 
         # Get track paths from diirectory
-        trackPaths = os.listdir(TRACKS_PATH)
+        trackPaths = [trackPath for trackPath in os.listdir(TRACKS_PATH) if trackPath.endswith(".json")]
         for trackPath in trackPaths:
             # Get rid of .json
             strippedPath = trackPath[:-5]
@@ -253,12 +304,14 @@ class Game:
         # Scaling down the track to fit on the screen
         zoom = int(TRACK_WIDTH / SCREEN_WIDTH)
         trackSurface = pygame.Surface((TRACK_WIDTH, TRACK_HEIGHT))
+        scaledTrackSurface = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
         selectedPoint = None
 
         firstDraw = True
         editorRunning = True
         while self.running and editorRunning:
             updateTrack = False
+            movedPoint = None
             hoveredElement = None
             for element in elements:
                 if element.updateHovered(pygame.mouse.get_pos()):
@@ -293,8 +346,8 @@ class Game:
                                         trackNameLabel.textColour = COLOUR_SCHEME[5]
                                         trackNameLabel.updateText("INVALID TRACK:")
                                     else:
-                                        self.track.initialiseTrack()
                                         self.track.exportTrack(trackName)
+                                        self.track.initialiseTrack()
                                         editorRunning = False
 
                             # User is editing the track name
@@ -328,9 +381,9 @@ class Game:
                     # Updating the track name
                     trackNameBox.update(event)
 
-            if selectedPoint is not None:
+            if selectedPoint is not None and self.track.points[selectedPoint] != scaledMousePosition:
                 # Moving the selected point with the mouse cursor
-                updateTrack = True
+                movedPoint = selectedPoint
                 self.track.movePoint(selectedPoint, scaledMousePosition)
             
             # Making sure the track is always drawn on the first frame
@@ -338,13 +391,33 @@ class Game:
                 updateTrack = True
                 firstDraw = False
 
-            # Only update the track if neccessary to save computing power
+            # Only redraw the parts of the track that changed to save computing power
+            dirtyArea = None
             if updateTrack:
-                trackSurface.fill(BACKGROUND_COLOUR)
-                self.track.drawEditor(trackSurface)
+                dirtyArea = self.track.updateEditorCurves()
+            elif movedPoint is not None:
+                dirtyArea = self.track.updateEditorCurves(movedPoint)
+
+            if dirtyArea is not None:
+                # Lining the area up with the zoom so scaling it gives the same pixels as scaling the whole surface
+                left = max(dirtyArea.left // zoom * zoom, 0)
+                top = max(dirtyArea.top // zoom * zoom, 0)
+                right = min(-(-dirtyArea.right // zoom) * zoom, TRACK_WIDTH)
+                bottom = min(-(-dirtyArea.bottom // zoom) * zoom, TRACK_HEIGHT)
+                dirtyArea = pygame.Rect(left, top, right - left, bottom - top)
+
+                if dirtyArea.width > 0 and dirtyArea.height > 0:
+                    # Drawing a little past the area because thick lines are drawn slightly differently near the edge of the clip area
+                    drawArea = dirtyArea.inflate(32, 32)
+                    trackSurface.set_clip(drawArea)
+                    trackSurface.fill(BACKGROUND_COLOUR)
+                    self.track.drawEditor(trackSurface, area=drawArea)
+                    trackSurface.set_clip(None)
+
+                    # Scaling only the redrawn area onto the scaled track surface
+                    scaledArea = pygame.transform.scale(trackSurface.subsurface(dirtyArea), (dirtyArea.width // zoom, dirtyArea.height // zoom))
+                    scaledTrackSurface.blit(scaledArea, (dirtyArea.x // zoom, dirtyArea.y // zoom))
 
-            # Scaling the track surface and drawing it
-            scaledTrackSurface = pygame.transform.scale(trackSurface, (SCREEN_WIDTH, SCREEN_HEIGHT))
             self.screen.blit(scaledTrackSurface, (0, 0))
 
             for element in elements:
@@ -356,11 +429,22 @@ class Game:
 
             self.deltaTime = self.clock.tick(FPS) / 1000
 
-    def gameLoop(self, model):
+    def gameLoop(self, inferenceEngines, opponentCount):
         spawnPoint, spawnAngle = self.track.getSpawnPosition()
 
         playerCar = Car(spawnPoint.x, spawnPoint.y, spawnAngle, BLUE_CAR_IMAGE, self.track)
-        agentCar = CarAgent(spawnPoint.x, spawnPoint.y, spawnAngle, RED_CAR_IMAGE, self.track, model, self.device, False)
+
+        # A single opponent starts alongside the player, otherwise the opponents line up on a grid behind them
+        if opponentCount == 1:
+            startPositions = [(spawnPoint, spawnAngle, playerCar.progress)]
+        else:
+            startPositions = self.track.getGridPositions(opponentCount)
+
+        agentCars = []
+        for index, (startPoint, startAngle, startProgress) in enumerate(startPositions):
+            agentCars.append(CarAgent(startPoint.x, startPoint.y, startAngle, RED_CAR_IMAGE, self.track, inferenceEngines[index % len(inferenceEngines)], False, startProgress))
+
+        racePosition = 1
 
         lap = 0
         cameraOffset = pygame.Vector2(0, 0)
@@ -375,8 +459,9 @@ class Game:
         lapContainerPosition = minimapSize - lapContainerSize
         lapContainer = Container(lapContainerPosition.x, lapContainerPosition.y, lapContainerSize.x, lapContainerSize.y, COLOUR_SCHEME[2], COLOUR_SCHEME[1], BUTTON_BORDER_THICKNESS)
         lapLabel = TextLabel(lapContainerPosition.x, lapContainerPosition.x, lapContainerSize.x, lapContainerSize.y, f"Lap 0/{TOTAL_LAPS}", FONT_16, COLOUR_SCHEME[0])
-        stopWatchLabel = TextLabel(minimapSize.x, 0, 0.05, 0.05, self.formatStopWatch(stopWatchTime), FONT_32, COLOUR_SCHEME[1])
-        countDownLabel = TextLabel(0, 0, 1, 1, self.formatStopWatch(stopWatchTime), FONT_128, COLOUR_SCHEME[0])
+        stopWatchLabel = TextLabel(minimapSize.x, 0, 0.05, 0.05, formatStopWatch(stopWatchTime), FONT_32, COLOUR_SCHEME[1])
+        positionLabel = TextLabel(minimapSize.x, 0.05, 0.05, 0.05, f"{racePosition}/{opponentCount + 1}", FONT_32, COLOUR_SCHEME[1])
+        countDownLabel = TextLabel(0, 0, 1, 1, formatStopWatch(stopWatchTime), FONT_128, COLOUR_SCHEME[0])
 
         continueButton = Button(0.88, 0.88, 0.1, 0.1, "Continue", FONT_32, COLOUR_SCHEME[0], COLOUR_SCHEME[1], COLOUR_SCHEME[0], BUTTON_BORDER_THICKNESS, BUTTON_HOVER_THICKNESS)
 
@@ -384,6 +469,10 @@ class Game:
         gameRunning = True
         returnToMenu = False
 
+        # The whole race is one row, with a step for every frame the cars are driving
+        if instrumentation.enabled:
+            instrumentation.start(f"race-{self.track.getFilePath() or 'track'}")
+
         while self.running and not returnToMenu:
             if not gameRunning:
                 continueButtonHovered = False
@@ -412,33 +501,66 @@ class Game:
                 if keys[pygame.K_a] or keys[pygame.K_LEFT]:
                     turnDirection -= 1
 
-                playerCar.update(self.deltaTime, acceleration, turnDirection)
-                agentCar.update(self.deltaTime)
+                if instrumentation.enabled:
+                    startTime = time.perf_counter()
+
+                playerCar.drive(self.deltaTime, acceleration, turnDirection)
+
+                if instrumentation.enabled:
+                    instrumentation.addPhaseTime("player", startTime)
+                    startTime = time.perf_counter()
+
+                selectedActions = selectAgentActions(agentCars)
+                for agentCar, selectedAction in zip(agentCars, selectedActions):
+                    agentCar.drive(self.deltaTime, *agentCar.getActionValues(selectedAction))
+
+                if instrumentation.enabled:
+                    instrumentation.addPhaseTime("agents", startTime)
+                    startTime = time.perf_counter()
+
+                updateCarProgresses([playerCar, *agentCars])
+
+                if instrumentation.enabled:
+                    instrumentation.addPhaseTime("progress", startTime)
+                    instrumentation.addCount("environmentSteps")
                 
                 # Check if game over
-                newLap = max(playerCar.lap, agentCar.lap)
+                newLap = max(playerCar.lap, *(agentCar.lap for agentCar in agentCars))
                 if newLap > TOTAL_LAPS:
                     gameRunning = False
                 elif lap != newLap:
                     lap = newLap
                     lapLabel.updateText(f"Lap {lap}/{TOTAL_LAPS}")
 
+                # The player is behind every opponent that is further around the race
+                playerRaceProgress = playerCar.getRaceProgress()
+                newRacePosition = 1 + sum(agentCar.getRaceProgress() > playerRaceProgress for agentCar in agentCars)
+                if racePosition != newRacePosition:
+                    racePosition = newRacePosition
+                    positionLabel.updateText(f"{racePosition}/{opponentCount + 1}")
+
             cameraOffset = playerCar.getCameraOffset(cameraOffset, self.deltaTime)
 
+            if instrumentation.enabled:
+                startTime = time.perf_counter()
+
             self.screen.fill(BACKGROUND_COLOUR)
             self.track.draw(self.screen, cameraOffset)
 
+            # The player is drawn on top of the opponents
+            for agentCar in agentCars:
+                agentCar.draw(self.screen, cameraOffset)
             playerCar.draw(self.screen, cameraOffset)
-            agentCar.draw(self.screen, cameraOffset)
 
-            minimap.draw(self.screen, playerCar, agentCar)
+            minimap.draw(self.screen, playerCar, agentCars)
 
             lapContainer.draw(self.screen)
             lapLabel.draw(self.screen)
 
             if countdownCompleted:
-                stopWatchLabel.updateText(self.formatStopWatch(stopWatchTime))
+                stopWatchLabel.updateText(formatStopWatch(stopWatchTime))
                 stopWatchLabel.draw(self.screen)
+                positionLabel.draw(self.screen)
             else:
                 countDownRemaining = math.ceil(COUNTDOWN_DURATION - stopWatchTime)
 
@@ -457,11 +579,17 @@ class Game:
 
             pygame.display.flip()
 
+            if instrumentation.enabled:
+                instrumentation.addPhaseTime("drawing", startTime)
+
             self.deltaTime = self.clock.tick(FPS) / 1000
 
             if gameRunning:
                 stopWatchTime += self.deltaTime
 
+        if instrumentation.enabled:
+            instrumentation.writeRow(opponents=opponentCount, raceTime=stopWatchTime, finished=not gameRunning)
+
     def trainingMenu(self, episode, steps, reward, explorationThreshold):
         reward = round(reward, 2)
         explorationThreshold = round(explorationThreshold, 3)
@@ -552,31 +680,46 @@ class Game:
 
             self.deltaTime = self.clock.tick(FPS) / 1000
 
-    def formatStopWatch(self, stopWatchTime):
-        # Modulo 60 to remove minutes
-        seconds = stopWatchTime % 60
+    def checkEndTraining(self):
+        # Requests from the viewer's buttons, which are checked after every episode
+        if self.viewer is None:
+            return False
 
-        # Floor division by 60 to remove seconds
-        minutes = int(stopWatchTime // 60)
+        requests = self.viewer.getRequests()
+        if "quit" in requests:
+            self.running = False
 
-        if minutes > 0:
-            return f"{minutes:02d}:{seconds:05.2f}" # Pad seconds and minutes with a 0 if only one digit and round to 2 decimal places for example: 1:5.323 because 01:05.32
-        else:
-            return f"{seconds:05.2f}"
+        return "endTraining" in requests
+
+    def closeViewer(self):
+        if self.viewer is not None:
+            self.viewer.close()
+            self.viewer = None
+
+    def visualizeEpisode(self):
+        if ASYNC_VISUALISATION:
+            # Training carries on while the viewer process drives the latest policy in its own window
+            if self.viewer is None:
+                from viewer import Viewer
+                self.viewer = Viewer(self.track.getFilePath())
+
+            self.viewer.sendPolicy(self.trainer.learner.getPolicyWeights())
+            return self.checkEndTraining()
 
-    def visualizeEpisode(self):        
         spawnPoint, spawnAngle = self.track.getSpawnPosition()
-        agentCar = CarAgent(spawnPoint.x, spawnPoint.y, spawnAngle, RED_CAR_IMAGE, self.track, self.trainer.policyNet, self.device, False)
+        agentCar = CarAgent(spawnPoint.x, spawnPoint.y, spawnAngle, RED_CAR_IMAGE, self.track, self.trainer.inferenceEngine, False)
 
         self.resetDeltaTime()
         stopWatchTime = 0
 
         skipButton = Button(0.88, 0.88, 0.1, 0.1, "Skip", FONT_32, COLOUR_SCHEME[0], COLOUR_SCHEME[1], COLOUR_SCHEME[0], BUTTON_BORDER_THICKNESS, BUTTON_HOVER_THICKNESS)
         endTrainingButton = Button(0.76, 0.88, 0.1, 0.1, "End Training", FONT_32, COLOUR_SCHEME[0], COLOUR_SCHEME[1], COLOUR_SCHEME[0], BUTTON_BORDER_THICKNESS, BUTTON_HOVER_THICKNESS)
-        stopWatchLabel = TextLabel(0, 0, 0.05, 0.05, self.formatStopWatch(stopWatchTime), FONT_32, COLOUR_SCHEME[1])
+        stopWatchLabel = TextLabel(0, 0, 0.05, 0.05, formatStopWatch(stopWatchTime), FONT_32, COLOUR_SCHEME[1])
 
         elements = [skipButton, endTrainingButton]
 
+        trackOverview = TrackOverview(0, 0, 1, 1, self.track)
+
         visualisationRunning = True
         while visualisationRunning and self.running:
             hoveredElement = None
@@ -602,19 +745,12 @@ class Game:
             if crashed or agentCar.lap > 1 or stopWatchTime > MAX_VISUALISATION_TIME:
                 visualisationRunning = False
 
-            trackSurface = pygame.Surface((TRACK_WIDTH, TRACK_HEIGHT), pygame.SRCALPHA)
-            trackSurface.fill(BACKGROUND_COLOUR)
-
-            self.track.draw(trackSurface, pygame.Vector2(0, 0))
-            agentCar.draw(trackSurface, pygame.Vector2(0, 0))
-
-            scaledTrackSurface = pygame.transform.scale(trackSurface, (SCREEN_WIDTH, SCREEN_HEIGHT))
-            self.screen.blit(scaledTrackSurface, (0, 0))
+            trackOverview.draw(self.screen, agentCar)
 
             for element in elements:
                 element.draw(self.screen)
 
-            stopWatchLabel.updateText(self.formatStopWatch(stopWatchTime))
+            stopWatchLabel.updateText(formatStopWatch(stopWatchTime))
             stopWatchLabel.draw(self.screen)
 
             pygame.display.flip()
@@ -1,34 +1,219 @@
-from collections import namedtuple, deque
 from itertools import count
-import random
 import pygame
+import random
 import math
+import time
+import os
 
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.optim as optim
 
-from config import BATCH_SIZE, DISCOUNT_FACTOR, TARGET_UPDATE_STRENGTH, LR, TRAINING_TIMESTEP, BACKGROUND_COLOUR, SCREEN_HEIGHT, SCREEN_WIDTH, TRACK_HEIGHT, EXPLORATION_DECAY, NETWORK_INPUT_SIZE, NETWORK_ACTION_SIZE, TRACK_WIDTH, FPS, MAX_TIMESTEPS, EXPLORATION_START, MODELS_PATH, EXPLORATION_END, RED_CAR_IMAGE, VISUALISATION_STEP, TRAINING_EPISODES, EXPERIENCE_CAPACITY
+from config import BATCH_SIZE, DISCOUNT_FACTOR, TARGET_UPDATE_STRENGTH, TARGET_UPDATE_INTERVAL, LR, TRAINING_TIMESTEP, BACKGROUND_COLOUR, SCREEN_HEIGHT, SCREEN_WIDTH, TRACK_HEIGHT, EXPLORATION_DECAY, NETWORK_INPUT_SIZE, NETWORK_ACTION_SIZE, TRACK_WIDTH, FPS, MAX_TIMESTEPS, EXPLORATION_START, MODELS_PATH, EXPLORATION_END, RED_CAR_IMAGE, VISUALISATION_STEP, TRAINING_EPISODES, EXPERIENCE_CAPACITY, TRAINING_WORKERS, CARS_PER_WORKER, ROLLOUT_STEPS, UPDATES_PER_ROLLOUT, PRIORITISED_REPLAY, PRIORITY_EXPONENT, PRIORITY_OFFSET, IMPORTANCE_SAMPLING_START, IMPORTANCE_SAMPLING_STEPS, LEARNER_BACKEND, CHECKPOINT_INTERVAL
 from cars import CarAgent
+from environment import ParallelEnvironment
+import instrumentation
+import modelNumpy
+from modelNumpy import createMemoryArray, flushMemoryArray, saveCheckpointFile, loadCheckpointFile
 
 
 
 class ExperienceMemory:
-    def __init__(self, maximumSize):
-        # Deque for efficiency
-        self.memory = deque([], maxlen=maximumSize)
+    def __init__(self, maximumSize, device, path=None, resume=False):
+        self.maximumSize = maximumSize
+        self.device = device
+
+        # Every experience is one row of a preallocated tensor, laid out as state, action, reward, next state and done flag
+        self.stateColumns = slice(0, NETWORK_INPUT_SIZE)
+        self.actionColumn = NETWORK_INPUT_SIZE
+        self.rewardColumn = NETWORK_INPUT_SIZE + 1
+        self.nextStateColumns = slice(NETWORK_INPUT_SIZE + 2, NETWORK_INPUT_SIZE * 2 + 2)
+        self.doneColumn = NETWORK_INPUT_SIZE * 2 + 2
+
+        # On the CPU the tensor shares the memory-mapped file when the memory is checkpointed
+        self.memoryFile = createMemoryArray((maximumSize, NETWORK_INPUT_SIZE * 2 + 3), np.float32, path, "memory", resume)
+        self.memory = torch.from_numpy(self.memoryFile).to(device)
+
+        # The memory is used as a ring buffer, overwriting the oldest experiences once it is full
+        self.nextIndex = 0
+        self.size = 0
+
+        # Experiences added since the last checkpoint, the only rows that need copying back from another device
+        self.unsavedCount = 0
 
     def getSize(self):
         # To check how many experiences are stored in the memory
-        return len(self.memory)
+        return self.size
+
+    def getState(self):
+        # Everything needed to carry on from a checkpoint apart from the experiences, which are flushed to their own file
+        if self.memory.device.type != "cpu":
+            # The newest rows end just before nextIndex, and are copied in two parts when they wrap around the end of the memory
+            start = (self.nextIndex - self.unsavedCount) % self.maximumSize
+            for first, last in [(start, min(start + self.unsavedCount, self.maximumSize)), (0, max(start + self.unsavedCount - self.maximumSize, 0))]:
+                if last > first:
+                    self.memoryFile[first:last] = self.memory[first:last].cpu().numpy()
+        flushMemoryArray(self.memoryFile)
+        self.unsavedCount = 0
+
+        return {"nextIndex": self.nextIndex, "size": self.size}
+
+    def loadState(self, state):
+        self.nextIndex = state["nextIndex"]
+        self.size = state["size"]
 
     def addExperience(self, state, action, nextState, reward):
-        # Add experience as a tuple
-        self.memory.append((state, action, nextState, reward))
+        index = self.nextIndex
+        row = self.memory[index]
+
+        row[self.stateColumns] = torch.as_tensor(state).reshape(-1)
+        row[self.actionColumn] = action
+        row[self.rewardColumn] = reward
+
+        # The agent crashed if there is no next state
+        if nextState is None:
+            row[self.nextStateColumns] = 0
+            row[self.doneColumn] = 1
+        else:
+            row[self.nextStateColumns] = torch.as_tensor(nextState).reshape(-1)
+            row[self.doneColumn] = 0
+
+        self.nextIndex = (self.nextIndex + 1) % self.maximumSize
+        self.size = min(self.size + 1, self.maximumSize)
+        self.unsavedCount = min(self.unsavedCount + 1, self.maximumSize)
+
+        return index
+
+    def addExperiences(self, states, actions, nextStates, rewards, dones):
+        # Add a batch of experiences from NumPy arrays, keeping only the newest ones if there are more than fit
+        count = min(len(states), self.maximumSize)
+
+        rows = torch.empty((count, self.memory.shape[1]))
+        rows[:, self.stateColumns] = torch.from_numpy(states[-count:])
+        rows[:, self.actionColumn] = torch.from_numpy(actions[-count:])
+        rows[:, self.rewardColumn] = torch.from_numpy(rewards[-count:])
+        rows[:, self.nextStateColumns] = torch.from_numpy(nextStates[-count:])
+        rows[:, self.doneColumn] = torch.from_numpy(dones[-count:])
+
+        indices = (self.nextIndex + torch.arange(count)) % self.maximumSize
+        self.memory[indices.to(self.device)] = rows.to(self.device)
+
+        self.nextIndex = (self.nextIndex + count) % self.maximumSize
+        self.size = min(self.size + count, self.maximumSize)
+        self.unsavedCount = min(self.unsavedCount + count, self.maximumSize)
+
+        return indices
 
     def getBatch(self, batchSize):
-        # Randomly sample experiences to create a batch
-        return random.sample(self.memory, batchSize)
+        # Randomly sample experiences with a single gather, then split the rows into their parts
+        indices = torch.randint(0, self.size, (batchSize,), device=self.device)
+        return self.getExperiences(indices)
+
+    def getExperiences(self, indices):
+        batch = self.memory[indices]
+
+        states = batch[:, self.stateColumns]
+        actions = batch[:, self.actionColumn].long()
+        rewards = batch[:, self.rewardColumn]
+        nextStates = batch[:, self.nextStateColumns]
+        dones = batch[:, self.doneColumn].bool()
+
+        return states, actions, rewards, nextStates, dones
+
+class SumTree:
+    def __init__(self, size, path=None, resume=False):
+        # Binary tree stored in an array where node i has children 2i and 2i + 1 and every node is the sum of its children
+        # The leaves start at leafOffset, rounded up to a power of two so every level is full
+        self.depth = max(1, math.ceil(math.log2(size)))
+        self.leafOffset = 2 ** self.depth
+
+        # Kept on the CPU with NumPy because walking the tree is many tiny operations
+        self.tree = createMemoryArray((self.leafOffset * 2,), np.float64, path, "priorities", resume)
+
+    def getTotal(self):
+        return self.tree[1]
+
+    def getValues(self, indices):
+        return self.tree[indices + self.leafOffset]
+
+    def update(self, indices, values):
+        # Set a batch of leaves then recalculate their parents one level at a time
+        nodes = indices + self.leafOffset
+        self.tree[nodes] = values
+
+        for _ in range(self.depth):
+            nodes = nodes // 2
+            self.tree[nodes] = self.tree[nodes * 2] + self.tree[nodes * 2 + 1]
+
+    def find(self, values, filledCount):
+        # Walk down from the root for every value at once, going right whenever the value is past the left child's sum
+        # Leaves are filled in order, so only the first filledCount have a priority
+        nodes = np.ones(len(values), dtype=np.int64)
+
+        for _ in range(self.depth):
+            leftChildren = nodes * 2
+            leftSums = self.tree[leftChildren]
+
+            goRight = values >= leftSums
+            values = np.where(goRight, values - leftSums, values)
+            nodes = leftChildren + goRight
+
+        # Rounding errors can land on an empty leaf past the last experience, which would never have been sampled otherwise
+        return np.minimum(nodes - self.leafOffset, filledCount - 1)
+
+class PrioritisedExperienceMemory(ExperienceMemory):
+    def __init__(self, maximumSize, device, path=None, resume=False):
+        super().__init__(maximumSize, device, path, resume)
+
+        self.priorities = SumTree(maximumSize, path, resume)
+        self.maxPriority = 1.0
+        self.batchesSampled = 0
+
+    def getState(self):
+        flushMemoryArray(self.priorities.tree)
+
+        return {**super().getState(), "maxPriority": self.maxPriority, "batchesSampled": self.batchesSampled}
+
+    def loadState(self, state):
+        super().loadState(state)
+        self.maxPriority = state["maxPriority"]
+        self.batchesSampled = state["batchesSampled"]
+
+    def addExperience(self, state, action, nextState, reward):
+        # New experiences get the highest priority so they are sampled at least once
+        index = super().addExperience(state, action, nextState, reward)
+        self.priorities.update(np.array([index]), self.maxPriority)
+
+        return index
+
+    def addExperiences(self, states, actions, nextStates, rewards, dones):
+        indices = super().addExperiences(states, actions, nextStates, rewards, dones)
+        self.priorities.update(indices.numpy(), self.maxPriority)
+
+        return indices
+
+    def getBatch(self, batchSize):
+        # Split the total priority into equal segments and sample one experience from each
+        segmentSize = self.priorities.getTotal() / batchSize
+        values = (np.arange(batchSize) + np.random.random(batchSize)) * segmentSize
+        indices = self.priorities.find(values, self.size)
+
+        # Importance sampling weights undo the bias from sampling high priority experiences more often
+        self.batchesSampled += 1
+        exponent = min(1.0, IMPORTANCE_SAMPLING_START + (1 - IMPORTANCE_SAMPLING_START) * self.batchesSampled / IMPORTANCE_SAMPLING_STEPS)
+
+        probabilities = self.priorities.getValues(indices) / self.priorities.getTotal()
+        weights = (self.size * probabilities) ** -exponent
+        weights = torch.tensor(weights / weights.max(), dtype=torch.float32, device=self.device)
+
+        return *self.getExperiences(torch.from_numpy(indices).to(self.device)), indices, weights
+
+    def updatePriorities(self, indices, tdErrors):
+        priorities = (tdErrors.detach().abs().cpu().double().numpy() + PRIORITY_OFFSET) ** PRIORITY_EXPONENT
+        self.priorities.update(indices, priorities)
+
+        self.maxPriority = max(self.maxPriority, priorities.max())
 
 class NeuralNetwork(nn.Module):
     def __init__(self, inputs, outputs):
@@ -42,76 +227,331 @@ class NeuralNetwork(nn.Module):
         x = torch.relu(self.layer2(x))
         return self.layer3(x)
 
-class DQNTrainer:
-    def __init__(self, game):
-        self.game = game
-        self.device = game.device
+def scriptPolicy(model):
+    # TorchScript runs without the Python class, so exported policies load without NeuralNetwork
+    return torch.jit.script(model.eval())
+
+def quantisePolicy(model):
+    # Linear weights are stored as int8 and the activations are quantised on the fly for each forward pass
+    return torch.ao.quantization.quantize_dynamic(model.eval(), {nn.Linear}, dtype=torch.qint8)
+
+def getNumpyNetwork(model):
+    # NumPy copy of a torch network in the layout used by modelNumpy.NeuralNetwork
+    layers = [model.layer1, model.layer2, model.layer3]
+
+    network = modelNumpy.NeuralNetwork(NETWORK_INPUT_SIZE, NETWORK_ACTION_SIZE)
+    network.loadWeights([layer.weight.detach().cpu().numpy().T for layer in layers], [layer.bias.detach().cpu().numpy() for layer in layers])
+
+    return network
+
+def loadPolicy(modelName, device):
+    # The quantised export is used if there is one, then the TorchScript export, then the trained state dict
+    for extension in [".int8.pt", ".pt"]:
+        modelPath = f"{MODELS_PATH}/{modelName}{extension}"
+        if os.path.isfile(modelPath):
+            return torch.jit.load(modelPath, map_location=device)
+
+    model = NeuralNetwork(NETWORK_INPUT_SIZE, NETWORK_ACTION_SIZE).to(device)
+    model.load_state_dict(torch.load(f"{MODELS_PATH}/{modelName}.model", map_location=device))
+
+    return model
+
+class InferenceEngine:
+    def __init__(self, model, device, capacity=1):
+        self.model = model
+        self.device = device
+
+        # States are copied into a preallocated input tensor that grows to fit the largest batch seen
+        self.inputBuffer = torch.zeros((capacity, NETWORK_INPUT_SIZE), device=device)
+
+    def getQValues(self, states):
+        # Q-Values for a (states, inputs) NumPy array in one forward pass without building an autograd graph
+        count = len(states)
+        if count > len(self.inputBuffer):
+            self.inputBuffer = torch.zeros((count, NETWORK_INPUT_SIZE), device=self.device)
+
+        with torch.inference_mode():
+            inputs = self.inputBuffer[:count]
+            inputs.copy_(torch.from_numpy(states))
+
+            return self.model(inputs)
+
+    def selectActions(self, states):
+        # Index of the best action for each state
+        with torch.inference_mode():
+            return self.getQValues(states).argmax(dim=1).cpu().numpy()
+
+class TorchLearner:
+    # Learns with PyTorch networks and the AdamW optimiser, with the same interface as modelNumpy.NumpyLearner
+    def __init__(self, device, checkpointPath=None, resume=False):
+        self.device = device
 
         # Initialising neural network
         self.policyNet = NeuralNetwork(NETWORK_INPUT_SIZE, NETWORK_ACTION_SIZE).to(self.device)
         self.targetNet = NeuralNetwork(NETWORK_INPUT_SIZE, NETWORK_ACTION_SIZE).to(self.device)
         self.targetNet.load_state_dict(self.policyNet.state_dict())
 
+        # The training car acts through the policy network without building autograd graphs
+        self.inferenceEngine = InferenceEngine(self.policyNet, self.device)
+
+        # Parameter lists so the target network can be updated in place
+        self.policyParameters = list(self.policyNet.parameters())
+        self.targetParameters = list(self.targetNet.parameters())
+        self.stepsSinceTargetUpdate = 0
+
         # Initialisng optimiser and experience memory
         self.optimizer = optim.AdamW(self.policyNet.parameters(), lr=LR, amsgrad=True)
-        self.memory = ExperienceMemory(EXPERIENCE_CAPACITY)
-    
+        if PRIORITISED_REPLAY:
+            self.memory = PrioritisedExperienceMemory(EXPERIENCE_CAPACITY, self.device, checkpointPath, resume)
+        else:
+            self.memory = ExperienceMemory(EXPERIENCE_CAPACITY, self.device, checkpointPath, resume)
+
+    def getLoss(self, states, actions, rewards, nextStates, dones, weights=None):
+        # Calculate and gather Q-Values for each action
+        stateActionQValues = self.policyNet(states)
+
+        # Gather the Q-Values for the chosen actions
+        selectedActionQValues = stateActionQValues.gather(1, actions.unsqueeze(1)).squeeze(1)
+
+        # Calculate target Q-Values for the next state, which are 0 if the agent crashed
+        with torch.no_grad():
+            nextStateQValues = self.targetNet(nextStates).max(1).values.masked_fill(dones, 0)
+
+        # Compute the expected Q-Values
+        expectedQValues = (nextStateQValues * DISCOUNT_FACTOR) + rewards
+
+        # Compute Huber loss for each experience
+        huberLoss = nn.SmoothL1Loss(reduction="none")
+        losses = huberLoss(selectedActionQValues, expectedQValues)
+
+        # Weight each loss by its importance sampling weight when sampling by priority
+        if weights is not None:
+            losses = losses * weights
+
+        return losses.mean(), selectedActionQValues - expectedQValues
+
+    def learnFromBatch(self, states, actions, rewards, nextStates, dones, weights=None):
+        loss, tdErrors = self.getLoss(states, actions, rewards, nextStates, dones, weights)
+
+        # Backpropogation
+        self.optimizer.zero_grad()
+        loss.backward()
+
+        self.optimizer.step()
+
+        return tdErrors
+
     def updateModel(self):
         if self.memory.getSize() >= BATCH_SIZE:
-            # Sampling experiences
-            experiences = self.memory.getBatch(BATCH_SIZE)
+            if PRIORITISED_REPLAY:
+                # Use the TD errors as the new priorities
+                states, actions, rewards, nextStates, dones, indices, weights = self.memory.getBatch(BATCH_SIZE)
+                tdErrors = self.learnFromBatch(states, actions, rewards, nextStates, dones, weights)
+                self.memory.updatePriorities(indices, tdErrors)
+            else:
+                self.learnFromBatch(*self.memory.getBatch(BATCH_SIZE))
 
-            # Split batch into states, actions, nextStates and rewards arrays
-            states, actions, nextStates, rewards = zip(*experiences)
+    def softUpdateTargetNetwork(self):
+        self.stepsSinceTargetUpdate += 1
+        if self.stepsSinceTargetUpdate < TARGET_UPDATE_INTERVAL:
+            return
 
-            # Convert each array into tensors so I can manipulate them using pytorch
-            states = torch.cat(states)
-            actions = torch.cat(actions)
-            rewards = torch.cat(rewards)
+        self.stepsSinceTargetUpdate = 0
 
-            # Creating a mask of valid states so that invalid states can be filtered out
-            nonFinalMask = torch.tensor([state is not None for state in nextStates], device=self.device, dtype=torch.bool)
+        # Move every target parameter towards the policy parameter in place with a single fused call
+        with torch.no_grad():
+            torch._foreach_lerp_(self.targetParameters, self.policyParameters, TARGET_UPDATE_STRENGTH)
 
-            # Only including valid next states because some might be None because the agent might have crashed
-            nextStates = torch.cat([state for state in nextStates if state is not None]) 
+    def getPolicyWeights(self):
+        # NumPy copies of the policy network, for acting in environment workers and the viewer
+        network = getNumpyNetwork(self.policyNet)
 
-            # Calculate and gather Q-Values for each action
-            stateActionQValues = self.policyNet(states)
+        return network.weights, network.biases
 
-            # Gather the Q-Values for the chosen actions
-            selectedActionQValues = stateActionQValues.gather(1, actions.unsqueeze(1))
+    def loadPolicyWeights(self, weights, biases):
+        # Both networks start from the given weights, which are laid out like modelNumpy.NeuralNetwork
+        layers = [self.policyNet.layer1, self.policyNet.layer2, self.policyNet.layer3]
 
-            # Calculate target Q-Values for the next state
-            nextStateQValues = torch.zeros(BATCH_SIZE, NETWORK_ACTION_SIZE, device=self.device)
-            with torch.no_grad():
-                nextStateQValues[nonFinalMask] = self.targetNet(nextStates)
-                
-            # Separate the max Q-values for acceleration and turning
-            nextStateQValues = nextStateQValues.max(1).values
+        with torch.no_grad():
+            for layer, layerWeights, layerBiases in zip(layers, weights, biases):
+                layer.weight.copy_(torch.from_numpy(np.ascontiguousarray(layerWeights.T)))
+                layer.bias.copy_(torch.from_numpy(layerBiases))
 
-            # Compute the expected Q-Values for both acceleration and turning
-            expectedQValues = (nextStateQValues * DISCOUNT_FACTOR) + rewards
+        self.targetNet.load_state_dict(self.policyNet.state_dict())
 
-            # Compute Huber loss for both acceleration and turning
-            huberLoss = nn.SmoothL1Loss()
-            
-            # Combine both losses
-            loss = huberLoss(selectedActionQValues, expectedQValues.unsqueeze(1))
+    def getQValues(self, states):
+        return self.inferenceEngine.getQValues(states).cpu().numpy()
 
-            # Backpropogation
-            self.optimizer.zero_grad()
-            loss.backward()
+    def getGradients(self, states, actions, rewards, nextStates, dones):
+        # Gradients of the loss of a NumPy batch without updating the network, for comparing learners
+        batch = [torch.from_numpy(array).to(self.device) for array in (states, actions, rewards, nextStates, dones)]
 
-            
-            self.optimizer.step()
+        self.optimizer.zero_grad()
+        self.getLoss(*batch)[0].backward()
+
+        layers = [self.policyNet.layer1, self.policyNet.layer2, self.policyNet.layer3]
+        return [layer.weight.grad.cpu().numpy().T.copy() for layer in layers], [layer.bias.grad.cpu().numpy().copy() for layer in layers]
+
+    def savePolicy(self, path):
+        torch.save(self.policyNet.state_dict(), path + ".model")
+
+        # A NumPy copy lets play mode race against the model without importing torch
+        modelNumpy.saveNetwork(getNumpyNetwork(self.policyNet), path + ".npz")
+
+    def saveCheckpoint(self, path):
+        # Saved with torch.save so the tensors can be loaded onto a different device
+        state = {
+            "policyNet": self.policyNet.state_dict(),
+            "targetNet": self.targetNet.state_dict(),
+            "optimizer": self.optimizer.state_dict(),
+            "memory": self.memory.getState(),
+            "stepsSinceTargetUpdate": self.stepsSinceTargetUpdate,
+            "randomState": torch.get_rng_state(),
+        }
+
+        torch.save(state, f"{path}/learner.pt.tmp")
+        os.replace(f"{path}/learner.pt.tmp", f"{path}/learner.pt")
+
+    def loadCheckpoint(self, path):
+        state = torch.load(f"{path}/learner.pt", map_location=self.device, weights_only=False)
+
+        self.policyNet.load_state_dict(state["policyNet"])
+        self.targetNet.load_state_dict(state["targetNet"])
+        self.optimizer.load_state_dict(state["optimizer"])
+        self.memory.loadState(state["memory"])
+        self.stepsSinceTargetUpdate = state["stepsSinceTargetUpdate"]
+        torch.set_rng_state(state["randomState"].cpu())
+
+def getCheckpointEpisode(checkpointPath):
+    # Episode that training would resume from, or None if there is no checkpoint
+    if not os.path.isfile(f"{checkpointPath}/trainer.pkl"):
+        return None
+
+    return loadCheckpointFile(f"{checkpointPath}/trainer.pkl")["episode"]
+
+class DQNTrainer:
+    def __init__(self, game, backend=LEARNER_BACKEND, checkpointPath=None, resume=False):
+        self.game = game
+        self.device = game.device
+        self.checkpointPath = checkpointPath
+        self.episode = 1
+
+        if resume:
+            # A checkpoint is resumed with the backend it was trained with
+            trainerState = loadCheckpointFile(f"{checkpointPath}/trainer.pkl")
+            backend = trainerState["backend"]
+        elif checkpointPath is not None:
+            # Starting again replaces any old checkpoint, whose experiences are about to be overwritten
+            os.makedirs(checkpointPath, exist_ok=True)
+            self.removeCheckpoint()
+
+        self.backend = backend
+
+        # The networks, optimiser and experience memory all belong to the learner, so either backend can be trained by the same loops
+        if backend == "numpy":
+            self.learner = modelNumpy.NumpyLearner(checkpointPath, resume)
+        else:
+            self.learner = TorchLearner(self.device, checkpointPath, resume)
+
+        self.inferenceEngine = self.learner.inferenceEngine
+        self.memory = self.learner.memory
+
+        if resume:
+            self.learner.loadCheckpoint(checkpointPath)
+
+            self.episode = trainerState["episode"]
+            random.setstate(trainerState["randomState"])
+            np.random.set_state(trainerState["numpyRandomState"])
+
+    def saveCheckpoint(self):
+        if self.checkpointPath is None:
+            return
+
+        if instrumentation.enabled:
+            startTime = time.perf_counter()
+
+        # The learner is saved first so the trainer file, which marks a checkpoint as ready to resume, is always written last
+        self.learner.saveCheckpoint(self.checkpointPath)
+
+        saveCheckpointFile({
+            "backend": self.backend,
+            "episode": self.episode,
+            "randomState": random.getstate(),
+            "numpyRandomState": np.random.get_state(),
+        }, f"{self.checkpointPath}/trainer.pkl")
+
+        if instrumentation.enabled:
+            instrumentation.addPhaseTime("checkpoint", startTime)
+
+    def addTransitions(self, transitions):
+        # Store a batch of transitions from the environment workers
+        states, actions, rewards, nextStates, crashed = transitions
+        self.memory.addExperiences(states, actions, nextStates, rewards, crashed)
+
+    def updateNetworks(self):
+        # One training step and target network update, timed separately when instrumentation is on
+        if not instrumentation.enabled:
+            self.learner.updateModel()
+            self.learner.softUpdateTargetNetwork()
+            return
+
+        if self.memory.getSize() >= BATCH_SIZE:
+            instrumentation.addCount("gradientSteps")
+
+        startTime = time.perf_counter()
+        self.learner.updateModel()
+        instrumentation.addPhaseTime("updateModel", startTime)
+
+        startTime = time.perf_counter()
+        self.learner.softUpdateTargetNetwork()
+        instrumentation.addPhaseTime("targetUpdate", startTime)
+
+    def removeCheckpoint(self):
+        # Without the trainer file the checkpoint is no longer offered to resume, and its experience files are overwritten by the next run
+        if self.checkpointPath is not None and os.path.isfile(f"{self.checkpointPath}/trainer.pkl"):
+            os.remove(f"{self.checkpointPath}/trainer.pkl")
+
+    def showEpisode(self, episode, steps, reward, explorationThreshold, previousEpisode):
+        # Shows the training menu, and every VISUALISATION_STEP episodes an episode, returning whether training should end
+        if instrumentation.enabled:
+            startTime = time.perf_counter()
+
+        self.game.trainingMenu(episode, steps, reward, explorationThreshold)
+
+        if instrumentation.enabled:
+            instrumentation.addPhaseTime("trainingMenu", startTime)
+
+        if self.game.checkEndTraining():
+            return True
+
+        if episode // VISUALISATION_STEP > previousEpisode // VISUALISATION_STEP:
+            if instrumentation.enabled:
+                startTime = time.perf_counter()
+
+            exitTraining = self.game.visualizeEpisode()
+
+            if instrumentation.enabled:
+                instrumentation.addPhaseTime("visualisation", startTime)
+
+            return exitTraining
+
+        return False
+
+    def getExplorationThreshold(self, episode):
+        # Calculating exploration threshold using exponential decay
+        return EXPLORATION_END + (EXPLORATION_START - EXPLORATION_END) * math.exp(-EXPLORATION_DECAY * episode)
 
     def train(self):
-        episode = 1
+        if TRAINING_WORKERS > 0:
+            return self.trainParallel()
 
         spawnPoint, spawnAngle = self.game.track.getSpawnPosition()
 
-        while episode <= TRAINING_EPISODES:
-            agentCar = CarAgent(spawnPoint.x, spawnPoint.y, spawnAngle, RED_CAR_IMAGE, self.game.track, self.policyNet, self.device, True)
+        if instrumentation.enabled:
+            instrumentation.start(f"training-{self.game.track.getFilePath() or 'track'}")
+
+        while self.episode <= TRAINING_EPISODES:
+            agentCar = CarAgent(spawnPoint.x, spawnPoint.y, spawnAngle, RED_CAR_IMAGE, self.game.track, self.inferenceEngine, True)
             
             state = agentCar.getState()
 
@@ -122,53 +562,133 @@ class DQNTrainer:
                         self.game.running = False
 
                 if self.game.running == False:
+                    # The unfinished episode is started again when training is resumed
+                    self.saveCheckpoint()
                     return
 
-                # Calculating exploration threshold using exponential decay
-                explorationThreshold = EXPLORATION_END + (EXPLORATION_START - EXPLORATION_END) * math.exp(-EXPLORATION_DECAY * episode)
+                explorationThreshold = self.getExplorationThreshold(self.episode)
 
                 # Retrieving new experience
+                if instrumentation.enabled:
+                    startTime = time.perf_counter()
+
                 action, nextState, reward, episodeEnded = agentCar.update(TRAINING_TIMESTEP, explorationThreshold)
                 episodeReward += reward
 
-                # Converting to tensors
-                action = torch.tensor([action], device=self.device, dtype=torch.long)
-                reward = torch.tensor([reward], device=self.device)
+                if instrumentation.enabled:
+                    instrumentation.addPhaseTime("environmentStep", startTime)
+                    instrumentation.addCount("environmentSteps")
+                    startTime = time.perf_counter()
 
                 # Store experience in memory
                 self.memory.addExperience(state, action, nextState, reward)
 
+                if instrumentation.enabled:
+                    instrumentation.addPhaseTime("addExperience", startTime)
+
                 # Move to the next state
                 state = nextState
 
-                # Update the policy network
-                self.updateModel()
-
-                # Soft update target network
-                self.softUpdateTargetNetwork()
+                # Update the policy network and soft update the target network
+                self.updateNetworks()
 
                 if episodeEnded:
                     break
 
-            self.game.trainingMenu(episode, timeStep, episodeReward, explorationThreshold)
-            
-            if (episode) % VISUALISATION_STEP == 0:
-                exitTraining = self.game.visualizeEpisode()
+            endTraining = self.showEpisode(self.episode, timeStep, episodeReward, explorationThreshold, self.episode - 1)
 
-                if exitTraining:
-                    break
+            if instrumentation.enabled:
+                instrumentation.writeRow(episode=self.episode, steps=timeStep, reward=episodeReward, explorationThreshold=explorationThreshold)
 
-            episode += 1
-                    
-        modelFilePath = self.game.modelSaveMenu()
-        if modelFilePath:
-            torch.save(self.policyNet.state_dict(), MODELS_PATH + "/" + modelFilePath + ".model")
+            if endTraining:
+                break
 
-    def softUpdateTargetNetwork(self):
-        targetNetStateDict = self.targetNet.state_dict()
-        policyNetStateDict = self.policyNet.state_dict()
+            self.episode += 1
+
+            if (self.episode - 1) % CHECKPOINT_INTERVAL == 0:
+                self.saveCheckpoint()
+
+        # A finished run is not offered to resume, only runs stopped by closing the window are
+        self.saveModel()
+        self.removeCheckpoint()
+
+    def trainParallel(self):
+        environment = ParallelEnvironment(self.game.track.getFilePath(), TRAINING_WORKERS, CARS_PER_WORKER)
+
+        # Raycasts and overlaps happen in the worker processes, so only the trainer's own phases and counters are recorded
+        if instrumentation.enabled:
+            instrumentation.start(f"training-{self.game.track.getFilePath() or 'track'}")
+
+        completedEpisodes = self.episode - 1
+        explorationThreshold = self.getExplorationThreshold(completedEpisodes + 1)
+        environment.startCollecting(self.learner.getPolicyWeights(), explorationThreshold, ROLLOUT_STEPS)
+
+        while completedEpisodes < TRAINING_EPISODES:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    self.game.running = False
+
+            if self.game.running == False:
+                environment.close()
+
+                # Cars part way through an episode start again when training is resumed
+                self.saveCheckpoint()
+                return
 
-        for key in policyNetStateDict:
-            targetNetStateDict[key] = policyNetStateDict[key] * TARGET_UPDATE_STRENGTH + targetNetStateDict[key] * (1.0 - TARGET_UPDATE_STRENGTH)
+            if instrumentation.enabled:
+                startTime = time.perf_counter()
 
-        self.targetNet.load_state_dict(targetNetStateDict)
+            transitions, finishedEpisodes = environment.receiveTransitions()
+
+            if instrumentation.enabled:
+                instrumentation.addPhaseTime("collect", startTime)
+                instrumentation.addCount("environmentSteps", len(transitions[1]))
+
+            # Start the next rollout straight away so the workers keep stepping their cars while the network learns
+            explorationThreshold = self.getExplorationThreshold(completedEpisodes + 1)
+            environment.startCollecting(self.learner.getPolicyWeights(), explorationThreshold, ROLLOUT_STEPS)
+
+            if instrumentation.enabled:
+                startTime = time.perf_counter()
+
+            self.addTransitions(transitions)
+
+            if instrumentation.enabled:
+                instrumentation.addPhaseTime("addExperience", startTime)
+
+            for _ in range(UPDATES_PER_ROLLOUT):
+                self.updateNetworks()
+
+            if len(finishedEpisodes) == 0:
+                continue
+
+            # Episodes the workers finish past the last one are not counted, shown or checkpointed
+            finishedEpisodes = finishedEpisodes[:TRAINING_EPISODES - completedEpisodes]
+
+            previousEpisodes = completedEpisodes
+            completedEpisodes += len(finishedEpisodes)
+            self.episode = completedEpisodes + 1
+
+            if completedEpisodes // CHECKPOINT_INTERVAL > previousEpisodes // CHECKPOINT_INTERVAL:
+                self.saveCheckpoint()
+
+            # Show the latest finished episode
+            episodeReward, timeStep = finishedEpisodes[-1]
+            endTraining = self.showEpisode(completedEpisodes, timeStep, episodeReward, explorationThreshold, previousEpisodes)
+
+            if instrumentation.enabled:
+                instrumentation.writeRow(episode=completedEpisodes, finishedEpisodes=len(finishedEpisodes), steps=timeStep, reward=episodeReward, explorationThreshold=explorationThreshold)
+
+            if endTraining:
+                break
+
+        # Closing waits for the last rollout before stopping the workers
+        environment.close()
+
+        self.saveModel()
+        self.removeCheckpoint()
+
+    def saveModel(self):
+        modelFilePath = self.game.modelSaveMenu()
+        if modelFilePath:
+            self.learner.savePolicy(MODELS_PATH + "/" + modelFilePath)
@@ -1,111 +1,338 @@
-from collections import deque
-import random
-import pygame
 import numpy as np
 import math
+import pickle
+import os
 
-from config import BATCH_SIZE, DISCOUNT_FACTOR, TARGET_UPDATE_STRENGTH, LR, TRAINING_TIMESTEP, BACKGROUND_COLOUR, SCREEN_HEIGHT, SCREEN_WIDTH, TRACK_HEIGHT, TRACK_WIDTH, FPS, MAX_TIMESTEPS, RED_CAR_IMAGE, VISUALISATION_STEP, TRAINING_EPISODES, EXPERIENCE_CAPACITY
-from cars import CarAgent
+from config import BATCH_SIZE, DISCOUNT_FACTOR, TARGET_UPDATE_STRENGTH, TARGET_UPDATE_INTERVAL, LR, EXPERIENCE_CAPACITY, NETWORK_INPUT_SIZE, NETWORK_ACTION_SIZE, PRIORITISED_REPLAY
 
+def createMemoryArray(shape, dtype, path=None, name=None, resume=False):
+    # Replay memories that are checkpointed live in memory-mapped .npy files, so saving them only has to flush what has changed
+    if path is None:
+        return np.zeros(shape, dtype=dtype)
+
+    return np.lib.format.open_memmap(f"{path}/{name}.npy", mode="r+" if resume else "w+", dtype=dtype, shape=shape)
+
+def flushMemoryArray(array):
+    if isinstance(array, np.memmap):
+        array.flush()
+
+def saveCheckpointFile(state, path):
+    # Written to a temporary file first so a crash while saving never leaves a half written checkpoint
+    with open(path + ".tmp", "wb") as file:
+        pickle.dump(state, file)
+
+    os.replace(path + ".tmp", path)
+
+def loadCheckpointFile(path):
+    with open(path, "rb") as file:
+        return pickle.load(file)
 
 class ExperienceMemory:
-    def __init__(self, maximumSize):
-        # Deque for efficiency
-        self.memory = deque([], maxlen=maximumSize)
+    def __init__(self, maximumSize, seed=None, path=None, resume=False):
+        self.maximumSize = maximumSize
+
+        # Every part of an experience has its own preallocated array, used as a ring buffer that overwrites the oldest experiences once it is full
+        self.states = createMemoryArray((maximumSize, NETWORK_INPUT_SIZE), np.float32, path, "states", resume)
+        self.actions = createMemoryArray((maximumSize,), np.int64, path, "actions", resume)
+        self.rewards = createMemoryArray((maximumSize,), np.float32, path, "rewards", resume)
+        self.nextStates = createMemoryArray((maximumSize, NETWORK_INPUT_SIZE), np.float32, path, "nextStates", resume)
+        self.dones = createMemoryArray((maximumSize,), bool, path, "dones", resume)
+
+        self.nextIndex = 0
+        self.size = 0
+
+        self.randomGenerator = np.random.default_rng(seed)
+        self.batchSize = 0
 
     def getSize(self):
         # To check how many experiences are stored in the memory
-        return len(self.memory)
+        return self.size
+
+    def getState(self):
+        # Everything needed to carry on from a checkpoint apart from the experiences, which are flushed to their own files
+        for array in [self.states, self.actions, self.rewards, self.nextStates, self.dones]:
+            flushMemoryArray(array)
+
+        return {"nextIndex": self.nextIndex, "size": self.size, "randomState": self.randomGenerator.bit_generator.state}
+
+    def loadState(self, state):
+        self.nextIndex = state["nextIndex"]
+        self.size = state["size"]
+        self.randomGenerator.bit_generator.state = state["randomState"]
 
     def addExperience(self, state, action, nextState, reward):
-        # Add experience as a tuple
-        self.memory.append((state, action, nextState, reward))
+        index = self.nextIndex
+
+        self.states[index] = np.reshape(state, -1)
+        self.actions[index] = action
+        self.rewards[index] = reward
+
+        # The agent crashed if there is no next state
+        if nextState is None:
+            self.nextStates[index] = 0
+            self.dones[index] = True
+        else:
+            self.nextStates[index] = np.reshape(nextState, -1)
+            self.dones[index] = False
+
+        self.nextIndex = (self.nextIndex + 1) % self.maximumSize
+        self.size = min(self.size + 1, self.maximumSize)
+
+    def addExperiences(self, states, actions, nextStates, rewards, dones):
+        # Add a batch of experiences, keeping only the newest ones if there are more than fit
+        count = min(len(states), self.maximumSize)
+        indices = (self.nextIndex + np.arange(count)) % self.maximumSize
+
+        self.states[indices] = states[-count:]
+        self.actions[indices] = actions[-count:]
+        self.rewards[indices] = rewards[-count:]
+        self.nextStates[indices] = nextStates[-count:]
+        self.dones[indices] = dones[-count:]
+
+        self.nextIndex = (self.nextIndex + count) % self.maximumSize
+        self.size = min(self.size + count, self.maximumSize)
+
+    def allocateBatch(self, batchSize):
+        # Sampled experiences are gathered into the same arrays every time
+        self.batchSize = batchSize
+        self.randomValues = np.zeros(batchSize)
+        self.batchIndices = np.zeros(batchSize, dtype=np.int64)
+
+        self.stateBatch = np.zeros((batchSize, NETWORK_INPUT_SIZE), dtype=np.float32)
+        self.actionBatch = np.zeros(batchSize, dtype=np.int64)
+        self.rewardBatch = np.zeros(batchSize, dtype=np.float32)
+        self.nextStateBatch = np.zeros((batchSize, NETWORK_INPUT_SIZE), dtype=np.float32)
+        self.doneBatch = np.zeros(batchSize, dtype=bool)
 
     def getBatch(self, batchSize):
-        # Randomly sample experiences to create a batch
-        return random.sample(self.memory, batchSize)
+        if batchSize != self.batchSize:
+            self.allocateBatch(batchSize)
+
+        # Random indices below the size, made without allocating by scaling uniform values and truncating them
+        self.randomGenerator.random(out=self.randomValues)
+        self.randomValues *= self.size
+        np.copyto(self.batchIndices, self.randomValues, casting="unsafe")
+
+        np.take(self.states, self.batchIndices, axis=0, out=self.stateBatch)
+        np.take(self.actions, self.batchIndices, out=self.actionBatch)
+        np.take(self.rewards, self.batchIndices, out=self.rewardBatch)
+        np.take(self.nextStates, self.batchIndices, axis=0, out=self.nextStateBatch)
+        np.take(self.dones, self.batchIndices, out=self.doneBatch)
+
+        # The arrays are overwritten by the next batch
+        return self.stateBatch, self.actionBatch, self.rewardBatch, self.nextStateBatch, self.doneBatch
 
 class NeuralNetwork:
     def __init__(self, inputs, outputs):
+        self.layerSizes = [inputs, 128, 128, outputs]
+
+        # Every weight and bias is a view into one flat array, so optimising and blending networks is a few operations on the whole array
+        self.parameters = np.zeros(sum((self.layerSizes[index] + 1) * self.layerSizes[index + 1] for index in range(len(self.layerSizes) - 1)), dtype=np.float32)
+        self.weights, self.biases = self.splitParameters(self.parameters)
+
         # Initialising neural network with small random weights
-        self.weights = [
-            np.random.randn(inputs, 128) * 0.1,
-            np.random.randn(128, 128) * 0.1,
-            np.random.randn(128, outputs) * 0.1
-        ]
+        for weights in self.weights:
+            weights[...] = np.random.randn(*weights.shape) * 0.1
 
-        self.biases = [
-            np.zeros(128),
-            np.zeros(128),
-            np.zeros(outputs)
-        ]
+        # Activations for each batch size, reused by every forward pass of that size
+        self.activations = {}
 
-    def relu(self, x): # Activation function
-        return np.maximum(0, x)
+    def splitParameters(self, parameters):
+        # Views of a flat array laid out like the parameters as each layer's weights and biases
+        weights = []
+        biases = []
+
+        offset = 0
+        for index in range(len(self.layerSizes) - 1):
+            weightCount = self.layerSizes[index] * self.layerSizes[index + 1]
+            weights.append(parameters[offset:offset + weightCount].reshape(self.layerSizes[index], self.layerSizes[index + 1]))
+            offset += weightCount
+
+            biases.append(parameters[offset:offset + self.layerSizes[index + 1]])
+            offset += self.layerSizes[index + 1]
+
+        return weights, biases
+
+    def loadWeights(self, weights, biases):
+        # Copying into the existing arrays keeps them as views into the parameters
+        for layerIndex in range(len(self.weights)):
+            self.weights[layerIndex][...] = weights[layerIndex]
+            self.biases[layerIndex][...] = biases[layerIndex]
+
+    def relu(self, x, out=None): # Activation function
+        return np.maximum(0, x, out=out)
 
     def forwardPass(self, x): # Forward propogation
-        numLayers = len(self.weights)
-        self.layerInputs = []
-        self.layerOutputs = []
+        x = np.asarray(x, dtype=np.float32)
+
+        batchSize = len(x)
+        if batchSize not in self.activations:
+            self.activations[batchSize] = (
+                [np.zeros((batchSize, weights.shape[1]), dtype=np.float32) for weights in self.weights],
+                [np.zeros((batchSize, weights.shape[1]), dtype=np.float32) for weights in self.weights[:-1]]
+            )
 
-        for layerIndex in range(numLayers):
-            x = np.dot(x, self.weights[layerIndex]) + self.biases[layerIndex]
-            self.layerInputs.append(x) # Used during backpropogation to calculate the derivatives of the activation functions from the previous layer
+        # Used during backpropogation, and overwritten by the next forward pass of the same batch size
+        self.layerInputs, hiddenOutputs = self.activations[batchSize]
+        self.layerOutputs = hiddenOutputs + [self.layerInputs[-1]] # No activation function on the output layer
 
-            if layerIndex < numLayers - 1: # No activation function on the output layer
-                x = self.relu(x)
+        for layerIndex in range(len(self.weights)):
+            z = self.layerInputs[layerIndex]
+            np.dot(x, self.weights[layerIndex], out=z)
+            z += self.biases[layerIndex]
 
-            self.layerOutputs.append(x) # Used to calculate derivatives wrt the weights of neurons
+            x = self.relu(z, self.layerOutputs[layerIndex]) if layerIndex < len(self.weights) - 1 else z
 
         return x
 
-class DQNTrainer:
-    def __init__(self, game):
-        self.game = game
+class AdamOptimizer:
+    # Same update as torch.optim.AdamW, applied to a network's flat parameters and gradients in place
+    def __init__(self, parameters, learningRate=LR, betas=(0.9, 0.999), epsilon=1e-8, weightDecay=0.01, amsgrad=True):
+        self.parameters = parameters
+        self.learningRate = learningRate
+        self.beta1, self.beta2 = betas
+        self.epsilon = epsilon
+        self.weightDecay = weightDecay
+        self.amsgrad = amsgrad
+
+        # Moving averages of the gradients and squared gradients, and the largest squared average seen for AMSGrad
+        self.firstMoments = np.zeros_like(parameters)
+        self.secondMoments = np.zeros_like(parameters)
+        self.maxSecondMoments = np.zeros_like(parameters)
+        self.update = np.zeros_like(parameters)
+        self.normalMoments = np.zeros(parameters.shape, dtype=bool)
+
+        self.steps = 0
+
+    def flushDenormals(self, moments):
+        # Moments of parameters that stop getting gradients decay into denormal floats, which make every operation on them many times slower
+        np.abs(moments, out=self.update)
+        np.greater_equal(self.update, np.finfo(np.float32).tiny, out=self.normalMoments)
+        np.multiply(moments, self.normalMoments, out=moments)
+
+    def step(self, gradients):
+        self.steps += 1
+        firstCorrection = 1 - self.beta1 ** self.steps
+        secondCorrection = 1 - self.beta2 ** self.steps
+
+        # Decoupled weight decay
+        self.parameters *= 1 - self.learningRate * self.weightDecay
+
+        self.firstMoments *= self.beta1
+        np.multiply(gradients, 1 - self.beta1, out=self.update)
+        self.firstMoments += self.update
+        self.flushDenormals(self.firstMoments)
+
+        self.secondMoments *= self.beta2
+        np.multiply(gradients, gradients, out=self.update)
+        self.update *= 1 - self.beta2
+        self.secondMoments += self.update
+        self.flushDenormals(self.secondMoments)
+
+        if self.amsgrad:
+            np.maximum(self.maxSecondMoments, self.secondMoments, out=self.maxSecondMoments)
+            secondMoments = self.maxSecondMoments
+        else:
+            secondMoments = self.secondMoments
+
+        # Parameters move by the bias corrected first moment over the root of the bias corrected second moment
+        np.sqrt(secondMoments, out=self.update)
+        self.update *= 1 / math.sqrt(secondCorrection)
+        self.update += self.epsilon
+        np.divide(self.firstMoments, self.update, out=self.update)
+        self.update *= self.learningRate / firstCorrection
+
+        self.parameters -= self.update
+
+def saveNetwork(network, path):
+    # Every layer's weights and biases in one .npz file, so the network can be loaded without torch
+    arrays = {}
+    for layerIndex in range(len(network.weights)):
+        arrays[f"weights{layerIndex}"] = network.weights[layerIndex]
+        arrays[f"biases{layerIndex}"] = network.biases[layerIndex]
+
+    np.savez(path, **arrays)
+
+def loadNetwork(path):
+    with np.load(path) as arrays:
+        layerCount = len(arrays.files) // 2
+        weights = [arrays[f"weights{layerIndex}"] for layerIndex in range(layerCount)]
+        biases = [arrays[f"biases{layerIndex}"] for layerIndex in range(layerCount)]
+
+    network = NeuralNetwork(weights[0].shape[0], weights[-1].shape[1])
+    network.loadWeights(weights, biases)
+
+    return network
+
+class InferenceEngine:
+    # Same interface as model.InferenceEngine, so agents can act with a NumPy network instead of a torch one
+    def __init__(self, network):
+        self.network = network
+
+    def getQValues(self, states):
+        # The Q-Values are overwritten by the network's next forward pass of the same batch size
+        return self.network.forwardPass(states)
+
+    def selectActions(self, states):
+        # Index of the best action for each state
+        return self.getQValues(states).argmax(axis=1)
+
+class NumpyLearner:
+    # Learns with NumPy networks and the Adam optimiser above, with the same interface as model.TorchLearner
+    def __init__(self, checkpointPath=None, resume=False):
+        # Experiences are only ever sampled uniformly here, so training with prioritised replay turned on would quietly ignore it
+        if PRIORITISED_REPLAY:
+            raise ValueError("PRIORITISED_REPLAY is only supported by the torch learner, train with the torch backend or turn it off in config.py")
 
-        # Input and output layer sizes
-        self.inputSize = 6
-        self.actionSize = 6
-        
         # Initialising policy and target network
-        self.policyNet = NeuralNetwork(self.inputSize, self.actionSize)
-        self.targetNet = NeuralNetwork(self.inputSize, self.actionSize)
+        self.policyNet = NeuralNetwork(NETWORK_INPUT_SIZE, NETWORK_ACTION_SIZE)
+        self.targetNet = NeuralNetwork(NETWORK_INPUT_SIZE, NETWORK_ACTION_SIZE)
 
         # Copying the policy network to the target network
-        self.targetNet.weights = [np.copy(weights) for weights in self.policyNet.weights]
-        self.targetNet.biases = [np.copy(biases) for biases in self.policyNet.biases]
+        self.targetNet.parameters[...] = self.policyNet.parameters
 
-        self.memory = ExperienceMemory(EXPERIENCE_CAPACITY)
+        # The training car acts through the policy network
+        self.inferenceEngine = InferenceEngine(self.policyNet)
 
-        self.episode = 0
+        self.optimizer = AdamOptimizer(self.policyNet.parameters)
+        self.memory = ExperienceMemory(EXPERIENCE_CAPACITY, path=checkpointPath, resume=resume)
 
-    def huberLoss(self, actualY, targetY, threshold=1):
-        difference = actualY - targetY
-        absoluteDifference = np.abs(difference)
+        # Gradients laid out like the policy network's parameters, with a view for every weight and bias
+        self.gradients = np.zeros_like(self.policyNet.parameters)
+        self.weightGradients, self.biasGradients = self.policyNet.splitParameters(self.gradients)
+        self.targetBlend = np.zeros_like(self.policyNet.parameters)
 
-        # Squared loss below the threshold and absolute loss above the threshold
-        loss = np.where(absoluteDifference <= threshold, 0.5 * absoluteDifference**2, threshold * (absoluteDifference - (threshold * 0.5)))
+        # Buffers for the loss and its derivatives, allocated for the batch size on the first update
+        self.batchSize = 0
 
-        return loss
+        self.stepsSinceTargetUpdate = 0
 
-    def huberLossDerivative(self, actualY, targetY, threshold=1):
-        difference = actualY - targetY  
-        absoluteDifference = np.abs(difference)
+    def allocateBatch(self, batchSize):
+        self.batchSize = batchSize
 
-        # The derrivative is equal to the absolute difference below the threshold and -1 or 1 (assuming threshold is 1) above the threshold
-        derrivative = np.where(absoluteDifference <= threshold, difference, threshold * np.sign(difference))
+        # Flat index of each experience's Q-Value row, so the chosen actions can be gathered without fancy indexing
+        self.rowOffsets = np.arange(batchSize, dtype=np.int64) * NETWORK_ACTION_SIZE
+        self.actionIndices = np.zeros(batchSize, dtype=np.int64)
+        self.notDone = np.zeros(batchSize, dtype=bool)
 
-        return derrivative
+        self.selectedQValues = np.zeros(batchSize, dtype=np.float32)
+        self.expectedQValues = np.zeros(batchSize, dtype=np.float32)
+        self.selectedDerivatives = np.zeros(batchSize, dtype=np.float32)
+        self.lossDerivative = np.zeros((batchSize, NETWORK_ACTION_SIZE), dtype=np.float32)
 
-    def reluDerivative(self, x):
-        # Returns 0 if x is less than or equal to 0 and 1 if greater than 0
-        return (x > 0).astype(float)
+        # Derivatives of the loss wrt each hidden layer's outputs, and which of its neurons were active
+        self.hiddenDerivatives = [np.zeros((batchSize, weights.shape[1]), dtype=np.float32) for weights in self.policyNet.weights[:-1]]
+        self.activeNeurons = [np.zeros((batchSize, weights.shape[1]), dtype=bool) for weights in self.policyNet.weights[:-1]]
 
-    def backpropagation(self, inputs, derivativeLoss):
-        # To store gradients for gradient descent
-        weightGradients = []
-        biasGradients = []
+    def huberLossDerivative(self, actualY, targetY, out, threshold=1):
+        # The derrivative is equal to the difference below the threshold and -threshold or threshold above it
+        np.subtract(actualY, targetY, out=out)
+        np.clip(out, -threshold, threshold, out=out)
 
+        return out
+
+    def backpropagation(self, inputs, derivativeLoss):
+        # Gradients are written into self.gradients, which lines up with the policy network's parameters
         # Derrivatives of the loss wrt the outputs of the layer
         # These value start out being equal to the derrivatives of the loss wrt the outputs of the output layer 
         # This is because there is no activation function on the output layer
@@ -115,168 +342,120 @@ class DQNTrainer:
             if layerIndex != 0: # If its not the input layer
                 # Use the outputs of the previous layer to calculate the derrivatives wrt the weights
                 # We use .T to transpose the inputs so that the shape of the input matrix lines up with the dLdZ matrix
-                dLdW = np.dot(self.policyNet.layerOutputs[layerIndex - 1].T, dLdZ) / BATCH_SIZE
+                np.dot(self.policyNet.layerOutputs[layerIndex - 1].T, dLdZ, out=self.weightGradients[layerIndex])
             else: # If its the input layer
                 # Use the inputs to calculate the derrivatives wrt the weights
-                dLdW = np.dot(inputs.T, dLdZ) / BATCH_SIZE
+                np.dot(inputs.T, dLdZ, out=self.weightGradients[layerIndex])
 
             # Derrivatives of biases
-            dLdB = np.sum(dLdZ, axis=0) / BATCH_SIZE
-
-            weightGradients.append(dLdW)
-            biasGradients.append(dLdB)
+            np.sum(dLdZ, axis=0, out=self.biasGradients[layerIndex])
 
             #  If its not the input layer
             if layerIndex != 0:  
                 # Use the dZdA where A is the post-activation values of the previous layer (equal to the weights of the current layer) to find dLdA
-                dLdA = np.dot(dLdZ, self.policyNet.weights[layerIndex].T)
+                dLdA = np.dot(dLdZ, self.policyNet.weights[layerIndex].T, out=self.hiddenDerivatives[layerIndex - 1])
+
+                # Use the derivative of the activation function, which is 1 for active neurons and 0 otherwise, to find the dLdZ of the previous layer
+                activeNeurons = np.greater(self.policyNet.layerInputs[layerIndex - 1], 0, out=self.activeNeurons[layerIndex - 1])
+                dLdZ = np.multiply(dLdA, activeNeurons, out=dLdA)
+
+        return self.weightGradients, self.biasGradients
+
+    def computeGradients(self, states, actions, rewards, nextStates, dones):
+        # Gradients of the mean Huber loss of a batch, written into self.gradients
+        batchSize = len(states)
+        if self.batchSize != batchSize:
+            self.allocateBatch(batchSize)
+
+        # Calculate and gather Q-Values for the chosen actions
+        stateActionQValues = self.policyNet.forwardPass(states)
+
+        np.add(self.rowOffsets, actions, out=self.actionIndices)
+        np.take(stateActionQValues.reshape(-1), self.actionIndices, out=self.selectedQValues)
 
-                # Use the derivative of the activation function to find the dLdZ of the previous layer
-                dLdZ = dLdA * self.reluDerivative(self.policyNet.layerInputs[layerIndex - 1])
+        # Calculate target Q-Values for the next state, which are 0 if the agent crashed
+        nextStateQValues = self.targetNet.forwardPass(nextStates)
+        np.max(nextStateQValues, axis=1, out=self.expectedQValues)
+        np.logical_not(dones, out=self.notDone)
+        self.expectedQValues *= self.notDone
 
-        # Reverse the gradients because they were appended backwards
-        weightGradients.reverse()
-        biasGradients.reverse()
+        # Compute the expected Q-Values
+        self.expectedQValues *= DISCOUNT_FACTOR
+        self.expectedQValues += rewards
 
-        return weightGradients, biasGradients
+        # Derivative of the mean Huber loss, which is 0 for every action that was not chosen
+        self.huberLossDerivative(self.selectedQValues, self.expectedQValues, self.selectedDerivatives)
+        self.selectedDerivatives *= 1 / batchSize
 
-    def gradientDescent(self, weightGradients, biasGradients):
-        for layerIndex in range(len(self.policyNet.weights)):
-            # Retrieve gradients for current layer
-            dLdW = weightGradients[layerIndex]
-            dLdB = biasGradients[layerIndex]
+        self.lossDerivative.fill(0)
+        np.put(self.lossDerivative.reshape(-1), self.actionIndices, self.selectedDerivatives)
 
-            # Clip gradients to stabilise training
-            dLdW = np.clip(dLdW, -1.0, 1.0)
-            dLdB = np.clip(dLdB, -1.0, 1.0)
+        # Perform backpropogation to calculate gradients
+        self.backpropagation(states, self.lossDerivative)
 
-            # Update the weights and biases using our chosen learning rate value
-            self.policyNet.weights[layerIndex] -= LR * dLdW
-            self.policyNet.biases[layerIndex] -= LR * dLdB
+    def learnFromBatch(self, states, actions, rewards, nextStates, dones):
+        self.computeGradients(states, actions, rewards, nextStates, dones)
 
-    def adam(self):
-        pass
+        # Update the weights and biases with Adam
+        self.optimizer.step(self.gradients)
 
-    def optimizeModel(self):
+    def updateModel(self):
         if self.memory.getSize() >= BATCH_SIZE:
-            experiences = self.memory.getBatch(BATCH_SIZE)
-            
-            # Split batch into states, actions, nextStates and rewards arrays
-            states, actions, nextStates, rewards = zip(*experiences)
-
-            # Convert each array into numpy arrays so I can manipulate them using numpy
-            stateBatch = np.array(states)
-            actionBatch = np.array(actions)
-            rewardBatch = np.array(rewards)
-
-            # Only including valid next states because some might be None because the agent might have crashed
-            nextStateBatch = np.array([state for state in nextStates if state is not None]) 
-
-            # Calculate and gather Q-Values for each action
-            stateActionQValues = self.policyNet.forwardPass(stateBatch)
-            
-            # Separate Q-values for acceleration and turning
-            accelerationQValues = stateActionQValues[:, :3]
-            turningQValues = stateActionQValues[:, 3:]
-
-            # Get the index of the action for each by shifting from -1, 0, 1 -> 0, 1, 2
-            accelerationActions = actionBatch[:, 0] + 1
-            turningActions = actionBatch[:, 1] + 1
-
-            # Gather the Q-Values for the chosen actions
-            selectedAccelerationQValues = accelerationQValues[np.arange(BATCH_SIZE), accelerationActions]
-            selectedTurningQValues = turningQValues[np.arange(BATCH_SIZE), turningActions]
-
-            # Creating a mask of valid states so that invalid states can be filtered out
-            validStateMask = np.array([state is not None for state in nextStates])
-
-            # Calculate Q-Values for the next state
-            nextStateQValues = np.zeros((BATCH_SIZE, self.actionSize))
-
-            if np.any(validStateMask):
-                nextStateQValues[validStateMask] = self.targetNet.forwardPass(nextStateBatch)
-                
-            # Select the max Q-values for acceleration and turning for the next state
-            nextStateAccelerationQValues = np.max(nextStateQValues[:, :3], axis=1)
-            nextStateTurningQValues = np.max(nextStateQValues[:, 3:], axis=1)
-
-            # Calculate the expected Q-Values for both acceleration and turning
-            expectedAccelerationQValues = (nextStateAccelerationQValues * DISCOUNT_FACTOR) + rewardBatch
-            expectedTurningQValues = (nextStateTurningQValues * DISCOUNT_FACTOR) + rewardBatch
-
-            # Calculate Huber loss derivative for both acceleration and turning
-            accelerationLossDerivative = self.huberLossDerivative(selectedAccelerationQValues, expectedAccelerationQValues)
-            turningLossDerivative = self.huberLossDerivative(selectedTurningQValues, expectedTurningQValues)
-            
-            # Insert both loss derivatives into a matrix of the output actions and set the derivatives of the actions that were not chosen to 0
-            lossDerivative = np.zeros((BATCH_SIZE, self.actionSize))
-            lossDerivative[np.arange(BATCH_SIZE), accelerationActions] = accelerationLossDerivative
-            lossDerivative[np.arange(BATCH_SIZE), 3 + turningActions] = turningLossDerivative
-            
-            # Perform backpropogation to calculate gradients
-            weightGradients, biasGradients = self.backpropagation(stateBatch, lossDerivative)
-
-            # Perform gradient descent using calculated gradients
-            self.gradientDescent(weightGradients, biasGradients)
-
-    def train(self):
-        steps = 0
-        spawnPoint, spawnAngle = self.game.track.getSpawnPosition()
-
-        self.episode_rewards = []
-        self.episode_qvalues = []
-        self.episode_epsilons = []
-
-        # Stop the training after a specified number of episodes
-        while self.episode <= TRAINING_EPISODES:
-            # Update the training menu after each episode
-            self.game.trainingMenu()
-
-            self.episode += 1
-
-            # Initialise the car agent
-            agentCar = CarAgent(spawnPoint.x, spawnPoint.y, spawnAngle, RED_CAR_IMAGE, self.policyNet, True)
-            
-            state = agentCar.getState(self.game.track)
-
-            # Stop the training episode after a certain amount of steps so the episode does not run indefinitely
-            for timeStep in range(MAX_TIMESTEPS):
-                for event in pygame.event.get():
-                    if event.type == pygame.QUIT:
-                        self.game.running = False
-
-                if self.game.running == False:
-                    return
-
-                steps += 1
-
-                # Retrieving new transition
-                action, nextState, reward, terminated, truncated = agentCar.update(TRAINING_TIMESTEP, self.game.track, steps)
-
-                if terminated:
-                    nextState = None
-
-                # Store transition in memory
-                self.memory.addExperience(state, action, nextState, reward)
-
-                # Move to the next state
-                state = nextState
-
-                # Perform one step of optimisation on the policy network
-                self.optimizeModel()
-
-                # Soft update target network
-                self.partialUpdateTargetNetwork()
-
-                if terminated or truncated:
-                    print(f"Episode {self.episode} finished after {timeStep} timesteps.")
-                    break
-            
-            # Visualise the episode
-            if (self.episode) % VISUALISATION_STEP == 0:
-                self.game.visualizeEpisode()
+            self.learnFromBatch(*self.memory.getBatch(BATCH_SIZE))
     
-    def partialUpdateTargetNetwork(self):
-        for layerIndex in range(len(self.policyNet.weights)):
-            self.targetNet.weights[layerIndex] = self.policyNet.weights[layerIndex] * TARGET_UPDATE_STRENGTH + self.targetNet.weights[layerIndex] * (1.0 - TARGET_UPDATE_STRENGTH)
-            self.targetNet.biases[layerIndex] = self.policyNet.biases[layerIndex] * TARGET_UPDATE_STRENGTH + self.targetNet.biases[layerIndex] * (1.0 - TARGET_UPDATE_STRENGTH)
\ No newline at end of file
+    def softUpdateTargetNetwork(self):
+        self.stepsSinceTargetUpdate += 1
+        if self.stepsSinceTargetUpdate < TARGET_UPDATE_INTERVAL:
+            return
+
+        self.stepsSinceTargetUpdate = 0
+
+        # Blend the policy network into the target network without replacing the target arrays
+        self.targetNet.parameters *= 1.0 - TARGET_UPDATE_STRENGTH
+        np.multiply(self.policyNet.parameters, TARGET_UPDATE_STRENGTH, out=self.targetBlend)
+        self.targetNet.parameters += self.targetBlend
+
+    def getPolicyWeights(self):
+        # Copies of the policy network's weights and biases, for acting in environment workers and the viewer
+        return [weights.copy() for weights in self.policyNet.weights], [biases.copy() for biases in self.policyNet.biases]
+
+    def loadPolicyWeights(self, weights, biases):
+        # Both networks start from the given weights
+        self.policyNet.loadWeights(weights, biases)
+        self.targetNet.parameters[...] = self.policyNet.parameters
+
+    def getQValues(self, states):
+        return self.policyNet.forwardPass(states).copy()
+
+    def getGradients(self, states, actions, rewards, nextStates, dones):
+        # Gradients of the loss of a batch without updating the network, for comparing learners
+        self.computeGradients(states, actions, rewards, nextStates, dones)
+
+        return [gradients.copy() for gradients in self.weightGradients], [gradients.copy() for gradients in self.biasGradients]
+
+    def savePolicy(self, path):
+        saveNetwork(self.policyNet, path + ".npz")
+
+    def saveCheckpoint(self, path):
+        saveCheckpointFile({
+            "policyNet": self.policyNet.parameters,
+            "targetNet": self.targetNet.parameters,
+            "optimizer": {"steps": self.optimizer.steps, "firstMoments": self.optimizer.firstMoments, "secondMoments": self.optimizer.secondMoments, "maxSecondMoments": self.optimizer.maxSecondMoments},
+            "memory": self.memory.getState(),
+            "stepsSinceTargetUpdate": self.stepsSinceTargetUpdate,
+        }, f"{path}/learner.pkl")
+
+    def loadCheckpoint(self, path):
+        state = loadCheckpointFile(f"{path}/learner.pkl")
+
+        # Copied into the existing arrays so the weight and moment views stay in place
+        self.policyNet.parameters[...] = state["policyNet"]
+        self.targetNet.parameters[...] = state["targetNet"]
+
+        self.optimizer.steps = state["optimizer"]["steps"]
+        self.optimizer.firstMoments[...] = state["optimizer"]["firstMoments"]
+        self.optimizer.secondMoments[...] = state["optimizer"]["secondMoments"]
+        self.optimizer.maxSecondMoments[...] = state["optimizer"]["maxSecondMoments"]
+
+        self.memory.loadState(state["memory"])
+        self.stepsSinceTargetUpdate = state["stepsSinceTargetUpdate"]
@@ -0,0 +1,28 @@
+import os
+
+from config import MODELS_PATH
+import modelNumpy
+
+# Files a policy can be saved as, from the trained state dict to the exports made by export.py
+MODEL_EXTENSIONS = [".model", ".pt", ".int8.pt", ".npz"]
+
+def getModelNames():
+    # Every policy in the models folder, whichever files it has been saved as
+    modelNames = set()
+    for fileName in os.listdir(MODELS_PATH):
+        for extension in MODEL_EXTENSIONS:
+            if fileName.endswith(extension):
+                modelNames.add(fileName[:-len(extension)])
+
+    # .int8.pt also ends in .pt, so its name still ends in .int8
+    return sorted(modelName for modelName in modelNames if not modelName.endswith(".int8"))
+
+def loadInferenceEngine(modelName, device="cpu"):
+    # The NumPy copy is used whenever there is one, so racing only imports torch for models that have not been converted
+    numpyPath = f"{MODELS_PATH}/{modelName}.npz"
+    if os.path.isfile(numpyPath):
+        return modelNumpy.InferenceEngine(modelNumpy.loadNetwork(numpyPath))
+
+    from model import InferenceEngine, loadPolicy
+
+    return InferenceEngine(loadPolicy(modelName, device), device)
@@ -1,8 +1,12 @@
 from config import TRACK_WIDTH, TRACK_HEIGHT, TRACKS_PATH, COLOUR_SCHEME, CHECKPOINT_FREQUENCY, FONT_64
 
 import pygame
+import numpy as np
 import math
 import json
+import hashlib
+
+import instrumentation
 
 class Track:
     def __init__(self, filePath=None):
@@ -16,9 +20,15 @@ class Track:
             self.trackWidth = 250
             self.trackColour = (50, 50, 50)
 
-        self.curves = None
+        self.curvePoints = None
+        self.curveOffsets = None
         self.checkpoints = None
 
+        # Segments of the track shown in the editor and the areas they and the control points cover
+        self.editorCurves = []
+        self.editorCurveAreas = []
+        self.editorPointAreas = []
+
         self.minCurvePoints = 50
         self.pointFrequency = 20
         self.finalPointFrequency = 5
@@ -40,6 +50,27 @@ class Track:
         self.lineThickness = 10
         self.lineColour = COLOUR_SCHEME[1]
 
+        # Distances in the distance field are capped so they fit in a byte
+        self.maxFieldDistance = 255
+
+        # Spacing in pixels of the centre line points used to measure progress along the track and the size of the grid cells used to find them
+        self.progressSpacing = 8
+        self.progressCellSize = 32
+        # A moving car checks its last segment first, then the segments either side, and walks towards whichever is strictly closer
+        # It walks at most progressTrackingWidth segments in one update, covering more than a full speed training step
+        self.progressWalkOffsets = (0, -1, 1)
+        self.progressTrackingWidth = 16
+
+        # Distance along the track between each row of the starting grid
+        self.gridRowSpacing = 200
+
+        # The compiled track is drawn in square tiles so only the tiles on screen are blitted
+        self.tileSize = 256
+        self.tiles = None
+
+        # Changing this invalidates every compiled track on disk
+        self.cacheVersion = 4
+
     def addPoint(self, position):
         self.points.append(position)
 
@@ -58,94 +89,217 @@ class Track:
             if math.dist(mousePosition, point) < self.pointRadius:
                 return index
 
-    def getLines(self):
-        lines = []
+    def getCurves(self, segments=None):
+        # Samples of every Catmull-Rom segment of the closed track, evaluated together in one (N, 2) array
+        # Segment i runs from control point i to control point i + 1 and its samples are curvePoints[curveOffsets[i]:curveOffsets[i + 1]]
+        # Only the segments listed are evaluated if segments is given
+        if len(self.points) <= 3:
+            return np.empty((0, 2)), np.zeros(1, dtype=np.int64)
+
+        controlPoints = np.array([(point.x, point.y) for point in self.points])
+        if segments is None:
+            segments = np.arange(len(controlPoints))
+
+        segments = np.asarray(segments)
+        point0 = controlPoints[(segments - 1) % len(controlPoints)]
+        point1 = controlPoints[segments]
+        point2 = controlPoints[(segments + 1) % len(controlPoints)]
+        point3 = controlPoints[(segments + 2) % len(controlPoints)]
 
-        for i in range(len(self.points) - 2):
-            lines += self.getCurve(self.points[i:i+3])
+        # Long segments are sampled every pointFrequency pixels instead of a fixed number of times
+        distances = np.linalg.norm(point2 - point1, axis=1)
+        curvePointCounts = np.where(distances > 1000, (distances / self.pointFrequency).astype(np.int64), self.minCurvePoints)
+
+        curveOffsets = np.zeros(len(segments) + 1, dtype=np.int64)
+        np.cumsum(curvePointCounts + 1, out=curveOffsets[1:])
+
+        segmentIndices = np.repeat(np.arange(len(segments)), curvePointCounts + 1)
+        t = ((np.arange(curveOffsets[-1]) - curveOffsets[segmentIndices]) / curvePointCounts[segmentIndices])[:, None]
+
+        # Polynomial coefficients of each segment, gathered for every sample
+        coefficient0 = (2 * point1)[segmentIndices]
+        coefficient1 = (-point0 + point2)[segmentIndices]
+        coefficient2 = (2 * point0 - 5 * point1 + 4 * point2 - point3)[segmentIndices]
+        coefficient3 = (-point0 + 3 * point1 - 3 * point2 + point3)[segmentIndices]
 
-        return lines
+        curvePoints = 0.5 * (coefficient0 + coefficient1 * t + coefficient2 * t**2 + coefficient3 * t**3)
 
-    def getCurve(self, points):
-        curve = []
-        curvePoints = self.minCurvePoints
+        return curvePoints, curveOffsets
 
-        distance = math.dist(points[1], points[2])
-        if distance > 1000:
-            curvePoints = int(distance / self.pointFrequency)
+    def getCheckpointIndices(self, curveOffsets):
+        curvePointCounts = np.diff(curveOffsets)
+        segmentIndices = np.repeat(np.arange(len(curvePointCounts)), curvePointCounts)
+        indices = np.arange(curveOffsets[-1]) - curveOffsets[segmentIndices]
 
-        for index in range(curvePoints + 1):
-            t = index / curvePoints
+        # Every CHECKPOINT_FREQUENCY samples along each segment, keeping checkpointOffset samples away from both ends
+        selected = (indices >= self.checkpointOffset) & (indices < curvePointCounts[segmentIndices] - self.checkpointOffset - 1) & (indices % CHECKPOINT_FREQUENCY == 0)
+        selected = np.flatnonzero(selected)
 
-            x = 0.5 * (
-                (2 * points[1].x) +
-                (-points[0].x + points[2].x) * t +
-                (2 * points[0].x - 5 * points[1].x + 4 * points[2].x - points[3].x) * t**2 +
-                (-points[0].x + 3 * points[1].x - 3 * points[2].x + points[3].x) * t**3
-            )
+        return selected, segmentIndices[selected]
 
-            y = 0.5 * (
-                (2 * points[1].y) +
-                (-points[0].y + points[2].y) * t +
-                (2 * points[0].y - 5 * points[1].y + 4 * points[2].y - points[3].y) * t**2 +
-                (-points[0].y + 3 * points[1].y - 3 * points[2].y + points[3].y) * t**3
-            )
+    def getCheckpoints(self, curvePoints, curveOffsets):
+        selected = self.getCheckpointIndices(curveOffsets)[0]
 
-            curve.append(pygame.Vector2(x, y))
+        points = curvePoints[selected]
+        differences = curvePoints[selected + 1] - points
 
-        return curve
+        perpendicularDirections = np.stack([-differences[:, 1], differences[:, 0]], axis=1)
+        perpendicularDirections /= np.linalg.norm(perpendicularDirections, axis=1, keepdims=True)
 
-    def getCurves(self):
-        curves = []
+        offsets = perpendicularDirections * self.trackWidth
+        starts = (points + offsets).tolist()
+        ends = (points - offsets).tolist()
 
-        if len(self.points) > 3:
-            curves.append(self.getCurve([self.points[-1]] + self.points[:3]))
-            
-            for i in range(len(self.points) - 3):
-                curves.append(self.getCurve(self.points[i:i + 4]))
-            
-            curves.append(self.getCurve(self.points[-3:] + [self.points[0]]))
-            curves.append(self.getCurve(self.points[-2:] + self.points[:2]))
+        return [(pygame.Vector2(start), pygame.Vector2(end)) for start, end in zip(starts, ends)]
+
+    def drawCircles(self, screen, curvePoints):
+        for point in curvePoints.tolist():
+            pygame.draw.circle(screen, self.trackColour, point, self.trackWidth)
+
+    def drawRoad(self, screen, curvePoints, curveOffsets, area=None):
+        # Road drawn as polygon strips along the centre line, with circles only at the joints where the strips would leave gaps
+        # Strips and circles outside area are skipped
+        # Each curve starts where the previous one ends, so the centre line is one closed loop of points
+        points = np.delete(curvePoints, curveOffsets[1:] - 1, axis=0)
+        nextPoints = np.roll(points, -1, axis=0)
 
-        return curves
+        # Normals from the direction between the neighbouring points so the edges of neighbouring strips meet
+        tangents = nextPoints - np.roll(points, 1, axis=0)
+        normals = np.stack([-tangents[:, 1], tangents[:, 0]], axis=1)
+        normals /= np.maximum(np.linalg.norm(normals, axis=1, keepdims=True), 1e-9)
 
-    def getCheckpoints(self, curves):
-        checkpoints = []
-        # restor midpoint code so if there is not enough points in a curve we can add a checkpoint at midpoint of a curve
-        for curve in curves:
-            for index in range(len(curve) - self.checkpointOffset * 2 - 1):
-                if (index + self.checkpointOffset) % CHECKPOINT_FREQUENCY == 0:
-                    point1 = pygame.Vector2(curve[index + self.checkpointOffset])
-                    point2 = pygame.Vector2(curve[index + self.checkpointOffset + 1])
+        leftEdge = points + normals * self.trackWidth
+        rightEdge = points - normals * self.trackWidth
 
-                    difference = point2 - point1
-                    perpendicularDirection = pygame.Vector2(-difference.y, difference.x).normalize()
+        # Segment i goes from point i to point i + 1
+        segments = nextPoints - points
+        directions = segments / np.maximum(np.linalg.norm(segments, axis=1, keepdims=True), 1e-9)
 
-                    offset = perpendicularDirection * self.trackWidth
-                    checkpoints.append((point1 + offset, point1 - offset))
+        # Joints that turn enough for the strip edge to cut more than half a pixel inside the circle around the joint
+        turnCosines = np.clip((directions * np.roll(directions, 1, axis=0)).sum(axis=1), -1, 1)
+        joints = self.trackWidth * (1 - np.sqrt((1 + turnCosines) / 2)) >= 0.5
 
-        return checkpoints
+        # Splitting the loop into strips at the start of every curve and at every sharp joint
+        curveStarts = np.zeros(len(points), dtype=bool)
+        curveStarts[curveOffsets[:-1] - np.arange(len(curveOffsets) - 1)] = True
+        breaks = np.flatnonzero(curveStarts | joints).tolist() + [len(points)]
 
-    def drawCircles(self, screen, curves):
-        for curve in curves:
-            for point in curve:
-                pygame.draw.circle(screen, self.trackColour, point, self.trackWidth)
+        # On the inside of bends tighter than the track width the strip edge runs backwards and folds over itself, leaving holes
+        # These are filled with circles spaced closely enough that the gaps between them are less than half a pixel deep
+        folded = ((np.roll(leftEdge, -1, axis=0) - leftEdge) * segments).sum(axis=1) <= 0
+        folded |= ((np.roll(rightEdge, -1, axis=0) - rightEdge) * segments).sum(axis=1) <= 0
+        folded |= np.roll(folded, 1)
+
+        circleSpacing = 2 * math.sqrt(self.trackWidth)
+        # Distances are measured from the start of each curve so editing one curve does not move the circles on the others
+        arcLengths = np.concatenate([[0], np.cumsum(np.linalg.norm(segments, axis=1))[:-1]])
+        arcLengths -= np.maximum.accumulate(np.where(curveStarts, arcLengths, 0))
+        spacingIndices = (arcLengths // circleSpacing).astype(np.int64)
+        firstInSpacing = spacingIndices != np.roll(spacingIndices, 1)
+        foldEnds = folded & ~(np.roll(folded, 1) & np.roll(folded, -1))
 
-    def drawEditor(self, screen, drawCheckpoints=False):
-        curves = self.getCurves()
-        self.drawCircles(screen, curves)
+        joints |= folded & (firstInSpacing | foldEnds)
+        jointPoints = points[joints]
 
-        for index, curve in enumerate(curves):
-            for point in curve:
-                pygame.draw.lines(screen, self.lineColour, False, curve, self.lineThickness)
+        leftEdge = np.vstack([leftEdge, leftEdge[:1]])
+        rightEdge = np.vstack([rightEdge, rightEdge[:1]])
+
+        visibleStrips = np.ones(len(breaks) - 1, dtype=bool)
+        if area is not None:
+            # Bounding box of each strip, which includes the first point of the next strip
+            starts = np.array(breaks[:-1])
+            ends = np.array(breaks[1:])
+            minimums = np.minimum(np.minimum(np.minimum.reduceat(leftEdge, starts), leftEdge[ends]), np.minimum(np.minimum.reduceat(rightEdge, starts), rightEdge[ends]))
+            maximums = np.maximum(np.maximum(np.maximum.reduceat(leftEdge, starts), leftEdge[ends]), np.maximum(np.maximum.reduceat(rightEdge, starts), rightEdge[ends]))
+
+            visibleStrips = (maximums[:, 0] >= area.left - 1) & (minimums[:, 0] <= area.right) & (maximums[:, 1] >= area.top - 1) & (minimums[:, 1] <= area.bottom)
+
+            circleArea = area.inflate(self.trackWidth * 2 + 2, self.trackWidth * 2 + 2)
+            jointPoints = jointPoints[(jointPoints[:, 0] >= circleArea.left) & (jointPoints[:, 0] < circleArea.right) & (jointPoints[:, 1] >= circleArea.top) & (jointPoints[:, 1] < circleArea.bottom)]
+
+        for index in np.flatnonzero(visibleStrips).tolist():
+            start, end = breaks[index], breaks[index + 1]
+            pygame.draw.polygon(screen, self.trackColour, np.concatenate([leftEdge[start:end + 1], rightEdge[end:start - 1 if start > 0 else None:-1]]).tolist())
+
+        for point in jointPoints.tolist():
+            pygame.draw.circle(screen, self.trackColour, point, self.trackWidth)
+
+    def getPointArea(self, index):
+        # Area covered by a control point and its label in the editor
+        point = self.points[index]
+        pointArea = pygame.Rect(0, 0, self.pointRadius * 2 + 2, self.pointRadius * 2 + 2)
+        pointArea.center = point
+
+        labelArea = pygame.Rect(point + self.pointLabelOffset, FONT_64.size(f"P{index}"))
+
+        return pointArea.union(labelArea)
+
+    def getCurveArea(self, curve):
+        # Area covered by the road and centre line of a segment
+        left, top = curve.min(axis=0)
+        right, bottom = curve.max(axis=0)
+
+        margin = self.trackWidth + max(self.lineThickness, self.finishLineThickness, self.checkpointThickness) + 2
+        return pygame.Rect(left - margin, top - margin, right - left + margin * 2, bottom - top + margin * 2)
+
+    def updateEditorCurves(self, movedPoint=None):
+        # Recomputes the editor segments, only redoing the four segments that use movedPoint if only that point has moved
+        # Returns the area of the track surface that needs redrawing
+        segmentCount = len(self.points) if len(self.points) > 3 else 0
+
+        if movedPoint is None or len(self.editorCurves) != segmentCount or len(self.editorPointAreas) != len(self.points):
+            curvePoints, curveOffsets = self.getCurves()
+            self.editorCurves = np.split(curvePoints, curveOffsets[1:-1]) if segmentCount > 0 else []
+            self.editorCurveAreas = [self.getCurveArea(curve) for curve in self.editorCurves]
+            self.editorPointAreas = [self.getPointArea(index) for index in range(len(self.points))]
+
+            return pygame.Rect(0, 0, TRACK_WIDTH, TRACK_HEIGHT)
+
+        dirtyArea = self.editorPointAreas[movedPoint]
+        self.editorPointAreas[movedPoint] = self.getPointArea(movedPoint)
+        dirtyArea = dirtyArea.union(self.editorPointAreas[movedPoint])
+
+        if segmentCount > 0:
+            # Segment i uses control points i - 1 to i + 2
+            segments = sorted({(movedPoint + offset) % segmentCount for offset in range(-2, 2)})
+            curvePoints, curveOffsets = self.getCurves(segments)
+
+            for segment, curve in zip(segments, np.split(curvePoints, curveOffsets[1:-1])):
+                dirtyArea = dirtyArea.union(self.editorCurveAreas[segment])
+
+                self.editorCurves[segment] = curve
+                self.editorCurveAreas[segment] = self.getCurveArea(curve)
+                dirtyArea = dirtyArea.union(self.editorCurveAreas[segment])
+
+        return dirtyArea
+
+    def drawEditor(self, screen, drawCheckpoints=False, area=None):
+        # Draws the editor view from the segments computed by updateEditorCurves, skipping everything outside area
+        if area is None:
+            area = screen.get_rect()
+
+        if len(self.editorCurves) > 0:
+            curvePoints = np.concatenate(self.editorCurves)
+            curveOffsets = np.cumsum([0] + [len(curve) for curve in self.editorCurves])
+            self.drawRoad(screen, curvePoints, curveOffsets, area)
+
+        for curve, curveArea in zip(self.editorCurves, self.editorCurveAreas):
+            if curveArea.colliderect(area):
+                pygame.draw.lines(screen, self.lineColour, False, curve.tolist(), self.lineThickness)
         
         for index, point in enumerate(self.points):
+            if not self.editorPointAreas[index].colliderect(area):
+                continue
+
             pointLabel = FONT_64.render(f"P{index}", True, self.pointLabelColour)
             
             pygame.draw.circle(screen, self.pointColour, point, self.pointRadius)
             screen.blit(pointLabel, point + self.pointLabelOffset)
-        
-        checkpoints = self.getCheckpoints(curves)
+
+        if len(self.editorCurves) == 0:
+            return
+
+        checkpoints = self.getCheckpoints(curvePoints, curveOffsets)
     
         if drawCheckpoints:
             for index, checkpoint in enumerate(checkpoints):
@@ -160,26 +314,66 @@ class Track:
             pygame.draw.line(screen, self.finishLineColour, checkpoint[0], checkpoint[1], self.finishLineThickness)
 
     def getSpawnPosition(self):
-        if self.curves:
+        if self.curvePoints is not None and len(self.curvePoints) > 0:
             # Last point in last curve of the track 
-            point1 = pygame.Vector2(self.curves[-1][-2].x, self.curves[-1][-2].y)
-            point2 = pygame.Vector2(self.curves[-1][-1].x, self.curves[-1][-1].y)
+            point1 = pygame.Vector2(self.curvePoints[-2].tolist())
+            point2 = pygame.Vector2(self.curvePoints[-1].tolist())
 
             difference = point2 - point1
             angle = math.degrees(math.atan2(difference.y, difference.x))
 
             return point1, angle
 
+    def getGridPositions(self, count):
+        # Starting positions in rows of two behind the spawn point, each facing along the track, with their progress along it
+        # The progress is known from the grid so cars never snap to another part of the road where it passes close to itself
+        spawnPoint, _ = self.getSpawnPosition()
+        spawnDistance = (self.getProgress(spawnPoint) + self.startDistance) % self.trackLength
+        laneOffset = self.trackWidth / 3
+
+        positions = []
+        for index in range(count):
+            distance = (spawnDistance - (index // 2 + 1) * self.gridRowSpacing) % self.trackLength
+
+            pointX, pointY, segmentX, segmentY, _, segmentDistance, segmentLength = self.progressSegmentList[int(distance // self.progressSpacing)]
+            fraction = (distance - segmentDistance) / segmentLength
+
+            # Alternating between the left and right of the centre line
+            side = pygame.Vector2(-segmentY, segmentX).normalize() * (laneOffset if index % 2 == 0 else -laneOffset)
+            position = pygame.Vector2(pointX + segmentX * fraction, pointY + segmentY * fraction) + side
+            angle = math.degrees(math.atan2(segmentY, segmentX))
+
+            positions.append((position, angle, (distance - self.startDistance) % self.trackLength))
+
+        return positions
+
     def initialiseTrack(self):
-        self.curves = self.getCurves()
-        self.checkpoints = self.getCheckpoints(self.curves)
+        cacheKey = self.getCacheKey()
+
+        self.curvePoints, self.curveOffsets = self.getCurves()
 
         # Adding more curve points when creating final surface
         self.pointFrequency = self.finalPointFrequency
-        finalCurves = self.getCurves()
+
+        # Only compile the track if there is no up to date compiled copy on disk
+        if not self.loadCache(cacheKey):
+            self.compileTrack()
+            self.saveCache(cacheKey)
+
+        # Flat view of the distance field so single lookups return plain ints
+        self.distanceFieldBuffer = memoryview(self.distanceField.reshape(-1))
+
+        self.buildProgressIndex()
+
+        # Tiles are built when the track is first drawn, once there is a window to convert them for
+        self.tiles = None
+
+    def compileTrack(self):
+        self.checkpoints = self.getCheckpoints(self.curvePoints, self.curveOffsets)
+        finalCurvePoints, finalCurveOffsets = self.getCurves()
 
         self.trackSurface = pygame.Surface((TRACK_WIDTH, TRACK_HEIGHT), pygame.SRCALPHA)
-        self.drawCircles(self.trackSurface, finalCurves)
+        self.drawRoad(self.trackSurface, finalCurvePoints, finalCurveOffsets)
 
         # Finish line
         checkpoint = self.checkpoints[0]
@@ -188,13 +382,442 @@ class Track:
         self.mask = pygame.mask.from_surface(self.trackSurface)
         self.mask.invert()
 
+        self.distanceField = self.getDistanceField()
+
+    def getCachePath(self):
+        return f"{TRACKS_PATH}/{self.filePath}.npz"
+
+    def getCacheKey(self):
+        # Hash of the track and every setting used to compile it, so the cache is rebuilt whenever either changes
+        settings = {
+            "Points": [(point.x, point.y) for point in self.points],
+            "TrackWidth": self.trackWidth,
+            "TrackColour": self.trackColour,
+            "TrackSize": (TRACK_WIDTH, TRACK_HEIGHT),
+            "Curves": (self.minCurvePoints, self.pointFrequency, self.finalPointFrequency),
+            "Checkpoints": (self.checkpointOffset, CHECKPOINT_FREQUENCY),
+            "FinishLine": (self.finishLineThickness, self.finishLineColour),
+            "MaxFieldDistance": self.maxFieldDistance,
+            "Version": self.cacheVersion
+        }
+
+        return hashlib.sha256(json.dumps(settings).encode()).hexdigest()
+
+    def saveCache(self, cacheKey):
+        # New tracks have nowhere to be cached until they are exported
+        if not self.filePath:
+            return
+
+        checkpoints = [(checkpoint[0].x, checkpoint[0].y, checkpoint[1].x, checkpoint[1].y) for checkpoint in self.checkpoints]
+
+        with open(self.getCachePath(), "wb") as file:
+            np.savez(file, key=cacheKey, walls=np.packbits(self.getWallArray()), checkpoints=checkpoints, distanceField=self.distanceField)
+
+    def loadCache(self, cacheKey):
+        if not self.filePath:
+            return False
+
+        try:
+            with np.load(self.getCachePath()) as cache:
+                if str(cache["key"]) != cacheKey:
+                    return False
+
+                walls = np.unpackbits(cache["walls"], count=TRACK_WIDTH * TRACK_HEIGHT).reshape(TRACK_HEIGHT, TRACK_WIDTH)
+                checkpoints = cache["checkpoints"].tolist()
+                distanceField = cache["distanceField"]
+        except (OSError, KeyError, ValueError):
+            # A missing or unreadable cache is rebuilt
+            return False
+
+        self.checkpoints = [(pygame.Vector2(x1, y1), pygame.Vector2(x2, y2)) for x1, y1, x2, y2 in checkpoints]
+        self.distanceField = distanceField
+
+        # Palette surfaces use the wall array as their pixels, so the mask is every pixel that is not palette index 0
+        wallSurface = pygame.image.frombuffer(walls, (TRACK_WIDTH, TRACK_HEIGHT), "P")
+        wallSurface.set_colorkey(0)
+        self.mask = pygame.mask.from_surface(wallSurface)
+
+        # Rebuilding the surface from the mask gives the same pixels as drawing the circles again
+        trackMask = self.mask.copy()
+        trackMask.invert()
+        self.trackSurface = trackMask.to_surface(setcolor=self.trackColour, unsetcolor=(0, 0, 0, 0))
+
+        # Finish line
+        checkpoint = self.checkpoints[0]
+        pygame.draw.line(self.trackSurface, self.finishLineColour, checkpoint[0], checkpoint[1], self.finishLineThickness)
+
+        return True
+
+    def buildProgressIndex(self):
+        # The centre line as a closed loop resampled every progressSpacing pixels, so a point's index gives its distance along the track
+        loopPoints = np.delete(self.curvePoints, self.curveOffsets[1:] - 1, axis=0)
+        loopSegments = np.roll(loopPoints, -1, axis=0) - loopPoints
+        loopDistances = np.concatenate([[0], np.cumsum(np.linalg.norm(loopSegments, axis=1))])
+
+        self.trackLength = float(loopDistances[-1])
+        self.progressDistances = np.arange(0, self.trackLength, self.progressSpacing)
+
+        closedPoints = np.vstack([loopPoints, loopPoints[:1]])
+        self.progressPoints = np.stack([np.interp(self.progressDistances, loopDistances, closedPoints[:, 0]), np.interp(self.progressDistances, loopDistances, closedPoints[:, 1])], axis=1)
+        self.progressSegments = np.roll(self.progressPoints, -1, axis=0) - self.progressPoints
+        self.progressSegmentLengths = np.linalg.norm(self.progressSegments, axis=1)
+        self.progressSegmentSquaredLengths = np.maximum(self.progressSegmentLengths ** 2, 1e-9)
+
+        # The same coordinates in contiguous arrays, which are quicker to gather for many segments at once
+        self.progressPointX, self.progressPointY = self.progressPoints.T.copy()
+        self.progressSegmentX, self.progressSegmentY = self.progressSegments.T.copy()
+
+        # Each segment's start, direction, squared length, distance along the track and length as Python floats for single lookups
+        self.progressSegmentList = np.column_stack([self.progressPoints, self.progressSegments, self.progressSegmentSquaredLengths, self.progressDistances, self.progressSegmentLengths]).tolist()
+
+        # Grid over the track where each cell near the road stores centre line points close to the middle of the cell
+        # Only every few points are considered because lookups search the points either side anyway
+        cellSize = self.progressCellSize
+        self.progressGridWidth = -(-TRACK_WIDTH // cellSize)
+        self.progressGridHeight = -(-TRACK_HEIGHT // cellSize)
+
+        candidateStride = max(cellSize // self.progressSpacing, 1)
+        candidates = np.arange(0, len(self.progressPoints), candidateStride)
+
+        reach = -(-(self.trackWidth + cellSize) // cellSize)
+        cellOffsets = np.arange(-reach, reach + 1)
+
+        candidateCells = (self.progressPoints[candidates] // cellSize).astype(np.int64)
+        cellX = (candidateCells[:, 0, None, None] + cellOffsets[None, :, None]).repeat(len(cellOffsets), axis=2).reshape(-1)
+        cellY = (candidateCells[:, 1, None, None] + cellOffsets[None, None, :]).repeat(len(cellOffsets), axis=1).reshape(-1)
+        pointIndices = candidates.repeat(len(cellOffsets) ** 2)
+
+        inside = (cellX >= 0) & (cellY >= 0) & (cellX < self.progressGridWidth) & (cellY < self.progressGridHeight)
+        pointIndices, cellX, cellY = pointIndices[inside], cellX[inside], cellY[inside]
+
+        squaredDistances = ((cellX + 0.5) * cellSize - self.progressPoints[pointIndices, 0]) ** 2 + ((cellY + 0.5) * cellSize - self.progressPoints[pointIndices, 1]) ** 2
+        cells = cellY * self.progressGridWidth + cellX
+
+        # Enough points either side of a grid point to reach the closest point anywhere in the cell
+        self.progressSearchWidth = int(-(-(cellSize * 1.5 + candidateStride * self.progressSpacing) // self.progressSpacing)) + 1
+
+        # Where the road passes close to itself a cell is near several parts of the centre line, so the candidates are split into
+        # stretches no longer than the search width and the closest candidate of every stretch is kept
+        # Searching either side of each kept point then covers every candidate near the cell, so lookups match a search of the whole line
+        stretches = pointIndices // self.progressSearchWidth
+        order = np.lexsort((squaredDistances, stretches, cells))
+        cells, stretches, pointIndices, distances = cells[order], stretches[order], pointIndices[order], np.sqrt(squaredDistances[order])
+        firsts = np.flatnonzero((np.diff(cells, prepend=-1) != 0) | (np.diff(stretches, prepend=-1) != 0))
+        cells, pointIndices, distances = cells[firsts], pointIndices[firsts], distances[firsts]
+
+        # Stretches can be left out when they are too far from the cell to be closer than the cell's closest stretch for any point in it,
+        # allowing for half a cell diagonal either side of the middle and the gap between candidates
+        cellStarts = np.flatnonzero(np.diff(cells, prepend=-1))
+        closestDistances = np.minimum.reduceat(distances, cellStarts).repeat(np.diff(np.append(cellStarts, len(cells))))
+        near = distances <= closestDistances + cellSize * (math.sqrt(2) + 0.5) + self.progressSpacing
+        cells, pointIndices = cells[near], pointIndices[near]
+
+        # One row of points for each cell, padded with the cell's first point, or -1 for cells far from the road
+        cellStarts = np.flatnonzero(np.diff(cells, prepend=-1))
+        cellCounts = np.diff(np.append(cellStarts, len(cells)))
+        columns = np.arange(len(cells)) - cellStarts.repeat(cellCounts)
+
+        self.progressGrid = np.full((self.progressGridWidth * self.progressGridHeight, cellCounts.max()), -1, dtype=np.int64)
+        self.progressGrid[cells[cellStarts]] = pointIndices[cellStarts, None]
+        self.progressGrid[cells, columns] = pointIndices
+
+        # Progress is measured from the finish line
+        # Checkpoints are centred on centre line points, and each curve's last point was removed from the loop before them
+        checkpointIndices, checkpointSegments = self.getCheckpointIndices(self.curveOffsets)
+        checkpointDistances = loopDistances[checkpointIndices - checkpointSegments]
+
+        self.startDistance = float(checkpointDistances[0])
+        self.checkpointProgresses = (checkpointDistances - self.startDistance) % self.trackLength
+        self.checkpointProgresses[0] = 0
+
+    def getClosestPoints(self, xs, ys, segments):
+        # Which of each position's segments holds its closest point on the centre line, and how far along that segment it is
+        startX = xs[:, None] - self.progressPointX[segments]
+        startY = ys[:, None] - self.progressPointY[segments]
+        segmentX = self.progressSegmentX[segments]
+        segmentY = self.progressSegmentY[segments]
+
+        fractions = np.minimum(np.maximum((startX * segmentX + startY * segmentY) / self.progressSegmentSquaredLengths[segments], 0), 1)
+        squaredDistances = (startX - fractions * segmentX) ** 2 + (startY - fractions * segmentY) ** 2
+
+        rows = np.arange(len(segments))
+        closest = squaredDistances.argmin(axis=1)
+        return segments[rows, closest], fractions[rows, closest]
+
+    def projectOntoCentreLine(self, xs, ys, segments):
+        # Distance along the centre line to the closest point on any of each position's segments
+        closestSegments, closestFractions = self.getClosestPoints(xs, ys, segments)
+        return self.progressDistances[closestSegments] + closestFractions * self.progressSegmentLengths[closestSegments]
+
+    def getSearchSegments(self, xs, ys):
+        # Centre line segments that could hold the closest point to each position
+        cellX = np.clip(xs // self.progressCellSize, 0, self.progressGridWidth - 1).astype(np.int64)
+        cellY = np.clip(ys // self.progressCellSize, 0, self.progressGridHeight - 1).astype(np.int64)
+        nearestPoints = self.progressGrid[cellY * self.progressGridWidth + cellX]
+
+        # Positions far from the road search the whole centre line
+        farAway = np.flatnonzero(nearestPoints[:, 0] < 0)
+        if len(farAway) > 0:
+            squaredDistances = (self.progressPoints[None, :, 0] - xs[farAway, None]) ** 2 + (self.progressPoints[None, :, 1] - ys[farAway, None]) ** 2
+            nearestPoints[farAway] = squaredDistances.argmin(axis=1)[:, None]
+
+        # Every part of the centre line near each position is searched
+        segments = nearestPoints[:, :, None] + np.arange(-self.progressSearchWidth, self.progressSearchWidth + 1)
+        return segments.reshape(len(xs), -1) % len(self.progressPoints)
+
+    def followCentreLine(self, xs, ys, previousProgresses):
+        # Moving cars walk along the centre line from the segment of their last progress until neither neighbour is closer,
+        # so they stay on their own part of the track where it passes close to itself
+        pointCount = len(self.progressPoints)
+        previousDistances = (np.asarray(previousProgresses) + self.startDistance) % self.trackLength
+        previousSegments = (previousDistances // self.progressSpacing).astype(np.int64)
+        segments, fractions = self.getClosestPoints(xs, ys, (previousSegments[:, None] + self.progressWalkOffsets) % pointCount)
+
+        # Most cars stay on their segment or move one along, so only the few that moved are searched again
+        walking = np.flatnonzero(segments != previousSegments)
+        for _ in range(self.progressTrackingWidth - 1):
+            if len(walking) == 0:
+                break
+
+            closestSegments, closestFractions = self.getClosestPoints(xs[walking], ys[walking], (segments[walking, None] + self.progressWalkOffsets) % pointCount)
+
+            moved = closestSegments != segments[walking]
+            segments[walking] = closestSegments
+            fractions[walking] = closestFractions
+            walking = walking[moved]
+
+        return self.progressDistances[segments] + fractions * self.progressSegmentLengths[segments]
+
+    def getProgresses(self, xs, ys, previousProgresses=None):
+        # Distance along the track from the finish line for each position
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+
+        if previousProgresses is None:
+            distances = self.projectOntoCentreLine(xs, ys, self.getSearchSegments(xs, ys))
+        else:
+            distances = self.followCentreLine(xs, ys, previousProgresses)
+
+        return (distances - self.startDistance) % self.trackLength
+
+    def getProgress(self, position, previousProgress=None):
+        if previousProgress is None:
+            return float(self.getProgresses([position[0]], [position[1]])[0])
+
+        # Same walk as followCentreLine for a single moving car, which is quicker without NumPy
+        x, y = position
+        pointCount = len(self.progressSegmentList)
+        segment = int(((previousProgress + self.startDistance) % self.trackLength) // self.progressSpacing) % pointCount
+
+        for _ in range(self.progressTrackingWidth):
+            walkedFrom = segment
+            closestSquaredDistance = math.inf
+
+            for offset in self.progressWalkOffsets:
+                neighbour = (walkedFrom + offset) % pointCount
+                pointX, pointY, segmentX, segmentY, squaredLength, _, _ = self.progressSegmentList[neighbour]
+
+                startX = x - pointX
+                startY = y - pointY
+                fraction = min(max((startX * segmentX + startY * segmentY) / squaredLength, 0), 1)
+
+                differenceX = startX - fraction * segmentX
+                differenceY = startY - fraction * segmentY
+                squaredDistance = differenceX * differenceX + differenceY * differenceY
+
+                if squaredDistance < closestSquaredDistance:
+                    closestSquaredDistance = squaredDistance
+                    segment = neighbour
+                    closestFraction = fraction
+
+            if segment == walkedFrom:
+                break
+
+        _, _, _, _, _, distance, length = self.progressSegmentList[segment]
+        return (distance + closestFraction * length - self.startDistance) % self.trackLength
+
+    def getProgressChange(self, previousProgress, progress):
+        # Signed distance moved along the track, allowing for crossing the finish line in either direction
+        return (progress - previousProgress + self.trackLength / 2) % self.trackLength - self.trackLength / 2
+
+    def checkCheckpointPassed(self, progress, checkpointIndex):
+        # A checkpoint has been passed once the car is less than half the track ahead of it
+        return (progress - self.checkpointProgresses[checkpointIndex]) % self.trackLength < self.trackLength / 2
+
+    def getWallArray(self):
+        # Converting the mask into a (height, width) boolean array where walls are True, kept in row order so rows can be read quickly
+        maskSurface = self.mask.to_surface(setcolor=(255, 255, 255, 255), unsetcolor=(0, 0, 0, 0))
+        return pygame.surfarray.pixels_alpha(maskSurface).T > 0
+
+    def getDistanceField(self):
+        # Euclidean distance from every pixel to the nearest wall pixel, capped at maxFieldDistance
+        # Past the edges of the track surface counts as wall, as it does for sensors, so the walls get a border a pixel wide
+        walls = np.pad(self.getWallArray(), 1, constant_values=True)
+        height, width = walls.shape
+        cap = self.maxFieldDistance
+        distanceField = np.zeros((height, width), dtype=np.uint8)
+
+        # Everything outside the bounding box of the road is wall, so only the box and the walls just around it need working out
+        roadRows = np.flatnonzero(~walls.all(axis=1))
+        roadColumns = np.flatnonzero(~walls.all(axis=0))
+        if len(roadRows) == 0:
+            return np.ascontiguousarray(distanceField[1:-1, 1:-1])
+
+        top, bottom = roadRows[0] - 1, roadRows[-1] + 2
+        left, right = roadColumns[0] - 1, roadColumns[-1] + 2
+        walls = walls[top:bottom, left:right]
+        height, width = walls.shape
+
+        # Down each column, the lower envelope of the parabolas (row - vertex)^2 + rowDistance(vertex)^2 (Felzenszwalb and Huttenlocher), done for every column at once
+        # Rows more than the cap apart never matter, so each envelope only keeps its last parabolas in a ring of at least 2 * cap + 2, stored in flat arrays indexed by slot * width + column
+        # Vertices and values are whole numbers below 2^24 so float32 holds them exactly, and rounded boundaries only change which of two tied parabolas is used
+        depth = 1 << (2 * cap + 1).bit_length()
+        ringMask = depth - 1
+        columns = np.arange(width, dtype=np.int32)
+        vertices = np.full(depth * width, -np.inf, dtype=np.float32)
+        values = np.zeros(depth * width, dtype=np.float32)
+        boundaries = np.full(depth * width, -np.inf, dtype=np.float32)
+        firstEntries = np.zeros(width, dtype=np.int32)
+        lastEntries = np.full(width, -1, dtype=np.int32)
+
+        for row in range(height + cap):
+            if row < height:
+                # Distance to the nearest wall along the row, using running maximums of the wall columns from both directions
+                previousWall = np.where(walls[row], columns, -width)
+                nextWall = np.where(walls[row, ::-1], columns, -width)
+                np.maximum.accumulate(previousWall, out=previousWall)
+                np.maximum.accumulate(nextWall, out=nextWall)
+                rowDistances = np.minimum(columns - previousWall, (columns - nextWall)[::-1])
+                np.minimum(rowDistances, cap, out=rowDistances)
+                rowValues = rowDistances * rowDistances + row * row
+
+                # Remove the parabolas hidden by the new one, only revisiting the columns that still have hidden parabolas
+                slots = (lastEntries & ringMask) * width + columns
+                intersections = (rowValues - values.take(slots)) / (2 * row - vertices.take(slots))
+                hiddenColumns = np.flatnonzero((intersections <= boundaries.take(slots)) & (lastEntries >= firstEntries))
+                while len(hiddenColumns) > 0:
+                    lastEntries[hiddenColumns] -= 1
+
+                    hiddenSlots = (lastEntries[hiddenColumns] & ringMask) * width + hiddenColumns
+                    intersections[hiddenColumns] = (rowValues[hiddenColumns] - values.take(hiddenSlots)) / (2 * row - vertices.take(hiddenSlots))
+
+                    stillHidden = (intersections[hiddenColumns] <= boundaries.take(hiddenSlots)) & (lastEntries[hiddenColumns] >= firstEntries[hiddenColumns])
+                    hiddenColumns = hiddenColumns[stillHidden]
+
+                lastEntries += 1
+                slots = (lastEntries & ringMask) * width + columns
+                vertices[slots] = 2 * row
+                values[slots] = rowValues
+                boundaries[slots] = intersections
+
+            # Each row is read cap rows behind, once every parabola that could reach it has been added
+            fieldRow = row - cap
+            if fieldRow < 0:
+                continue
+
+            # Moving past parabolas that the next one beats by this row, or that are further away than the cap
+            passedColumns = np.flatnonzero(lastEntries > firstEntries)
+            while len(passedColumns) > 0:
+                firstSlots = (firstEntries[passedColumns] & ringMask) * width + passedColumns
+                nextSlots = ((firstEntries[passedColumns] + 1) & ringMask) * width + passedColumns
+                passed = (boundaries.take(nextSlots) <= fieldRow) | (vertices.take(firstSlots) < 2 * (fieldRow - cap))
+
+                passedColumns = passedColumns[passed]
+                firstEntries[passedColumns] += 1
+                passedColumns = passedColumns[lastEntries[passedColumns] > firstEntries[passedColumns]]
+
+            slots = (firstEntries & ringMask) * width + columns
+            boundaries[slots] = -np.inf
+            squaredDistances = values.take(slots) - fieldRow * vertices.take(slots) + fieldRow * fieldRow
+
+            # Rounding down so the field never overestimates how far away a wall is
+            distanceField[top + fieldRow, left:right] = np.minimum(np.floor(np.sqrt(squaredDistances)), cap)
+
+        return np.ascontiguousarray(distanceField[1:-1, 1:-1])
+
+    def castRay(self, position, angle, maxDistance):
+        # Sphere tracing: the distance field says how far the ray can safely jump without passing through a wall
+        if instrumentation.enabled:
+            instrumentation.addCount("raycasts")
+
+        directionX = math.cos(angle)
+        directionY = math.sin(angle)
+
+        width, height = self.mask.get_size()
+        field = self.distanceFieldBuffer
+
+        distance = 0
+        while distance < maxDistance:
+            x = int(position[0] + directionX * distance)
+            y = int(position[1] + directionY * distance)
+
+            # Treat leaving the track surface as hitting a wall
+            if x < 0 or y < 0 or x >= width or y >= height:
+                return distance
+
+            step = field[y * width + x]
+            if step == 0:
+                return distance
+
+            # Stepping one pixel less than the field allows because the ray position is not at the centre of the pixel
+            distance += max(step - 1, 1)
+
+        return maxDistance
+
+    def castRays(self, xs, ys, angles, maxDistance):
+        # Batched version of castRay that keeps stepping every ray that has not hit a wall yet
+        if instrumentation.enabled:
+            instrumentation.addCount("raycasts", len(angles))
+
+        directionX = np.cos(angles)
+        directionY = np.sin(angles)
+
+        distances = np.zeros(len(angles))
+        activeRays = np.arange(len(angles))
+
+        while len(activeRays) > 0:
+            activeDistances = distances[activeRays]
+            x = (xs[activeRays] + directionX[activeRays] * activeDistances).astype(np.int64)
+            y = (ys[activeRays] + directionY[activeRays] * activeDistances).astype(np.int64)
+
+            steps = self.getWallDistances(x, y).astype(np.int64)
+            activeDistances += np.maximum(steps - 1, 1)
+
+            # Rays that hit a wall keep their distance, the others move on
+            moving = steps > 0
+            distances[activeRays[moving]] = activeDistances[moving]
+            activeRays = activeRays[moving & (activeDistances < maxDistance)]
+
+        return np.minimum(distances, maxDistance)
+
     def getOverlap(self, x, y, mask):
+        if instrumentation.enabled:
+            instrumentation.addCount("overlaps")
+
         overlap = self.mask.overlap(mask, (x, y))
         return overlap
 
     def checkCollideAtPoint(self, position):
         return self.mask.get_at(position)
 
+    def getWallDistances(self, xs, ys):
+        # Distance field values for many points at once, points off the track surface have a distance of 0
+        height, width = self.distanceField.shape
+        inside = (xs >= 0) & (ys >= 0) & (xs < width) & (ys < height)
+
+        distances = self.distanceField.take(ys * width + xs, mode="clip")
+        distances[~inside] = 0
+
+        return distances
+
+    def checkCollideAtPoints(self, xs, ys):
+        # Batched version of checkCollideAtPoint using the distance field, where walls have a distance of 0
+        height, width = self.distanceField.shape
+        inside = (xs >= 0) & (ys >= 0) & (xs < width) & (ys < height)
+
+        # Points off the track surface do not collide, the same as masks overlapping the edge of the track mask
+        return (self.distanceField.take(ys * width + xs, mode="clip") == 0) & inside
+
     def getFilePath(self):
         return self.filePath or ""
 
@@ -213,6 +836,8 @@ class Track:
         with open(f"{TRACKS_PATH}/{filePath}.json", "w") as file:
             json.dump(output, file)
 
+        self.filePath = filePath
+
     def importTrack(self, filePath):
         with open(f"{TRACKS_PATH}/{filePath}.json", "r") as file:
             data = json.load(file)
@@ -227,5 +852,57 @@ class Track:
             self.trackWidth = data["TrackWidth"]
             self.trackColour = data["TrackColour"]
     
+    def buildTiles(self):
+        # Tiles with no road are left out, tiles covered by road are opaque and the rest use a colour key
+        # The road is either fully opaque or fully transparent, so a colour key gives the same picture as blending with alpha but is much faster to blit
+        convertTiles = pygame.display.get_surface() is not None
+        tileArea = self.tileSize * self.tileSize
+        keyColour = next(colour for colour in [(255, 0, 255), (0, 255, 0), (0, 0, 255)] if colour not in [tuple(self.trackColour[:3]), tuple(self.finishLineColour[:3])])
+
+        self.tiles = []
+        for y in range(0, TRACK_HEIGHT, self.tileSize):
+            row = []
+            for x in range(0, TRACK_WIDTH, self.tileSize):
+                tileRect = pygame.Rect(x, y, self.tileSize, self.tileSize).clip(self.trackSurface.get_rect())
+                tile = self.trackSurface.subsurface(tileRect)
+                roadPixels = pygame.mask.from_surface(tile).count()
+
+                if roadPixels == 0:
+                    row.append(None)
+                    continue
+
+                keyedTile = pygame.Surface(tileRect.size)
+                keyedTile.fill(keyColour)
+                keyedTile.blit(tile, (0, 0))
+
+                if roadPixels < tileArea:
+                    keyedTile.set_colorkey(keyColour, pygame.RLEACCEL)
+
+                # Converting to the display format when there is a window makes blitting the tiles much faster
+                row.append(keyedTile.convert() if convertTiles else keyedTile)
+
+            self.tiles.append(row)
+
     def draw(self, screen, offset):
-        screen.blit(self.trackSurface, (-offset, (TRACK_WIDTH, TRACK_HEIGHT)))
\ No newline at end of file
+        if self.tiles is None:
+            self.buildTiles()
+
+        # Position of the top left of the track on the screen, rounded the same way as a Rect
+        trackPosition = pygame.Rect(-offset, (TRACK_WIDTH, TRACK_HEIGHT))
+        screenWidth, screenHeight = screen.get_size()
+
+        # Only the tiles that overlap the screen
+        firstColumn = max(-trackPosition.x // self.tileSize, 0)
+        lastColumn = min((screenWidth - trackPosition.x - 1) // self.tileSize, len(self.tiles[0]) - 1)
+        firstRow = max(-trackPosition.y // self.tileSize, 0)
+        lastRow = min((screenHeight - trackPosition.y - 1) // self.tileSize, len(self.tiles) - 1)
+
+        visibleTiles = []
+        for row in range(firstRow, lastRow + 1):
+            for column in range(firstColumn, lastColumn + 1):
+                tile = self.tiles[row][column]
+
+                if tile is not None:
+                    visibleTiles.append((tile, (trackPosition.x + column * self.tileSize, trackPosition.y + row * self.tileSize)))
+
+        screen.blits(visibleTiles, doreturn=False)
\ No newline at end of file
@@ -0,0 +1,142 @@
+import multiprocessing
+import pygame
+
+pygame.init()
+
+from config import FPS, SCREEN_WIDTH, SCREEN_HEIGHT, COLOUR_SCHEME, RED_CAR_IMAGE, BUTTON_BORDER_THICKNESS, BUTTON_HOVER_THICKNESS, NETWORK_INPUT_SIZE, NETWORK_ACTION_SIZE, MAX_VISUALISATION_TIME, FONT_32, FONT_64
+from gui import TextLabel, Button, TrackOverview, formatStopWatch
+from cars import CarAgent, buildRotationCaches
+from modelNumpy import NeuralNetwork, InferenceEngine
+from track import Track
+
+def runViewer(connection, trackPath):
+    # The viewer has its own window and clock, and keeps driving the newest policy it has been sent while training carries on
+    # Policies arrive as NumPy weights, so the viewer never has to import torch
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    pygame.display.set_caption("Training Visualisation")
+    clock = pygame.time.Clock()
+
+    track = Track(trackPath)
+    track.initialiseTrack()
+
+    buildRotationCaches([RED_CAR_IMAGE])
+    spawnPoint, spawnAngle = track.getSpawnPosition()
+
+    trackOverview = TrackOverview(0, 0, 1, 1, track)
+    skipButton = Button(0.88, 0.88, 0.1, 0.1, "Skip", FONT_32, COLOUR_SCHEME[0], COLOUR_SCHEME[1], COLOUR_SCHEME[0], BUTTON_BORDER_THICKNESS, BUTTON_HOVER_THICKNESS)
+    endTrainingButton = Button(0.76, 0.88, 0.1, 0.1, "End Training", FONT_32, COLOUR_SCHEME[0], COLOUR_SCHEME[1], COLOUR_SCHEME[0], BUTTON_BORDER_THICKNESS, BUTTON_HOVER_THICKNESS)
+    stopWatchLabel = TextLabel(0, 0, 0.05, 0.05, formatStopWatch(0), FONT_32, COLOUR_SCHEME[1])
+    waitingLabel = TextLabel(0, 0, 1, 1, "Waiting for the first policy", FONT_64, COLOUR_SCHEME[0])
+
+    elements = [skipButton, endTrainingButton]
+
+    policyWeights = None
+    agentCar = None
+    deltaTime = 1 / FPS
+    stopWatchTime = 0
+
+    # Tell the trainer it can send the first policy
+    connection.send("ready")
+
+    while True:
+        # Only the newest policy is kept, and the trainer waits for each one to be received before sending another
+        while connection.poll():
+            message = connection.recv()
+            if message is None:
+                connection.close()
+                pygame.quit()
+                return
+
+            policyWeights = message
+            connection.send("ready")
+
+        # Start a new episode with the newest policy whenever the last one has ended
+        if agentCar is None and policyWeights is not None:
+            policyNet = NeuralNetwork(NETWORK_INPUT_SIZE, NETWORK_ACTION_SIZE)
+            policyNet.loadWeights(*policyWeights)
+
+            agentCar = CarAgent(spawnPoint.x, spawnPoint.y, spawnAngle, RED_CAR_IMAGE, track, InferenceEngine(policyNet), False)
+
+            stopWatchTime = 0
+            deltaTime = 1 / FPS
+            clock.tick(FPS)
+
+        hoveredElement = None
+        for element in elements:
+            if element.updateHovered(pygame.mouse.get_pos()):
+                hoveredElement = element
+
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                connection.send("quit")
+            elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                if hoveredElement == skipButton:
+                    agentCar = None
+                elif hoveredElement == endTrainingButton:
+                    connection.send("endTraining")
+
+        if agentCar is not None:
+            crashed = agentCar.update(deltaTime)
+
+            if crashed or agentCar.lap > 1 or stopWatchTime > MAX_VISUALISATION_TIME:
+                agentCar = None
+
+        trackOverview.draw(screen, agentCar)
+
+        if agentCar is not None:
+            stopWatchLabel.updateText(formatStopWatch(stopWatchTime))
+            stopWatchLabel.draw(screen)
+        elif policyWeights is None:
+            waitingLabel.draw(screen)
+
+        for element in elements:
+            element.draw(screen)
+
+        pygame.display.flip()
+
+        deltaTime = clock.tick(FPS) / 1000
+        stopWatchTime += deltaTime
+
+class Viewer:
+    def __init__(self, trackPath):
+        # Spawning a fresh process instead of forking so the viewer does not inherit the game window
+        context = multiprocessing.get_context("spawn")
+
+        self.connection, viewerConnection = context.Pipe()
+        self.process = context.Process(target=runViewer, args=(viewerConnection, trackPath), daemon=True)
+        self.process.start()
+
+        self.ready = False
+        self.pendingWeights = None
+
+    def sendPolicy(self, policyWeights):
+        # The newest policy's NumPy weights and biases replace any that the viewer has not been ready for yet
+        self.pendingWeights = policyWeights
+        self.sendPendingPolicy()
+
+    def sendPendingPolicy(self):
+        # Only sending once the viewer has received the last policy, so training never waits on a full pipe
+        if self.ready and self.pendingWeights is not None:
+            self.connection.send(self.pendingWeights)
+
+            self.ready = False
+            self.pendingWeights = None
+
+    def getRequests(self):
+        # Button presses sent back from the viewer since the last check
+        requests = []
+        while self.connection.poll():
+            message = self.connection.recv()
+
+            if message == "ready":
+                self.ready = True
+            else:
+                requests.append(message)
+
+        self.sendPendingPolicy()
+
+        return requests
+
+    def close(self):
+        self.connection.send(None)
+        self.process.join()